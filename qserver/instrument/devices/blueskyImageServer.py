@@ -2,15 +2,54 @@
 
 import argparse
 import logging
-import matplotlib.pyplot as plt
 import numpy as np
 import pvaccess as pva
 import random
 import time
 
+try:
+    from .frame_reductions import preview_frame
+    from .frame_reductions import reduce_frame
+    from .image_readers import DEFAULT_CACHE_BYTES
+    from .image_readers import FrameCache
+except ImportError:  # run as a script
+    from frame_reductions import preview_frame
+    from frame_reductions import reduce_frame
+    from image_readers import DEFAULT_CACHE_BYTES
+    from image_readers import FrameCache
+
 __version__ = pva.__version__
 logger = logging.getLogger(__name__)
 
+# per-frame reductions (see frame_reductions.reduce_frame), a compact struct
+REDUCTION_SCHEMA = {
+    "uniqueId": pva.ULONG,
+    "timeStamp": {
+        "secondsPastEpoch": pva.LONG,
+        "nanoseconds": pva.INT,
+        "userTag": pva.INT,
+    },
+    "total": pva.DOUBLE,
+    "maximum": pva.DOUBLE,
+    "centroid_x": pva.DOUBLE,
+    "centroid_y": pva.DOUBLE,
+    "sigma_x": pva.DOUBLE,
+    "sigma_y": pva.DOUBLE,
+    "fwhm_x": pva.DOUBLE,
+    "fwhm_y": pva.DOUBLE,
+    "projection_x": [pva.DOUBLE],
+    "projection_y": [pva.DOUBLE],
+    "roi_sums": [pva.DOUBLE],
+}
+
+
+def reduction_pv_object(reduction, uniqueId, ts=None):
+    """PVA object (REDUCTION_SCHEMA) of one frame's reductions."""
+    pv = pva.PvObject(REDUCTION_SCHEMA, dict(reduction, uniqueId=uniqueId))
+    if ts is not None:
+        pv["timeStamp"] = ts
+    return pv
+
 
 def rng(start=0, end=1000, precision=0.01):
     """
@@ -37,7 +76,18 @@ class BlueskyImageServer(pva.PvaServer):
         np.dtype("float64"): "doubleValue",
     }
 
-    def __init__(self, channelName, extraFieldsTypeDict={}):
+    def __init__(
+        self,
+        channelName,
+        extraFieldsTypeDict={},
+        cacheBytes=DEFAULT_CACHE_BYTES,
+        previewChannelName=None,
+        previewBinning=4,
+        previewRoi=None,
+        previewDecimation=1,
+        reductionChannelName=None,
+        reductionRois=None,
+    ):
         pva.PvaServer.__init__(self)
         self.channelName = channelName
         # Extra fields could be added to image, e.g.
@@ -48,6 +98,24 @@ class BlueskyImageServer(pva.PvaServer):
         self.extraFieldsTypeDict = extraFieldsTypeDict
         self.addRecord(self.channelName, pva.NtNdArray(extraFieldsTypeDict))
         self.frameId = 0
+        # decoded image files, re-used when the same file is published again
+        self.frameCache = FrameCache(cacheBytes)
+
+        # Optional low-resolution (binned and/or ROI) copy of each frame
+        # for light clients.  Published every 'previewDecimation' frames.
+        self.previewChannelName = previewChannelName
+        self.previewBinning = previewBinning
+        self.previewRoi = previewRoi
+        self.previewDecimation = max(1, int(previewDecimation))
+        if self.previewChannelName is not None:
+            self.addRecord(self.previewChannelName, pva.NtNdArray({}))
+
+        # Optional per-frame reductions (total, centroid, projections,
+        # ROI sums, ...) of every frame, for feedback clients.
+        self.reductionChannelName = reductionChannelName
+        self.reductionRois = reductionRois or []
+        if self.reductionChannelName is not None:
+            self.addRecord(self.reductionChannelName, pva.PvObject(REDUCTION_SCHEMA))
 
     def getTimestamp(self):
         s = time.time()
@@ -57,20 +125,29 @@ class BlueskyImageServer(pva.PvaServer):
 
     def updateImage(self, inputFile, extraFieldsValueDict={}):
         logger.info(f"Reading input file: {inputFile}")
-        data = plt.imread(inputFile)
+        data = self.frameCache.get(inputFile)
         self.updateFrame(data, extraFieldsValueDict=extraFieldsValueDict)
         logger.info(f"Published image {self.frameId} from: {inputFile}")
 
-    def updateFrame(self, image_frame, extraFieldsValueDict={}):
-        logger.info(f"image frame shape: {image_frame.shape}")
-        data = image_frame
+    def updateImages(self, inputFiles, extraFieldsValueDict={}, readAhead=4):
+        """Publish each of the input files, decoding the next ones ahead."""
+        inputFiles = list(inputFiles)
+        self.prefetch(inputFiles[:readAhead])
+        for i, inputFile in enumerate(inputFiles):
+            self.prefetch(inputFiles[i + readAhead : i + readAhead + 1])
+            self.updateImage(inputFile, extraFieldsValueDict=extraFieldsValueDict)
+
+    def prefetch(self, inputFiles):
+        """Decode these input files (in a read-ahead thread) before they are needed."""
+        self.frameCache.prefetch(inputFiles)
+
+    def buildFrame(self, data, uniqueId, ts, attrs, extraFieldsTypeDict={}):
+        """Build the NTNDArray PVA object for one frame."""
         rows, cols = data.shape
         size = rows * cols * data.itemsize
 
-        self.frameId += 1
-        frame = pva.NtNdArray(self.extraFieldsTypeDict)
-
-        frame["uniqueId"] = self.frameId
+        frame = pva.NtNdArray(extraFieldsTypeDict)
+        frame["uniqueId"] = uniqueId
         dims = [
             pva.PvDimension(cols, 0, cols, 1, False),
             pva.PvDimension(rows, 0, rows, 1, False),
@@ -78,22 +155,56 @@ class BlueskyImageServer(pva.PvaServer):
         frame["dimension"] = dims
         frame["compressedSize"] = size
         frame["uncompressedSize"] = size
-        ts = self.getTimestamp()
         frame["timeStamp"] = ts
         frame["dataTimeStamp"] = ts
         frame["descriptor"] = "Bluesky Image"
         pvaTypeKey = self.PVA_TYPE_KEY_MAP.get(data.dtype)
         frame["value"] = {pvaTypeKey: data.flatten()}
+        frame["attribute"] = attrs
+        return frame
+
+    def updateFrame(self, image_frame, extraFieldsValueDict={}):
+        logger.info(f"image frame shape: {image_frame.shape}")
+        self.frameId += 1
+        ts = self.getTimestamp()
         attrs = [
             pva.NtAttribute("ColorMode", pva.PvInt(0)),
             pva.NtAttribute("ImageGoal", pva.PvString("M6 demo")),
             pva.NtAttribute("pos_x", pva.PvDouble(rng())),
             pva.NtAttribute("pos_y", pva.PvDouble(rng())),
         ]
-        frame["attribute"] = attrs
+        frame = self.buildFrame(
+            image_frame, self.frameId, ts, attrs, self.extraFieldsTypeDict
+        )
         if extraFieldsValueDict:
             frame.set(extraFieldsValueDict)
-        self.update(frame)
+        self.update(self.channelName, frame)
+        self.updatePreview(image_frame, ts, attrs)
+        self.updateReduction(image_frame, ts)
+
+    def updatePreview(self, image_frame, ts, attrs):
+        """Publish the binned/ROI preview of the current frame (if enabled)."""
+        if self.previewChannelName is None:
+            return
+        if self.frameId % self.previewDecimation != 0:
+            return
+        data = preview_frame(image_frame, self.previewBinning, self.previewRoi)
+        attrs = attrs + [
+            pva.NtAttribute("PreviewBinning", pva.PvInt(int(self.previewBinning))),
+        ]
+        self.update(
+            self.previewChannelName, self.buildFrame(data, self.frameId, ts, attrs)
+        )
+
+    def updateReduction(self, image_frame, ts):
+        """Publish the reductions of the current frame (if enabled)."""
+        if self.reductionChannelName is None:
+            return
+        reduction = reduce_frame(image_frame, self.reductionRois)
+        self.update(
+            self.reductionChannelName,
+            reduction_pv_object(reduction, self.frameId, ts),
+        )
 
 
 def main():
@@ -104,9 +215,10 @@ def main():
         "--input-file",
         "-if",
         type=str,
+        nargs="+",
         dest="input_file",
-        default=None,
-        help="Input file to be delivered over PVA",
+        default=[],
+        help="Input file(s) to be delivered over PVA",
     )
     parser.add_argument(
         "--channel-name",
@@ -116,6 +228,30 @@ def main():
         default="bluesky:image",
         help="Server PVA channel name (default: bluesky:image)",
     )
+    parser.add_argument(
+        "--preview-channel-name",
+        "-pcn",
+        type=str,
+        dest="preview_channel_name",
+        default=None,
+        help="Preview (binned) PVA channel name (default: no preview)",
+    )
+    parser.add_argument(
+        "--preview-binning",
+        "-pb",
+        type=int,
+        dest="preview_binning",
+        default=4,
+        help="Preview binning factor (default: 4)",
+    )
+    parser.add_argument(
+        "--reduction-channel-name",
+        "-rcn",
+        type=str,
+        dest="reduction_channel_name",
+        default=None,
+        help="Per-frame reductions PVA channel name (default: none)",
+    )
     parser.add_argument(
         "-v",
         "--version",
@@ -127,10 +263,15 @@ def main():
     if len(unparsed) > 0:
         raise RuntimeError(f"Unrecognized argument(s): {' '.join(unparsed)}")
 
-    server = BlueskyImageServer(args.channel_name)
+    server = BlueskyImageServer(
+        args.channel_name,
+        previewChannelName=args.preview_channel_name,
+        previewBinning=args.preview_binning,
+        reductionChannelName=args.reduction_channel_name,
+    )
 
     server.start()
-    server.updateImage(args.input_file)
+    server.updateImages(args.input_file)
     time.sleep(60)
     server.stop()
 
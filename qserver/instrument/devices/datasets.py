@@ -0,0 +1,312 @@
+"""
+Registry of image & position datasets, named in iconfig.yml.
+
+Example ``iconfig.yml`` entry::
+
+    DATASETS:
+      fly001:
+        images: /gdata/bdp/henke/fly001_uint16.npy
+        positions: /gdata/bdp/henke/fly001_pos.csv
+        config: /gdata/bdp/henke/ptychodus.ini
+
+Images may be:
+
+* a NumPy ``.npy`` file (memory-mapped),
+* a chunked HDF5 file (``.h5``, ``.hdf5``, ``.nxs``; set ``images_path``
+  to the dataset within the file, default ``/entry/data/data``),
+* a stack of TIFF files (a directory or a glob pattern, sorted by name),
+* ``synthetic`` (see :mod:`synthetic_frames`, other keys are passed on).
+
+Frames are streamed by chunk: reading frames in sequence loads whole
+chunks and a read-ahead thread loads the next chunk(s) in the background.
+
+Positions (CSV: ``y, x`` per frame) are parsed once into a binary ``.npz``
+cache, regenerated only when the CSV file changes.
+"""
+
+__all__ = """
+    Dataset
+    dataset_names
+    load_positions
+    open_dataset
+""".split()
+
+import hashlib
+import logging
+import numpy as np
+import pathlib
+import threading
+
+from .. import iconfig
+from .image_readers import read_image
+from .synthetic_frames import SyntheticFrames
+from .synthetic_frames import SyntheticPositions
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CHUNK_SIZE = 64  # frames
+DEFAULT_HDF5_PATH = "/entry/data/data"
+DEFAULT_READ_AHEAD = 2  # chunks
+HDF5_SUFFIXES = (".h5", ".hdf5", ".hdf", ".nxs")
+POSITIONS_CACHE_DIR = pathlib.Path.home() / ".cache" / "bdp_controls"
+
+
+def dataset_names():
+    """Names of the datasets in the registry."""
+    return list(iconfig.get("DATASETS", {}))
+
+
+class ChunkedFrames:
+    """
+    Array-like access to frames, read by chunk with read-ahead.
+
+    ``read(start, stop)`` returns frames ``start .. stop`` as an array.
+    Frames read in sequence are loaded chunk by chunk, the following
+    'read_ahead' chunks are loaded in a background thread.  Random
+    access reads single frames.
+
+    Supports ``len()``, integer indexing, ``shape`` and ``dtype``.
+    """
+
+    def __init__(
+        self,
+        read,
+        shape,
+        dtype,
+        chunk_size=DEFAULT_CHUNK_SIZE,
+        read_ahead=DEFAULT_READ_AHEAD,
+    ):
+        self.read = read
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        self.chunk_size = max(1, int(chunk_size))
+        self.read_ahead = read_ahead
+        self._chunks = {}  # chunk number: frames
+        self._loading = {}  # chunk number: threading.Event
+        self._last_chunk = None
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return self.shape[0]
+
+    @property
+    def n_chunks(self):
+        return -(-len(self) // self.chunk_size)
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(f"Frame {i} is out of range (0..{len(self) - 1}).")
+        k, offset = divmod(i, self.chunk_size)
+        with self._lock:
+            sequential = self._last_chunk is None or k in (
+                self._last_chunk - 1,
+                self._last_chunk,
+                self._last_chunk + 1,
+            )
+            chunk = self._chunks.get(k)
+            loading = self._loading.get(k)
+        if chunk is None and loading is not None:
+            loading.wait()
+            with self._lock:
+                chunk = self._chunks.get(k)
+        if chunk is None:
+            if not sequential:  # random access
+                with self._lock:
+                    self._last_chunk = k  # reads from here on are sequential
+                return self.read(i, i + 1)[0]
+            chunk = self._load(k)
+        self._advance(k)
+        return chunk[offset]
+
+    def _load(self, k):
+        start = k * self.chunk_size
+        chunk = np.asarray(self.read(start, min(start + self.chunk_size, len(self))))
+        with self._lock:
+            self._chunks[k] = chunk
+        return chunk
+
+    def _advance(self, k):
+        """Now reading chunk 'k': drop chunks out of reach, read ahead."""
+        with self._lock:
+            last = self._last_chunk
+            if last is not None and last - 1 <= k <= last:
+                return  # same chunk (or the one before: threads out of order)
+            self._last_chunk = k
+            keep = range(k - 1, k + 1 + self.read_ahead)
+            for old in [c for c in self._chunks if c not in keep]:
+                del self._chunks[old]
+            ahead = [
+                c
+                for c in range(k + 1, min(k + 1 + self.read_ahead, self.n_chunks))
+                if c not in self._chunks and c not in self._loading
+            ]
+            for c in ahead:
+                self._loading[c] = threading.Event()
+        for c in ahead:
+            threading.Thread(target=self._read_ahead, args=(c,), daemon=True).start()
+
+    def _read_ahead(self, k):
+        try:
+            self._load(k)
+        except Exception as exc:
+            logger.warning("Read-ahead of chunk %d failed: %s", k, exc)
+        finally:
+            with self._lock:
+                event = self._loading.pop(k)
+            event.set()
+
+
+def npy_frames(path, **kwargs):
+    """Frames from a memory-mapped ``.npy`` file."""
+    array = np.load(path, mmap_mode="r")
+    # copy: a slice of the memory map is only a view, nothing would be read
+    frames = ChunkedFrames(
+        lambda a, b: np.array(array[a:b]), array.shape, array.dtype, **kwargs
+    )
+    frames.array = array  # direct (memory-mapped) access
+    return frames
+
+
+def hdf5_frames(path, images_path=DEFAULT_HDF5_PATH, **kwargs):
+    """Frames from a (chunked) HDF5 dataset."""
+    import h5py
+
+    dataset = h5py.File(path, "r")[images_path]
+    if dataset.chunks is not None:
+        kwargs.setdefault("chunk_size", dataset.chunks[0])  # read whole chunks
+    return ChunkedFrames(lambda a, b: dataset[a:b], dataset.shape, dataset.dtype, **kwargs)
+
+
+def tiff_stack_frames(pattern, **kwargs):
+    """Frames from TIFF files (a directory or glob pattern), sorted by name."""
+    path = pathlib.Path(pattern)
+    if path.is_dir():
+        files = sorted(path.glob("*.tif*"))
+    else:
+        files = sorted(path.parent.glob(path.name))
+    if len(files) == 0:
+        raise FileNotFoundError(f"No TIFF files match {pattern}")
+    first = read_image(files[0])
+
+    def read(a, b):
+        return np.stack([read_image(f) for f in files[a:b]])
+
+    return ChunkedFrames(read, (len(files), *first.shape), first.dtype, **kwargs)
+
+
+def open_frames(images, **kwargs):
+    """Open the frames of a dataset (by file type)."""
+    suffix = pathlib.Path(images).suffix.lower()
+    if suffix == ".npy":
+        return npy_frames(images, **kwargs)
+    if suffix in HDF5_SUFFIXES:
+        return hdf5_frames(images, **kwargs)
+    return tiff_stack_frames(images, **kwargs)
+
+
+def _parse_positions_csv(csv_file):
+    """Parse (y, x) positions from CSV, skipping a header line if present."""
+    with open(csv_file) as f:
+        first = f.readline()
+    try:
+        [float(v) for v in first.split(",")]
+        skip = 0
+    except ValueError:
+        skip = 1  # header
+    return np.loadtxt(csv_file, delimiter=",", skiprows=skip, ndmin=2)
+
+
+def _positions_caches(csv_file):
+    """Cache files to try: beside the CSV, then in the user's cache."""
+    key = hashlib.sha1(str(csv_file).encode()).hexdigest()[:16]  # full path
+    return [
+        csv_file.parent / f"{csv_file.name}.npz",
+        POSITIONS_CACHE_DIR / f"{csv_file.stem}_{key}.npz",
+    ]
+
+
+def load_positions(csv_file):
+    """
+    Return positions (float array) from 'csv_file', using a binary cache.
+
+    The cache (``<csv_file>.npz``, or in ``~/.cache/bdp_controls``, keyed
+    by the full path, if the data directory is not writable) records the
+    CSV's mtime and size.  It is regenerated when either changes.
+    """
+    csv_file = pathlib.Path(csv_file).resolve()
+    stat = csv_file.stat()
+    source = np.array([stat.st_mtime_ns, stat.st_size], dtype=np.int64)
+    candidates = _positions_caches(csv_file)
+    for cache in candidates:
+        try:
+            with np.load(cache) as npz:
+                if np.array_equal(npz["source"], source):
+                    return npz["positions"]
+        except (OSError, KeyError, ValueError):
+            continue  # no (usable) cache here
+
+    positions = _parse_positions_csv(csv_file)
+    for cache in candidates:
+        try:
+            cache.parent.mkdir(parents=True, exist_ok=True)
+            np.savez(cache, positions=positions, source=source)
+            logger.info("Cached positions from '%s' in '%s'", csv_file, cache)
+            break
+        except OSError:
+            continue
+    return positions
+
+
+class Dataset:
+    """
+    One named dataset: ``frames`` (array-like), ``positions`` (y, x per frame).
+
+    ``images_file`` is the ``.npy`` file (None for other types), as needed
+    for memory-mapped access from other processes.
+    """
+
+    def __init__(self, name, images, positions=None, config=None, **kwargs):
+        self.name = name
+        self.config_file = None if config is None else pathlib.Path(config)
+        self.images_file = None
+        if images == "synthetic":
+            n_frames = kwargs.get("frames", 1_000_000)
+            self.positions = SyntheticPositions(
+                n_frames, pattern=kwargs.get("scan", "snake")
+            )
+            self.frames = SyntheticFrames(
+                n_frames,
+                shape=kwargs.get("shape", (256, 256)),
+                dtype=kwargs.get("dtype", "uint16"),
+                content=kwargs.get("content", "gaussian"),
+                positions=self.positions,
+            )
+            return
+
+        if pathlib.Path(images).suffix.lower() == ".npy":
+            self.images_file = pathlib.Path(images)
+        self.frames = open_frames(images, **kwargs)
+        self.positions = load_positions(positions)
+
+    @property
+    def synthetic(self):
+        return isinstance(self.frames, SyntheticFrames)
+
+    def __len__(self):
+        """Number of (frame, position) pairs."""
+        return min(len(self.frames), len(self.positions))
+
+    def __repr__(self):
+        return f"Dataset({self.name!r}, frames={self.frames.shape})"
+
+
+def open_dataset(name):
+    """Open the dataset 'name' from the registry in iconfig.yml."""
+    registry = iconfig.get("DATASETS", {})
+    if name not in registry:
+        raise KeyError(f"Unknown dataset {name!r}.  Known: {dataset_names()}")
+    dataset = Dataset(name, **registry[name])
+    logger.info("Opened %r", dataset)
+    return dataset
@@ -0,0 +1,197 @@
+"""
+Watch a directory for new image files, report them in arrival order.
+
+Uses inotify (the optional ``inotify_simple`` package, Linux) when
+available: a file is reported once it has been closed after writing (or
+moved into the directory).  Otherwise, the directory is scanned
+periodically with an index of each file's size and modification time: a
+file is reported once both have not changed for 'settle_time' seconds.
+Either way, partially written files are not reported.
+
+New files are reported in batches (at most 'batch_size' files per call)
+so a slow consumer receives more files per call, not more calls.
+
+**Example**::
+
+    watcher = DirectoryWatcher("/data/images", print, patterns=["*.tif"])
+    watcher.start()
+    ...
+    watcher.stop()
+"""
+
+__all__ = """
+    DirectoryWatcher
+""".split()
+
+import fnmatch
+import logging
+import os
+import pathlib
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+try:
+    import inotify_simple
+except ImportError:
+    inotify_simple = None
+
+DEFAULT_PATTERNS = ("*.tif", "*.tiff")
+DEFAULT_BATCH_SIZE = 64
+DEFAULT_POLL_INTERVAL = 0.1  # s
+DEFAULT_SETTLE_TIME = 0.2  # s, unchanged for this long: not being written
+
+
+class DirectoryWatcher:
+    """
+    Call ``callback(files)`` with each batch of new files in 'directory'.
+
+    'files' is a list of ``pathlib.Path``, in order of arrival.  Files
+    already in the directory when the watcher starts are not reported,
+    nor is any file reported twice.
+    The callback runs in the watcher's thread: when it is slower than the
+    files arrive, the next batch is bigger.
+    """
+
+    def __init__(
+        self,
+        directory,
+        callback,
+        patterns=DEFAULT_PATTERNS,
+        batch_size=DEFAULT_BATCH_SIZE,
+        poll_interval=DEFAULT_POLL_INTERVAL,
+        settle_time=DEFAULT_SETTLE_TIME,
+        use_inotify=None,
+    ):
+        self.directory = pathlib.Path(directory)
+        if not self.directory.is_dir():
+            raise FileNotFoundError(f"Not a directory: {self.directory}")
+        self.callback = callback
+        self.patterns = list(patterns)
+        self.batch_size = max(1, int(batch_size))
+        self.poll_interval = poll_interval
+        self.settle_time = settle_time
+        if use_inotify is None:
+            use_inotify = inotify_simple is not None
+        elif use_inotify and inotify_simple is None:
+            raise ImportError("inotify_simple package is not installed.")
+        self.use_inotify = use_inotify
+
+        self.reported = 0  # files reported
+        self.batches = 0  # callbacks
+        self._index = {}  # name: (size, mtime_ns) of every file seen
+        self._done = set()  # names already reported (or there at start)
+        self._pending = {}  # name: time (monotonic) when last changed
+        self._ready = []  # names, in order of arrival
+        self._stop = threading.Event()
+        self._thread = None
+        self._inotify = None
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def matches(self, name):
+        return any(fnmatch.fnmatch(name, p) for p in self.patterns)
+
+    def start(self):
+        if self.running:
+            raise RuntimeError(f"Already watching {self.directory}")
+        self._stop.clear()
+        if self.use_inotify:  # watch before the scan: no file is missed
+            self._inotify = inotify_simple.INotify()
+            flags = inotify_simple.flags
+            self._inotify.add_watch(
+                str(self.directory),
+                flags.CLOSE_WRITE | flags.MOVED_TO | flags.DELETE | flags.MOVED_FROM,
+            )
+        self._index = self._scan()  # existing files are not reported
+        self._done = set(self._index)
+        target = self._watch_inotify if self.use_inotify else self._watch_polling
+        self._thread = threading.Thread(target=target, daemon=True)
+        self._thread.start()
+        logger.info(
+            "Watching %s for %s (%s)",
+            self.directory,
+            self.patterns,
+            "inotify" if self.use_inotify else "polling",
+        )
+
+    def stop(self, timeout=5):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def _report(self):
+        """Call back with the ready files, in batches."""
+        while self._ready and not self._stop.is_set():
+            batch = self._ready[: self.batch_size]
+            del self._ready[: self.batch_size]
+            batch = [name for name in batch if name not in self._done]
+            if len(batch) == 0:
+                continue
+            self._done.update(batch)
+            self.reported += len(batch)
+            self.batches += 1
+            try:
+                self.callback([self.directory / name for name in batch])
+            except Exception:
+                logger.exception("Directory watch callback failed.")
+
+    def _scan(self):
+        """Return {name: (size, mtime_ns)} of the matching files."""
+        found = {}
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                if entry.is_file() and self.matches(entry.name):
+                    st = entry.stat()
+                    found[entry.name] = (st.st_size, st.st_mtime_ns)
+        return found
+
+    def _watch_polling(self):
+        while not self._stop.wait(self.poll_interval):
+            now = time.monotonic()
+            try:
+                found = self._scan()
+            except OSError as exc:
+                logger.warning("Cannot scan %s: %s", self.directory, exc)
+                continue
+            for name, signature in found.items():
+                if name in self._done:
+                    continue
+                if self._index.get(name) != signature:  # new or still changing
+                    self._index[name] = signature
+                    self._pending[name] = now
+            for name in set(self._index) - set(found):  # removed
+                self._index.pop(name)
+                self._pending.pop(name, None)
+                self._done.discard(name)  # report it if written again
+
+            settled = [
+                name
+                for name, changed in self._pending.items()
+                if now - changed >= self.settle_time
+            ]
+            # arrival order: by modification time
+            settled.sort(key=lambda name: (self._index[name][1], name))
+            for name in settled:
+                self._pending.pop(name)
+            self._ready.extend(settled)
+            self._report()
+
+    def _watch_inotify(self):
+        removed = inotify_simple.flags.DELETE | inotify_simple.flags.MOVED_FROM
+        with self._inotify as inotify:
+            while not self._stop.is_set():
+                events = inotify.read(timeout=int(self.poll_interval * 1000))
+                # events arrive in order, complete files only
+                for event in events:
+                    if not self.matches(event.name):
+                        continue
+                    if event.mask & removed:
+                        self._done.discard(event.name)  # report if written again
+                    else:
+                        self._ready.append(event.name)
+                self._report()
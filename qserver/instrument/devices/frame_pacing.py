@@ -0,0 +1,136 @@
+"""
+Drift-free pacing of frames at a fixed rate.
+
+Frame ``i`` is due at ``t0 + i/rate`` on the ``time.perf_counter()`` clock,
+so timing errors do not accumulate from frame to frame.  The pacer sleeps
+until shortly before each deadline, then spins for the remainder (sleep
+alone is too coarse at kHz rates, spinning alone burns a core).
+
+A rate of zero means *unpaced*: every frame is due immediately (use this
+to measure the maximum sustained throughput).
+
+Overrun policies, when the publisher falls behind schedule:
+
+``catch_up``
+    Publish late frames immediately (back-to-back) until on schedule again.
+``skip``
+    Skip any frame that is more than one period late.
+
+**Example**::
+
+    pacer = FramePacer(1_000, n_frames=len(frames))
+    pacer.start()
+    for i, frame in enumerate(frames):
+        if pacer.wait(i):
+            publish(frame)
+    print(pacer.statistics())
+"""
+
+__all__ = """
+    FramePacer
+""".split()
+
+import logging
+import numpy as np
+import time
+
+logger = logging.getLogger(__name__)
+
+CATCH_UP = "catch_up"
+SKIP = "skip"
+OVERRUN_POLICIES = (CATCH_UP, SKIP)
+DEFAULT_HISTORY = 100_000  # lateness samples kept for statistics
+DEFAULT_SPIN_TIME = 0.000_2  # spin (do not sleep) for the last 0.2 ms
+
+
+class FramePacer:
+    """
+    Wait until each frame is due, keep statistics of the achieved timing.
+
+    Lateness (time from a frame's deadline until :meth:`wait` returns) is
+    kept in a preallocated array of 'n_frames' (or ``DEFAULT_HISTORY``,
+    most recent) samples.  A frame is *late* if it is more than one period
+    behind its deadline.
+    """
+
+    def __init__(
+        self, rate, n_frames=None, policy=CATCH_UP, spin_time=DEFAULT_SPIN_TIME
+    ):
+        if rate < 0:
+            raise ValueError(f"Rate must not be negative, received {rate}.")
+        if policy not in OVERRUN_POLICIES:
+            raise ValueError(
+                f"Unknown overrun policy {policy!r}.  Use one of {OVERRUN_POLICIES}."
+            )
+        self.rate = rate
+        self.period = 1.0 / rate if rate > 0 else 0.0
+        self.policy = policy
+        self.spin_time = spin_time
+        self.lateness = np.zeros(n_frames or DEFAULT_HISTORY)
+        self.start()
+
+    def start(self, t0=None):
+        """(Re)start the schedule: frame 0 is due at 't0' (default: now)."""
+        self.t0 = time.perf_counter() if t0 is None else t0
+        self.t_first = None
+        self.t_last = None
+        self.published = 0
+        self.skipped = 0
+        self.late = 0
+
+    def deadline(self, i):
+        """Time (``perf_counter`` clock) when frame 'i' is due."""
+        return self.t0 + i * self.period
+
+    def wait(self, i):
+        """
+        Wait until frame 'i' is due.
+
+        Return ``False`` if the frame should be skipped (overrun policy).
+        """
+        deadline = self.t0 + i * self.period
+        remaining = deadline - time.perf_counter()
+        if remaining > self.spin_time:
+            time.sleep(remaining - self.spin_time)
+        now = time.perf_counter()
+        while now < deadline:
+            now = time.perf_counter()
+
+        lateness = (now - deadline) if self.period > 0 else 0.0
+        if self.period > 0 and lateness > self.period:
+            if self.policy == SKIP:
+                self.skipped += 1
+                return False
+            self.late += 1
+
+        self.lateness[self.published % len(self.lateness)] = lateness
+        self.published += 1
+        if self.t_first is None:
+            self.t_first = now
+        self.t_last = now
+        return True
+
+    def statistics(self):
+        """Return a dict of the achieved timing (times in seconds)."""
+        n = min(self.published, len(self.lateness))
+        samples = self.lateness[:n]
+        if n > 0:
+            p50, p90, p99 = np.percentile(samples, [50, 90, 99])
+            jitter_max = samples.max()
+        else:
+            p50 = p90 = p99 = jitter_max = 0.0
+        elapsed = (self.t_last - self.t_first) if self.published > 1 else 0.0
+        achieved = (self.published - 1) / elapsed if elapsed > 0 else 0.0
+        return dict(
+            rate_requested=self.rate,
+            rate_achieved=achieved,
+            elapsed=elapsed,
+            frames_published=self.published,
+            frames_late=self.late,
+            frames_skipped=self.skipped,
+            jitter_p50=float(p50),
+            jitter_p90=float(p90),
+            jitter_p99=float(p99),
+            jitter_max=float(jitter_max),
+            overrun_policy=self.policy,
+        )
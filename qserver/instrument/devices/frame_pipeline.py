@@ -0,0 +1,187 @@
+"""
+Producer/consumer pipeline for publishing frames at high rates.
+
+Builder threads prepare frames ahead of time into a ring of preallocated
+slots.  The publisher (the thread calling :meth:`FramePipeline.run`) only
+waits for the next frame to be due and publishes it.
+
+**Example**::
+
+    def build(i, buffer):
+        numpy.copyto(buffer, frames[i])  # page-in from the memory map
+        return server.build_pva_frame(buffer, i, len(frames))
+
+    def publish(i, pva_frame):
+        server.update(channel, pva_frame)
+
+    pipeline = FramePipeline(
+        build, publish, len(frames), FramePacer(1_000, len(frames)),
+        builders=2, buffer_shape=frames.shape[1:], dtype=frames.dtype,
+    )
+    print(pipeline.run())
+"""
+
+__all__ = """
+    FramePipeline
+""".split()
+
+import logging
+import numpy as np
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_RING_DEPTH = 64
+
+
+class FramePipeline:
+    """
+    Build frames in builder threads, publish them (in order) from one thread.
+
+    ``build(i, buffer)`` prepares frame 'i' and returns the object to be
+    published.  'buffer' is this frame's preallocated ring slot (a numpy
+    array of 'buffer_shape' and 'dtype'), or ``None`` if no shape was given.
+    A slot is re-used only after its frame has been published.
+
+    ``publish(i, built)`` publishes the object returned by ``build()``.
+
+    'pacer' (a :class:`~frame_pacing.FramePacer`) decides when each frame
+    is due (and if it is skipped).
+    """
+
+    def __init__(
+        self,
+        build,
+        publish,
+        n_frames,
+        pacer,
+        builders=1,
+        depth=DEFAULT_RING_DEPTH,
+        buffer_shape=None,
+        dtype=None,
+    ):
+        self.build = build
+        self.publish = publish
+        self.n_frames = n_frames
+        self.pacer = pacer
+        self.n_builders = max(1, int(builders))
+        self.depth = max(1, int(depth))
+        self.buffers = None
+        if buffer_shape is not None:
+            self.buffers = np.empty((self.depth, *buffer_shape), dtype=dtype)
+
+        self._slots = [None] * self.depth
+        self._ready = np.full(self.depth, -1, dtype=np.int64)  # frame in slot
+        self._lock = threading.Lock()
+        self._frame_ready = threading.Condition(self._lock)
+        self._slot_free = threading.Condition(self._lock)
+        self._next_to_build = 0
+        self._consumed = 0  # frames taken from the ring by the publisher
+        self._built = 0
+        self._stop = False
+        self._error = None
+
+        self.builder_stalls = 0  # builder waited for a free slot
+        self.publisher_stalls = 0  # publisher waited for a built frame
+        self.max_queue_depth = 0
+
+    @property
+    def queue_depth(self):
+        """Number of built frames waiting to be published."""
+        return self._built - self._consumed
+
+    def stop(self):
+        """Stop building and publishing (at the next frame)."""
+        with self._lock:
+            self._stop = True
+            self._frame_ready.notify_all()
+            self._slot_free.notify_all()
+
+    def run(self):
+        """Publish all frames, return statistics (dict)."""
+        threads = [
+            threading.Thread(target=self._builder, daemon=True)
+            for _ in range(self.n_builders)
+        ]
+        for thread in threads:
+            thread.start()
+
+        t0 = time.perf_counter()
+        self.pacer.start()
+        try:
+            for i in range(self.n_frames):
+                built = self._take(i)
+                if built is None:
+                    break  # stopped
+                if self.pacer.wait(i):
+                    self.publish(i, built)
+                self._release(i)
+        finally:
+            self.stop()
+            for thread in threads:
+                thread.join()
+        elapsed = time.perf_counter() - t0
+        if self._error is not None:
+            raise self._error
+
+        stats = self.pacer.statistics()
+        stats.update(
+            builders=self.n_builders,
+            ring_depth=self.depth,
+            queue_depth_max=self.max_queue_depth,
+            builder_stalls=self.builder_stalls,
+            publisher_stalls=self.publisher_stalls,
+            throughput=self._consumed / elapsed if elapsed > 0 else 0.0,
+        )
+        return stats
+
+    def _builder(self):
+        while True:
+            with self._lock:
+                i = self._next_to_build
+                if self._stop or i >= self.n_frames:
+                    return
+                self._next_to_build += 1
+                if i >= self._consumed + self.depth:
+                    self.builder_stalls += 1
+                    while not self._stop and i >= self._consumed + self.depth:
+                        self._slot_free.wait()
+                    if self._stop:
+                        return
+
+            slot = i % self.depth
+            buffer = None if self.buffers is None else self.buffers[slot]
+            try:
+                built = self.build(i, buffer)
+            except Exception as exc:
+                logger.exception("Could not build frame %d.", i)
+                self._error = exc
+                self.stop()
+                return
+
+            with self._lock:
+                self._slots[slot] = built
+                self._ready[slot] = i
+                self._built += 1
+                self.max_queue_depth = max(self.max_queue_depth, self.queue_depth)
+                self._frame_ready.notify_all()
+
+    def _take(self, i):
+        slot = i % self.depth
+        with self._lock:
+            if self._ready[slot] != i:
+                self.publisher_stalls += 1
+                while not self._stop and self._ready[slot] != i:
+                    self._frame_ready.wait()
+            if self._ready[slot] != i:
+                return None
+            return self._slots[slot]
+
+    def _release(self, i):
+        slot = i % self.depth
+        with self._lock:
+            self._slots[slot] = None
+            self._ready[slot] = -1
+            self._consumed = i + 1
+            self._slot_free.notify_all()
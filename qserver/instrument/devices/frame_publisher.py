@@ -0,0 +1,162 @@
+"""
+One long-lived publisher thread, fed by a bounded queue.
+
+Each :meth:`FramePublisher.submit` queues one call (such as publishing an
+image) and returns an ophyd ``Status``, finished when the call is done.
+
+Overflow policies, when the queue is full:
+
+``block``
+    Wait (in :meth:`~FramePublisher.submit`) until there is room.
+``drop_oldest``
+    Drop the oldest queued call to make room.
+``drop_newest``
+    Drop this (the newest) call.
+
+The ``Status`` of a dropped call finishes with a :class:`FrameDropped`
+exception (also a call still waiting for room when the publisher is
+stopped).
+
+A call which returns ``False`` had nothing to publish (such as, no
+connection): it is counted as ``skipped``, not ``published``.
+
+**Example**::
+
+    publisher = FramePublisher(maxsize=16, policy="drop_oldest")
+    status = publisher.submit(server.updateFrame, frame)
+    status.wait()
+"""
+
+__all__ = """
+    FrameDropped
+    FramePublisher
+""".split()
+
+import collections
+import logging
+import threading
+
+from ophyd.status import Status
+
+logger = logging.getLogger(__name__)
+
+BLOCK = "block"
+DROP_OLDEST = "drop_oldest"
+DROP_NEWEST = "drop_newest"
+OVERFLOW_POLICIES = (BLOCK, DROP_OLDEST, DROP_NEWEST)
+DEFAULT_QUEUE_SIZE = 64
+
+
+class FrameDropped(RuntimeError):
+    """This call was dropped (the queue was full, or the publisher stopped)."""
+
+
+class FramePublisher:
+    """
+    Run submitted calls, in order, in one thread.
+
+    Counters: ``submitted``, ``published``, ``skipped``, ``dropped``,
+    ``failed``, and ``max_depth`` (most calls waiting in the queue).
+    """
+
+    def __init__(self, maxsize=DEFAULT_QUEUE_SIZE, policy=BLOCK, name="publisher"):
+        if policy not in OVERFLOW_POLICIES:
+            raise ValueError(
+                f"Unknown overflow policy {policy!r}.  Use one of {OVERFLOW_POLICIES}."
+            )
+        self.maxsize = max(1, int(maxsize))
+        self.policy = policy
+        self.name = name
+        self.last_status = None  # of the most recent call submitted
+
+        self.submitted = 0
+        self.published = 0
+        self.skipped = 0
+        self.dropped = 0
+        self.failed = 0
+        self.max_depth = 0
+
+        self._queue = collections.deque()
+        self._lock = threading.Lock()
+        self._not_empty = threading.Condition(self._lock)
+        self._not_full = threading.Condition(self._lock)
+        self._stop = False
+        self._thread = threading.Thread(target=self._worker, name=name, daemon=True)
+        self._thread.start()
+
+    def __len__(self):
+        return len(self._queue)
+
+    def submit(self, func, *args, **kwargs):
+        """Queue ``func(*args, **kwargs)``, return its ``Status``."""
+        status = Status()
+        dropped = None
+        reason = "queue is full"
+        with self._lock:
+            if self._stop:
+                raise RuntimeError(f"{self.name} has been stopped.")
+            self.submitted += 1
+            if len(self._queue) >= self.maxsize:
+                if self.policy == BLOCK:
+                    while len(self._queue) >= self.maxsize and not self._stop:
+                        self._not_full.wait()
+                    if self._stop:  # the worker may have exited already
+                        dropped = status
+                        reason = "has been stopped"
+                elif self.policy == DROP_OLDEST:
+                    dropped = self._queue.popleft()[0]
+                else:
+                    dropped = status
+            if dropped is not status:
+                self._queue.append((status, func, args, kwargs))
+                self.max_depth = max(self.max_depth, len(self._queue))
+                self._not_empty.notify()
+            if dropped is not None:
+                self.dropped += 1
+            self.last_status = status
+        if dropped is not None:
+            dropped.set_exception(FrameDropped(f"{self.name} {reason}."))
+        return status
+
+    def statistics(self):
+        """Return the counters (dict)."""
+        return dict(
+            submitted=self.submitted,
+            published=self.published,
+            skipped=self.skipped,
+            dropped=self.dropped,
+            failed=self.failed,
+            queue_depth=len(self._queue),
+            queue_depth_max=self.max_depth,
+            overflow_policy=self.policy,
+        )
+
+    def stop(self, timeout=None):
+        """Finish the queued calls, then stop the thread."""
+        with self._lock:
+            self._stop = True
+            self._not_empty.notify_all()
+            self._not_full.notify_all()
+        self._thread.join(timeout)
+
+    def _worker(self):
+        while True:
+            with self._lock:
+                while not self._queue and not self._stop:
+                    self._not_empty.wait()
+                if not self._queue:
+                    return  # stopped, and nothing left to publish
+                status, func, args, kwargs = self._queue.popleft()
+                self._not_full.notify()
+            try:
+                result = func(*args, **kwargs)
+            except Exception as exc:
+                logger.exception("%s: call failed.", self.name)
+                self.failed += 1
+                status.set_exception(exc)
+            else:
+                if result is False:  # nothing was published
+                    self.skipped += 1
+                else:
+                    self.published += 1
+                status.set_finished()
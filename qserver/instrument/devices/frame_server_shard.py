@@ -0,0 +1,491 @@
+#!/usr/bin/env python
+
+"""
+Publish frames from several processes (shards), outside of the RunEngine.
+
+Each shard is a separate Python process with its own ``pva.PvaServer``.
+Shard ``k`` (of ``N``) publishes frames ``k, k+N, k+2N, ...`` of a shared,
+memory-mapped ``.npy`` dataset on channel ``{channel}:{k}``.  Clients
+subscribe to all shard channels and order the frames by ``uniqueId``.
+All shards follow the same schedule (frame ``i`` is due at
+``t0 + i/rate``), so the aggregate rate is ``rate``.
+
+Optional preview (binned/ROI) frames and per-frame reductions are
+published the same way, on ``{preview channel}:{k}`` and
+``{reduction channel}:{k}``.
+
+With 'merge', one more process (the merger) serves ``{channel}`` itself
+(and the preview & reduction base channels): it monitors the shard
+channels and republishes every frame there, so single-channel clients
+still receive all frames (as they arrive, not ordered by ``uniqueId``).
+Two servers cannot serve the same channel: nothing else may serve
+these while the merger runs.
+
+:class:`ShardedFrameServer` starts the shard processes and coordinates
+them through control pipes (JSON lines on each shard's stdin/stdout).
+
+Shard process commands (one JSON object per line)::
+
+    {"cmd": "run", "run": 1, "rate": 1000, "n_frames": 12000, "t0": 1700000000.5}
+    {"cmd": "stop", "run": 1}  # stop run 1 early (even if not started yet)
+    {"cmd": "quit"}
+
+A shard writes ``{"ready": n_frames}`` when started and
+``{"stats": {...}, "ids": [...], "times": [...]}`` after each run
+(``uniqueId`` and ``time.time()`` of each frame it published).
+"""
+
+__all__ = """
+    ShardedFrameServer
+""".split()
+
+import argparse
+import json
+import logging
+import numpy as np
+import pathlib
+import pvaccess as pva
+import queue
+import subprocess
+import sys
+import threading
+import time
+
+try:
+    from .blueskyImageServer import REDUCTION_SCHEMA
+    from .blueskyImageServer import reduction_pv_object
+    from .frame_pacing import CATCH_UP
+    from .frame_pacing import FramePacer
+    from .frame_reductions import preview_frame
+    from .frame_reductions import reduce_frame
+except ImportError:  # run as a script
+    from blueskyImageServer import REDUCTION_SCHEMA
+    from blueskyImageServer import reduction_pv_object
+    from frame_pacing import CATCH_UP
+    from frame_pacing import FramePacer
+    from frame_reductions import preview_frame
+    from frame_reductions import reduce_frame
+
+logger = logging.getLogger(__name__)
+
+START_DELAY = 0.5  # s, time allowed for all shards to receive a run command
+PVA_TYPE_KEY_MAP = {
+    np.dtype("uint8"): "ubyteValue",
+    np.dtype("int8"): "byteValue",
+    np.dtype("uint16"): "ushortValue",
+    np.dtype("int16"): "shortValue",
+    np.dtype("uint32"): "uintValue",
+    np.dtype("int32"): "intValue",
+    np.dtype("uint64"): "ulongValue",
+    np.dtype("int64"): "longValue",
+    np.dtype("float32"): "floatValue",
+    np.dtype("float64"): "doubleValue",
+}
+
+
+def wall_to_perf(t):
+    """Convert a time.time() value to the time.perf_counter() clock."""
+    return time.perf_counter() + (t - time.time())
+
+
+class ShardedFrameServer:
+    """
+    Start 'n_shards' frame server processes and coordinate them.
+
+    'preview' (dict of ``channel``, ``binning``, ``roi``, ``decimation``)
+    and 'reduction' (dict of ``channel``, ``rois``), if given, are also
+    published by each shard, on ``{channel}:{k}``.  With 'merge', all
+    frames are also published on the base channels (by a merger process).
+
+    Typical use::
+
+        shards = ShardedFrameServer(4, "bluesky:image", "fly001_uint16.npy")
+        shards.start()
+        t0 = shards.begin(rate=4_000, n_frames=12_000)
+        ...  # publish anything else on the same schedule
+        print(shards.finish())
+        shards.stop()
+    """
+
+    def __init__(
+        self,
+        n_shards,
+        channel,
+        images_file,
+        preview=None,
+        reduction=None,
+        merge=False,
+    ):
+        self.n_shards = max(1, int(n_shards))
+        self.channel = channel
+        self.images_file = str(images_file)
+        self.preview = preview
+        self.reduction = reduction
+        self.merge = merge
+        self.n_frames = 0
+        self.processes = []
+        self.merger = None  # process serving the base channels, with 'merge'
+        self._run = 0  # sequence number of the latest run
+        self.ids = np.zeros(0, dtype=np.int64)  # frames published in the last run
+        self.times = np.zeros(0)  # and when
+
+    @property
+    def base_channels(self):
+        """The frame, preview & reduction channels (without the shard suffix)."""
+        bases = [self.channel]
+        for option in (self.preview, self.reduction):
+            if option is not None:
+                bases.append(option["channel"])
+        return bases
+
+    @property
+    def channels(self):
+        """All channels published by the shards (and the merger)."""
+        bases = self.base_channels
+        channels = [f"{base}:{k}" for base in bases for k in range(self.n_shards)]
+        if self.merge:
+            channels = bases + channels
+        return channels
+
+    @property
+    def running(self):
+        return len(self.processes) > 0
+
+    def start(self):
+        """Start the shard processes, wait until all are ready."""
+        if self.running:
+            raise RuntimeError("Shards are already running.")
+        for k in range(self.n_shards):
+            self.processes.append(self._popen(f"--shard={k}"))
+        self.n_frames = min(reply["ready"] for reply in self._replies())
+        if self.merge:
+            self.merger = self._popen("--merge")
+            if not self.merger.stdout.readline():
+                raise RuntimeError("Frame server merger stopped unexpectedly.")
+        logger.info("%d frame server shards ready: %s", self.n_shards, self.channels)
+
+    def _popen(self, *options):
+        command = [
+            sys.executable,
+            str(pathlib.Path(__file__).absolute()),
+            f"--images={self.images_file}",
+            f"--channel={self.channel}",
+            f"--shards={self.n_shards}",
+            *options,
+        ]
+        if self.preview is not None:
+            command.append(f"--preview={json.dumps(self.preview)}")
+        if self.reduction is not None:
+            command.append(f"--reduction={json.dumps(self.reduction)}")
+        return subprocess.Popen(
+            command,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            text=True,
+            bufsize=1,
+        )
+
+    def begin(self, rate, n_frames, policy=CATCH_UP):
+        """
+        Start publishing 'n_frames' at 'rate' (all shards combined).
+
+        Return the (``time.time()``) time when frame 0 is due.
+        """
+        t0 = time.time() + START_DELAY
+        self._run += 1
+        self._send(
+            dict(
+                cmd="run",
+                run=self._run,
+                rate=rate,
+                n_frames=n_frames,
+                t0=t0,
+                policy=policy,
+            )
+        )
+        return t0
+
+    def finish(self):
+        """
+        Wait for the shards to finish publishing, return combined statistics.
+
+        The frames published (``ids``) and their publish ``times`` are
+        available afterwards, ordered by frame.
+        """
+        replies = list(self._replies())
+        stats = [reply["stats"] for reply in replies]
+        ids = np.concatenate([np.array(r["ids"], dtype=np.int64) for r in replies])
+        times = np.concatenate([np.array(r["times"], dtype=float) for r in replies])
+        order = np.argsort(ids, kind="stable")
+        self.ids, self.times = ids[order], times[order]
+        published = sum(s["frames_published"] for s in stats)
+        elapsed = max(s["elapsed"] for s in stats)
+        combined = dict(
+            rate_requested=stats[0]["rate_requested"] * self.n_shards,
+            rate_achieved=(published - 1) / elapsed if elapsed > 0 else 0.0,
+            elapsed=elapsed,
+            frames_published=published,
+            frames_late=sum(s["frames_late"] for s in stats),
+            frames_skipped=sum(s["frames_skipped"] for s in stats),
+            overrun_policy=stats[0]["overrun_policy"],
+            shards=self.n_shards,
+        )
+        for key in "jitter_p50 jitter_p90 jitter_p99 jitter_max".split():
+            combined[key] = max(s[key] for s in stats)  # worst shard
+        combined["throughput"] = combined["rate_achieved"]
+        return combined
+
+    def abort(self):
+        """Stop the current run early (also if it has not started yet)."""
+        self._send(dict(cmd="stop", run=self._run))
+
+    def stop(self):
+        """Stop the shard processes."""
+        if not self.running:
+            return
+        processes = list(self.processes)
+        if self.merger is not None:
+            processes.append(self.merger)
+        for process in processes:
+            try:
+                process.stdin.write(json.dumps(dict(cmd="quit")) + "\n")
+                process.stdin.flush()
+            except (BrokenPipeError, OSError):
+                pass
+        for process in processes:
+            try:
+                process.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                process.kill()
+        self.processes = []
+        self.merger = None
+
+    def _send(self, command):
+        line = json.dumps(command) + "\n"
+        for process in self.processes:
+            process.stdin.write(line)
+            process.stdin.flush()
+
+    def _replies(self):
+        for k, process in enumerate(self.processes):
+            line = process.stdout.readline()
+            if not line:
+                raise RuntimeError(f"Frame server shard {k} stopped unexpectedly.")
+            yield json.loads(line)
+
+
+def build_frame(frame, unique_id, total_frames):
+    """Build the NTNDArray PVA object for one frame."""
+    rows, cols = frame.shape
+    size = rows * cols * frame.itemsize
+    pva_frame = pva.NtNdArray({})
+    pva_frame["uniqueId"] = unique_id
+    pva_frame["dimension"] = [
+        pva.PvDimension(cols, 0, cols, 1, False),
+        pva.PvDimension(rows, 0, rows, 1, False),
+    ]
+    pva_frame["compressedSize"] = size
+    pva_frame["uncompressedSize"] = size
+    pva_frame["descriptor"] = "Bluesky Image"
+    pva_frame["value"] = {PVA_TYPE_KEY_MAP.get(frame.dtype): frame.ravel()}
+    pva_frame["attribute"] = [
+        pva.NtAttribute("ColorMode", pva.PvInt(0)),
+        pva.NtAttribute("TotalFrames", pva.PvInt(total_frames)),
+    ]
+    return pva_frame
+
+
+def get_timestamp(t=None):
+    s = t or time.time()
+    ns = int((s - int(s)) * 1_000_000_000)
+    return pva.PvTimeStamp(int(s), ns)
+
+
+def serve_shard(
+    server,
+    channel,
+    frames,
+    shard,
+    shards,
+    command,
+    stopped,
+    preview=None,
+    reduction=None,
+):
+    """
+    Publish this shard's frames of one run.
+
+    Also publish the preview and reductions of each frame, if configured
+    ('preview' and 'reduction' dicts, as :class:`ShardedFrameServer`,
+    with this shard's channel names).  Stop early once ``stopped()``.
+
+    Return the pacing statistics, and the ids & publish times of the frames.
+    """
+    rate = command["rate"]
+    n = min(command["n_frames"], len(frames))
+    mine = range(shard, n, shards)  # frames spaced 'shards' frames apart
+    ids = np.zeros(len(mine), dtype=np.int64)
+    times = np.zeros(len(mine))
+    pacer = FramePacer(
+        rate / shards,
+        n_frames=len(mine),
+        policy=command.get("policy", CATCH_UP),
+    )
+    offset = shard / rate if rate > 0 else 0
+    pacer.start(wall_to_perf(command["t0"]) + offset)
+    for j, i in enumerate(mine):
+        if stopped():
+            break
+        if not pacer.wait(j):
+            continue
+        if stopped():  # while waiting for the frame to be due
+            break
+        frame = frames[i]
+        pva_frame = build_frame(frame, i, n)
+        t = time.time()
+        ts = get_timestamp(t)
+        pva_frame["timeStamp"] = ts
+        pva_frame["dataTimeStamp"] = ts
+        server.update(channel, pva_frame)
+        if preview is not None and i % preview["decimation"] == 0:
+            pva_preview = build_frame(
+                preview_frame(frame, preview["binning"], preview["roi"]), i, n
+            )
+            pva_preview["timeStamp"] = ts
+            pva_preview["dataTimeStamp"] = ts
+            server.update(preview["channel"], pva_preview)
+        if reduction is not None:
+            server.update(
+                reduction["channel"],
+                reduction_pv_object(reduce_frame(frame, reduction["rois"]), i, ts),
+            )
+        ids[pacer.published - 1] = i
+        times[pacer.published - 1] = t
+    published = pacer.published
+    return pacer.statistics(), ids[:published], times[:published]
+
+
+def merge_shards(channel, shards, preview=None, reduction=None):
+    """
+    Serve the base channels with the frames of all the shard channels.
+
+    Return the server and the shard channels (keep them, to keep the
+    monitors running).
+    """
+    server = pva.PvaServer()
+    bases = {channel: pva.NtNdArray({})}
+    if preview is not None:
+        bases[preview["channel"]] = pva.NtNdArray({})
+    if reduction is not None:
+        bases[reduction["channel"]] = pva.PvObject(REDUCTION_SCHEMA)
+    for base, record in bases.items():
+        server.addRecord(base, record)
+    server.start()
+
+    monitored = []
+    for base in bases:
+        for k in range(shards):
+            source = pva.Channel(f"{base}:{k}")
+            source.monitor(lambda pv, base=base: server.update(base, pv), "field()")
+            monitored.append(source)
+    return server, monitored
+
+
+def main():
+    """Run one frame server shard, or the merger (started by ShardedFrameServer)."""
+    parser = argparse.ArgumentParser(description="Frame server shard")
+    parser.add_argument("--images", required=True, help="Frames (.npy) file")
+    parser.add_argument("--channel", required=True, help="Base PVA channel name")
+    parser.add_argument("--shard", type=int, help="This shard")
+    parser.add_argument("--shards", type=int, required=True, help="Number of shards")
+    parser.add_argument("--merge", action="store_true",
+                        help="Serve the base channels, from all shards")
+    parser.add_argument("--preview", type=json.loads, help="Preview options (JSON)")
+    parser.add_argument("--reduction", type=json.loads, help="Reduction options (JSON)")
+    args = parser.parse_args()
+
+    # stdout is the control pipe: log to stderr only
+    logging.basicConfig(stream=sys.stderr, level=logging.WARNING)
+
+    def reply(**kwargs):
+        sys.stdout.write(json.dumps(kwargs) + "\n")
+        sys.stdout.flush()
+
+    if args.merge:
+        server, monitored = merge_shards(
+            args.channel, args.shards, args.preview, args.reduction
+        )
+        reply(ready=0)
+        for line in sys.stdin:
+            if json.loads(line)["cmd"] == "quit":
+                break
+        for source in monitored:
+            source.stopMonitor()
+        server.stop()
+        return
+    if args.shard is None:
+        parser.error("--shard is required (unless --merge)")
+
+    frames = np.load(args.images, mmap_mode="r")  # shared via the page cache
+    channel = f"{args.channel}:{args.shard}"
+    server = pva.PvaServer()
+    server.addRecord(channel, pva.NtNdArray({}))
+    preview, reduction = args.preview, args.reduction
+    if preview is not None:
+        preview = dict(
+            preview,
+            channel=f"{preview['channel']}:{args.shard}",
+            decimation=max(1, int(preview.get("decimation") or 1)),
+        )
+        server.addRecord(preview["channel"], pva.NtNdArray({}))
+    if reduction is not None:
+        reduction = dict(reduction, channel=f"{reduction['channel']}:{args.shard}")
+        server.addRecord(reduction["channel"], pva.PvObject(REDUCTION_SCHEMA))
+    server.start()
+
+    commands = queue.Queue()
+    # runs are numbered: a stop (read in order by this thread, at once)
+    # applies to its run even if that run has not started yet
+    runs = dict(latest=0, stopped=0)
+
+    def read_commands():
+        for line in sys.stdin:
+            command = json.loads(line)
+            if command["cmd"] == "run":
+                runs["latest"] = command.get("run", runs["latest"] + 1)
+                command["run"] = runs["latest"]
+            elif command["cmd"] == "stop":
+                stop = command.get("run", runs["latest"])
+                runs["stopped"] = max(runs["stopped"], stop)
+            elif command["cmd"] == "quit":
+                runs["stopped"] = float("inf")
+            commands.put(command)
+        runs["stopped"] = float("inf")
+        commands.put(dict(cmd="quit"))  # control pipe closed
+
+    threading.Thread(target=read_commands, daemon=True).start()
+
+    reply(ready=len(frames))
+    while True:
+        command = commands.get()
+        if command["cmd"] == "quit":
+            break
+        if command["cmd"] == "run":
+            run = command["run"]
+            stats, ids, times = serve_shard(
+                server,
+                channel,
+                frames,
+                args.shard,
+                args.shards,
+                command,
+                lambda: runs["stopped"] >= run,
+                preview=preview,
+                reduction=reduction,
+            )
+            reply(stats=stats, ids=ids.tolist(), times=times.tolist())
+    server.stop()
+
+
+if __name__ == "__main__":
+    main()
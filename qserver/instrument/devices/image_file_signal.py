@@ -12,99 +12,193 @@ print(__file__)
 
 from .. import iconfig
 from .blueskyImageServer import BlueskyImageServer
-from apstools.utils import run_in_thread
+from .datasets import open_dataset
+from .directory_watch import DirectoryWatcher
+from .frame_publisher import FramePublisher
+from .status_support import wait_for_status
 from bluesky import plan_stubs as bps
 from ophyd import EpicsSignal
 from ophyd import Signal
 import datetime
 import logging
 import numpy
+import os
 import pathlib
-import random
 import time
 
 
 logger = logging.getLogger(__name__)
+M6_DATASET = iconfig.get("M6_DATASET", "fly001")  # name in iconfig DATASETS
 M6_GALLERY = pathlib.Path.home() / "voyager" / "BDP" / "M6-gallery"
 PV_CA_IMAGE_FILE_NAME = iconfig["PV_CA_IMAGE_FILE_NAME"]
 PV_PVA_IMAGE = iconfig["PV_PVA_IMAGE"]
-WAIT_BUSY_LOOP = 1.0 / 5_000  # at most, 5k frames per second
-SHORT_WAIT = 0.000_5
+PV_PVA_IMAGE_PREVIEW = iconfig.get("PV_PVA_IMAGE_PREVIEW")
+PV_PVA_IMAGE_REDUCTION = iconfig.get("PV_PVA_IMAGE_REDUCTION")
+PUBLISH_QUEUE_SIZE = iconfig.get("IMAGE_PUBLISH_QUEUE_SIZE", 64)
+PUBLISH_OVERFLOW = iconfig.get("IMAGE_PUBLISH_OVERFLOW", "block")
+
+
+class GalleryIndex:
+    """
+    Index of the image files (names, sizes, mtimes) in a gallery directory.
+
+    Built once, then refreshed (incrementally: only added or removed files
+    are examined) when the directory's modification time changes.
+    """
+
+    def __init__(self, directory, suffix=".tif"):
+        self.directory = pathlib.Path(directory)
+        self.suffix = suffix
+        self.entries = {}  # name: (size, mtime_ns)
+        self.files = numpy.array([], dtype=str)  # full paths, sorted
+        self.rng = numpy.random.default_rng()
+        self._dir_mtime_ns = None
+
+    def __len__(self):
+        return len(self.files)
+
+    def refresh(self):
+        """Update the index if the directory has changed.  Return True if so."""
+        try:
+            dir_mtime_ns = self.directory.stat().st_mtime_ns
+        except FileNotFoundError:
+            dir_mtime_ns = None
+        if dir_mtime_ns == self._dir_mtime_ns:
+            return False
+
+        names = set()
+        if dir_mtime_ns is not None:
+            with os.scandir(self.directory) as items:
+                names = {
+                    item.name
+                    for item in items
+                    if item.name.endswith(self.suffix) and item.is_file()
+                }
+        for name in set(self.entries) - names:
+            self.entries.pop(name)
+        for name in names - set(self.entries):
+            st = (self.directory / name).stat()
+            self.entries[name] = (st.st_size, st.st_mtime_ns)
+        self.files = numpy.array(
+            sorted(str(self.directory / name) for name in self.entries), dtype=str
+        )
+        self._dir_mtime_ns = dir_mtime_ns
+        logger.debug("Gallery index: %d files in %s", len(self.files), self.directory)
+        return True
+
+    def sample(self, num=4, sort=True):
+        """Return 'num' randomly-chosen file names, sort is optional."""
+        self.refresh()
+        if len(self.files) == 0:
+            return []
+        indices = self.rng.choice(len(self.files), size=min(num, len(self.files)))
+        if sort:
+            indices.sort()  # self.files is sorted
+        return self.files[indices].tolist()
+
+
+gallery_index = GalleryIndex(M6_GALLERY)
 
 
 def image_file_list(num=4, sort=True):
     """Return randomized list of 'num' image file names, sort is optional."""
-    # fmt: off
-    all_files = [
-        str(item)
-        for item in M6_GALLERY.iterdir()
-        if str(item).endswith(".tif")
-    ]
-    if sort:
-        all_files = sorted(all_files)
-
-    subset = [
-        all_files[random.randint(0, len(all_files)-1)]
-        for i in range(min(num, len(all_files)-1))
-    ]
-    if sort:
-        subset = sorted(subset)
-    return subset
-    # fmt: on
+    return gallery_index.sample(num, sort)
 
 
 class ImageGallery(Signal):
-    AD_SIM_INPUT_FILE = "/gdata/bdp/henke/fly001_uint16.npy"
-    POSITION_INPUT_FILE = "/gdata/bdp/henke/fly001_pos.csv"
+    """
+    Frames & positions of a dataset (from the registry in iconfig.yml).
 
-    def __init__(self, *args, **kwargs):
+    ``.npy`` frames are memory-mapped (read from the page cache as needed),
+    so memory use does not grow with the size of the dataset.
+    """
+
+    def __init__(self, *args, dataset=M6_DATASET, **kwargs):
         super().__init__(*args, **kwargs)
-        self.gallery = numpy.load(self.AD_SIM_INPUT_FILE)
-        self.positions = numpy.loadtxt(
-            self.POSITION_INPUT_FILE, delimiter=",", dtype=str
-        )
-        # truncate
-        shortest = min(len(self.gallery), len(self.positions))
-        self.gallery = self.gallery[:shortest]
-        self.positions = self.positions[:shortest]
-    
+        self.rng = numpy.random.default_rng()
+        self.load_dataset(dataset)
+
+    def load_dataset(self, name):
+        """Use the frames & positions of dataset 'name'."""
+        try:
+            self.dataset = open_dataset(name)
+        except OSError as exc:
+            logger.warning("Dataset %r: %s.  Using 'synthetic'.", name, exc)
+            self.dataset = open_dataset("synthetic")
+        # memory-mapped array (fancy indexing), if available
+        self.gallery = getattr(self.dataset.frames, "array", self.dataset.frames)
+        self.positions = self.dataset.positions  # float (y, x)
+        self.total_images = len(self.dataset)  # truncate to the shortest
+
     def frame(self, num):
         return self.gallery[num]
     
     def position(self, num):
         return self.positions[num]
 
-    def image_file_list(self, num=4, sort=True):
-        """Return randomized list of 'num' image file names, sort is optional."""
-        # fmt: off
-        total_images = len(self.gallery)
-        requested_number = min(num, total_images)
-        indices = [
-            random.randint(0, total_images-1) for _ in range(requested_number)
-        ]
+    def image_file_list(self, num=4, sort=True, out=None):
+        """
+        Return 'num' randomly-chosen frames (as one new array), sort is optional.
+
+        To re-use a buffer instead, pass an earlier result as 'out': the
+        frames are copied into it (if it has room for them) and a view of
+        it is returned.  The caller must not re-use a buffer while its
+        frames are still needed (such as queued for publishing).
+        """
+        requested_number = min(num, self.total_images)
+        indices = self.rng.choice(self.total_images, size=requested_number)
         if sort:
-            indices = sorted(indices)
-        subset = [self.frame(i) for i in indices]
+            indices.sort()
+
+        frame_shape = self.gallery.shape[1:]
+        if (
+            out is None
+            or len(out) < requested_number
+            or out.shape[1:] != frame_shape
+            or out.dtype != self.gallery.dtype
+        ):
+            out = numpy.empty(
+                (requested_number, *frame_shape), dtype=self.gallery.dtype
+            )
+        subset = out[:requested_number]
+        if isinstance(self.gallery, numpy.ndarray):
+            numpy.take(self.gallery, indices, axis=0, out=subset)
+        else:  # frames only available one at a time
+            for j, i in enumerate(indices):
+                subset[j] = self.gallery[i]
         return subset
-        # fmt: on
 
 
 class ImageFileToPvaSignal(EpicsSignal):
     """
     EpicsSignal: receives file name, sends image via PVAccess
+
+    Images are published, in order, by one publisher thread from a bounded
+    queue ('queue_size' calls, 'overflow' policy when full: ``block``,
+    ``drop_oldest`` or ``drop_newest``).  The ``publish_*()`` methods
+    return a ``Status``, finished once the image has been published.
     """
 
     pva_name = PV_PVA_IMAGE
     pva_server = None
-
-    def __init__(self, *args, pva_name=None, **kwargs):
-        self._busy = True
+    watcher = None  # DirectoryWatcher, when watching a directory
+
+    def __init__(
+        self,
+        *args,
+        pva_name=None,
+        queue_size=PUBLISH_QUEUE_SIZE,
+        overflow=PUBLISH_OVERFLOW,
+        **kwargs,
+    ):
         super().__init__(*args, **kwargs)
         if pva_name is not None:
             self.pva_name = pva_name
+        self.publisher = FramePublisher(
+            queue_size, overflow, name=f"{self.name} publisher"
+        )
         self.start_pva_server()
         self.subscribe(self.cb_ca_monitor_event)
-        self._busy = False
 
     def cb_ca_monitor_event(self, *args, **kwargs):
         """Called from EPICS CA monitor update."""
@@ -115,52 +209,102 @@ class ImageFileToPvaSignal(EpicsSignal):
             logger.debug("Ignore non-str update.")
             return
         logger.debug(f"cb_readback({args}, {kwargs})")
-        logger.debug(f"self._busy: {self._busy}")
+        logger.debug(f"queued: {len(self.publisher)}")
 
         self.publish_image_as_pva(kwargs["value"])
 
-    @run_in_thread
     def publish_frame_as_pva(self, image_frame):
-        """Take image frame, publish as PVAccess."""
+        """Take image frame, publish as PVAccess.  Return a Status."""
         if self.pva_server is None:
             raise RuntimeError("PVA server is not running.")
-        if not self.connected:
-            logger.debug("Not connected.  Will not post image to PVA.")
-            return
-
-        self.wait_server()
+        return self.publisher.submit(self._publish_frame, image_frame)
 
-        logger.debug(f"pushing {image_frame.shape} image to PVA {self.pva_name}")
-        self.pva_server.updateFrame(image_frame)
-        self._busy = False
-
-    @run_in_thread
     def publish_image_as_pva(self, fname=None):
-        """Take image file name, read the image, publish as PVAccess."""
+        """Take image file name, read & publish as PVAccess.  Return a Status."""
         if self.pva_server is None:
             raise RuntimeError("PVA server is not running.")
+        return self.publisher.submit(self._publish_image, fname)
+
+    def _publish_frame(self, image_frame):
+        """(In the publisher thread.)  False: not published."""
         if not self.connected:
             logger.debug("Not connected.  Will not post image to PVA.")
-            return
-
-        self.wait_server()
+            return False
+        logger.debug(f"pushing {image_frame.shape} image to PVA {self.pva_name}")
+        self.pva_server.updateFrame(image_frame)
 
-        self._busy = True
+    def _publish_image(self, fname=None):
+        """(In the publisher thread.)  False: not published."""
+        if not self.connected:
+            logger.debug("Not connected.  Will not post image to PVA.")
+            return False
         fname = pathlib.Path(fname or self.get())
         if not fname.exists():
             logger.debug(f"{fname} not found.")
-            return
+            return False
 
         logger.debug(f"pushing {fname} image to PVA {self.pva_name}")
         self.pva_server.updateImage(f"{str(fname)}")
-        self._busy = False
+
+    def _publish_images(self, fnames):
+        """
+        (In the publisher thread.)  Publish a batch, with read-ahead.
+
+        Does not need the CA signal (watched directory).
+        """
+        logger.debug(f"pushing {len(fnames)} images to PVA {self.pva_name}")
+        self.pva_server.updateImages([str(f) for f in fnames])
+
+    def watch_directory(self, directory, patterns=("*.tif", "*.tiff"), **kwargs):
+        """
+        Publish new image files in 'directory' as they arrive (in order).
+
+        No CA update (of this signal) is needed for each image.  Files are
+        published once completely written, in batches when they arrive
+        faster than they are published.  Other keyword arguments are
+        passed to :class:`~directory_watch.DirectoryWatcher`.
+        """
+        if self.pva_server is None:
+            raise RuntimeError("PVA server is not running.")
+        self.stop_watching()
+        self.watcher = DirectoryWatcher(
+            directory,
+            lambda fnames: self.publisher.submit(self._publish_images, fnames),
+            patterns=patterns,
+            **kwargs,
+        )
+        self.watcher.start()
+        return self.watcher
+
+    def stop_watching(self):
+        if self.watcher is not None:
+            self.watcher.stop()
+            self.watcher = None
+
+    def prefetch(self, fnames):
+        """Decode these image files ahead of publication (read-ahead)."""
+        if self.pva_server is not None:
+            self.pva_server.prefetch(fnames)
 
     def start_pva_server(self):
         if self.pva_server is not None:
             raise RuntimeError("PVA server already running.")
 
         logger.debug("starting PVA server ...")
-        self.pva_server = BlueskyImageServer(self.pva_name)
+        options = {}
+        if iconfig.get("IMAGE_PREVIEW_ENABLE", False):
+            options.update(
+                previewChannelName=PV_PVA_IMAGE_PREVIEW,
+                previewBinning=iconfig.get("IMAGE_PREVIEW_BINNING", 4),
+                previewRoi=iconfig.get("IMAGE_PREVIEW_ROI"),
+                previewDecimation=iconfig.get("IMAGE_PREVIEW_DECIMATION", 1),
+            )
+        if iconfig.get("IMAGE_REDUCTION_ENABLE", False):
+            options.update(
+                reductionChannelName=PV_PVA_IMAGE_REDUCTION,
+                reductionRois=iconfig.get("IMAGE_REDUCTION_ROIS"),
+            )
+        self.pva_server = BlueskyImageServer(self.pva_name, **options)
         self.pva_server.start()
 
     def stop_pva_server(self):
@@ -171,13 +315,19 @@ class ImageFileToPvaSignal(EpicsSignal):
 
     @property
     def busy(self):
-        return self._busy
+        """Are any images waiting to be published?"""
+        status = self.publisher.last_status
+        return status is not None and not status.done
 
     def wait_server(self, earliest=0):
-        """Bluesky plan"""
-        yield from bps.null()
-        while (time.time() < earliest) or self.busy:
-            yield from bps.sleep(SHORT_WAIT)
+        """
+        Bluesky plan: wait until 'earliest' (a time.time() value)
+        and until all queued images have been published.
+        """
+        delay = earliest - time.time()
+        if delay > 0:
+            yield from bps.sleep(delay)
+        yield from wait_for_status(self.publisher.last_status)
 
 
 gallery = ImageGallery(name="gallery")
@@ -187,3 +337,12 @@ img2pva = ImageFileToPvaSignal(
     string=True,
     pva_name=PV_PVA_IMAGE,
 )
+if iconfig.get("IMAGE_WATCH_DIRECTORY"):
+    try:
+        img2pva.watch_directory(iconfig["IMAGE_WATCH_DIRECTORY"])
+    except Exception as exc:
+        logger.error(
+            "Not watching IMAGE_WATCH_DIRECTORY %r: %s",
+            iconfig["IMAGE_WATCH_DIRECTORY"],
+            exc,
+        )
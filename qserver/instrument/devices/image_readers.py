@@ -0,0 +1,296 @@
+"""
+Fast image file readers and an LRU cache of decoded frames.
+
+Decode TIFF, PNG, and NumPy ``.npy`` image files for the PVA image servers.
+
+* Uncompressed, single-sample TIFF files (as written by area detector) are
+  decoded directly with NumPy.
+* Other TIFF and PNG files are decoded by ``tifffile`` or ``PIL``
+  (whichever is available), then ``matplotlib`` as the last resort.
+  PNG frames are float32 in 0..1, as ``plt.imread`` returns them.
+* ``.npy`` files are read with ``numpy.load()``.
+
+:class:`FrameCache` keeps recently decoded frames in memory (up to a
+budget, in bytes) and can decode files ahead of publication in a
+read-ahead thread.
+"""
+
+__all__ = """
+    FrameCache
+    read_image
+""".split()
+
+import collections
+import logging
+import numpy as np
+import os
+import pathlib
+import queue
+import struct
+import threading
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CACHE_BYTES = 256 * 2**20  # 256 MiB
+
+# TIFF tags used by the fast path
+TIFF_IMAGE_WIDTH = 256
+TIFF_IMAGE_LENGTH = 257
+TIFF_BITS_PER_SAMPLE = 258
+TIFF_COMPRESSION = 259
+TIFF_STRIP_OFFSETS = 273
+TIFF_SAMPLES_PER_PIXEL = 277
+TIFF_STRIP_BYTE_COUNTS = 279
+TIFF_TILE_WIDTH = 322
+TIFF_SAMPLE_FORMAT = 339
+TIFF_FIELD_TYPES = {  # TIFF field type: struct format
+    1: "B",  # BYTE
+    3: "H",  # SHORT
+    4: "I",  # LONG
+    16: "Q",  # LONG8
+}
+TIFF_SAMPLE_KINDS = {1: "u", 2: "i", 3: "f"}  # SampleFormat: numpy kind
+
+
+def read_tiff_uncompressed(path):
+    """
+    Decode an uncompressed, single-sample, striped TIFF file with NumPy.
+
+    Return ``None`` if the file uses any other layout.
+    """
+    buf = pathlib.Path(path).read_bytes()
+    if buf[:4] == b"II*\x00":
+        order = "<"
+    elif buf[:4] == b"MM\x00*":
+        order = ">"
+    else:
+        return None  # not a classic TIFF (BigTIFF is not handled here)
+
+    (ifd,) = struct.unpack_from(f"{order}I", buf, 4)
+    (n_entries,) = struct.unpack_from(f"{order}H", buf, ifd)
+    tags = {}
+    for i in range(n_entries):
+        tag, ftype, count, raw = struct.unpack_from(
+            f"{order}HHI4s", buf, ifd + 2 + 12 * i
+        )
+        fmt = TIFF_FIELD_TYPES.get(ftype)
+        if fmt is None:
+            continue  # not needed by the fast path
+        size = struct.calcsize(fmt) * count
+        if size <= 4:
+            values = struct.unpack_from(f"{order}{count}{fmt}", raw)
+        else:
+            (offset,) = struct.unpack_from(f"{order}I", raw)
+            values = struct.unpack_from(f"{order}{count}{fmt}", buf, offset)
+        tags[tag] = values
+
+    if (
+        tags.get(TIFF_COMPRESSION, (1,))[0] != 1
+        or tags.get(TIFF_SAMPLES_PER_PIXEL, (1,))[0] != 1
+        or TIFF_TILE_WIDTH in tags
+        or TIFF_STRIP_OFFSETS not in tags
+    ):
+        return None
+
+    bits = tags.get(TIFF_BITS_PER_SAMPLE, (1,))[0]
+    kind = TIFF_SAMPLE_KINDS.get(tags.get(TIFF_SAMPLE_FORMAT, (1,))[0])
+    if kind is None or bits not in (8, 16, 32, 64):
+        return None
+    dtype = np.dtype(f"{order}{kind}{bits // 8}")
+
+    cols = tags[TIFF_IMAGE_WIDTH][0]
+    rows = tags[TIFF_IMAGE_LENGTH][0]
+    offsets = tags[TIFF_STRIP_OFFSETS]
+    counts = tags.get(TIFF_STRIP_BYTE_COUNTS, (rows * cols * dtype.itemsize,))
+    contiguous = all(
+        offsets[k] + counts[k] == offsets[k + 1] for k in range(len(offsets) - 1)
+    )
+    if contiguous:
+        data = np.frombuffer(buf, dtype=dtype, count=rows * cols, offset=offsets[0])
+    else:
+        strips = b"".join(buf[o : o + n] for o, n in zip(offsets, counts))
+        data = np.frombuffer(strips, dtype=dtype, count=rows * cols)
+    # native byte order, as the PVA type map expects
+    return data.reshape(rows, cols).astype(dtype.newbyteorder("="), copy=False)
+
+
+PNG_RAWMODE_SCALES = {"1": 1, "L;2": 2**2 - 1, "L;4": 2**4 - 1, "I;16B": 2**16 - 1}
+
+
+def png_to_float(image):
+    """PNG image (from PIL) as float32 in 0..1, just as ``plt.imread`` gives."""
+    scale = PNG_RAWMODE_SCALES.get(image.png.im_rawmode, 2**8 - 1)
+    if image.mode in ("P", "LA"):  # palette, grayscale + alpha
+        image = image.convert("RGBA")
+    return np.divide(image, scale, dtype=np.float32)
+
+
+def read_image_fallback(path):
+    """Decode an image file with whichever optional library is available."""
+    try:
+        import tifffile
+
+        if str(path).lower().endswith((".tif", ".tiff")):
+            return tifffile.imread(path)
+    except ImportError:
+        pass
+    try:
+        from PIL import Image
+
+        with Image.open(path) as image:
+            if image.format == "PNG":
+                return png_to_float(image)
+            return np.asarray(image)
+    except ImportError:
+        pass
+    import matplotlib.pyplot as plt  # slow to import, so only when needed
+
+    return plt.imread(path)
+
+
+def read_image(path):
+    """Decode the image in file 'path' and return it as a numpy array."""
+    suffix = pathlib.Path(path).suffix.lower()
+    if suffix == ".npy":
+        return np.load(path)
+    if suffix in (".tif", ".tiff"):
+        data = read_tiff_uncompressed(path)
+        if data is not None:
+            return data
+    return read_image_fallback(path)
+
+
+class FrameCache:
+    """
+    LRU cache of decoded image frames, keyed by file path and mtime.
+
+    Frames are evicted (least recently used first) to stay within
+    ``max_bytes``.  A frame replaced on disk (new mtime) is decoded again.
+    Cached frames are read-only since they are shared by all callers.
+
+    Call :meth:`prefetch` with the next file names to be published.  These
+    are decoded by a read-ahead thread so :meth:`get` finds them ready.
+    Files too big to cache are not read ahead (or, if they are only too
+    big once decoded, the frame is handed to the next :meth:`get` once).
+
+    Counters: ``hits`` (frame ready), ``pending_hits`` (frame still being
+    read ahead, waited for), ``misses`` (decoded by :meth:`get`).
+    """
+
+    def __init__(self, max_bytes=DEFAULT_CACHE_BYTES, reader=read_image):
+        self.max_bytes = max_bytes
+        self.reader = reader
+        self.nbytes = 0
+        self.hits = 0
+        self.pending_hits = 0
+        self.misses = 0
+        self._frames = collections.OrderedDict()  # (path, mtime): frame
+        self._keys = {}  # path: (path, mtime)
+        self._pending = {}  # (path, mtime): threading.Event
+        self._oversized = {}  # (path, mtime): frame, read ahead but too big
+        self._lock = threading.Lock()
+        self._read_ahead = queue.Queue()
+        self._read_ahead_thread = None
+
+    def __len__(self):
+        return len(self._frames)
+
+    @staticmethod
+    def key(path):
+        path = str(path)
+        return path, os.stat(path).st_mtime_ns
+
+    def get(self, path):
+        """Return the decoded frame from 'path', decoding it if necessary."""
+        key = self.key(path)
+        with self._lock:
+            frame = self._lookup(key)
+            if frame is not None:
+                self.hits += 1
+                return frame
+            pending = self._pending.get(key)
+        if pending is not None:  # read-ahead thread is decoding it now
+            pending.wait()
+            with self._lock:
+                frame = self._lookup(key)
+                if frame is not None:
+                    self.pending_hits += 1
+                    return frame
+        with self._lock:
+            self.misses += 1
+        return self._load(key)
+
+    def _lookup(self, key):
+        """Return the cached frame (call with the lock held) or None."""
+        frame = self._frames.get(key)
+        if frame is None:
+            # read ahead, but too big to cache: handed over once
+            return self._oversized.pop(key, None)
+        self._frames.move_to_end(key)
+        return frame
+
+    def clear(self):
+        with self._lock:
+            self._frames.clear()
+            self._keys.clear()
+            self._oversized.clear()
+            self.nbytes = 0
+
+    def prefetch(self, paths):
+        """Decode 'paths' into the cache from the read-ahead thread."""
+        if self._read_ahead_thread is None:
+            self._read_ahead_thread = threading.Thread(
+                target=self._read_ahead_worker, daemon=True
+            )
+            self._read_ahead_thread.start()
+        for path in paths:
+            self._read_ahead.put(path)
+
+    def _load(self, key):
+        frame = self.reader(key[0])
+        self._store(key, frame)
+        return frame
+
+    def _store(self, key, frame):
+        """Cache 'frame'.  Return False if it is too big to cache."""
+        if frame.nbytes > self.max_bytes:
+            return False
+        frame.flags.writeable = False
+        with self._lock:
+            if key in self._frames:
+                return True
+            stale = self._keys.get(key[0])
+            if stale is not None:  # file was re-written
+                self.nbytes -= self._frames.pop(stale).nbytes
+            self._frames[key] = frame
+            self._keys[key[0]] = key
+            self.nbytes += frame.nbytes
+            while self.nbytes > self.max_bytes:
+                old_key, old_frame = self._frames.popitem(last=False)
+                del self._keys[old_key[0]]
+                self.nbytes -= old_frame.nbytes
+        return True
+
+    def _read_ahead_worker(self):
+        while True:
+            path = self._read_ahead.get()
+            try:
+                if os.stat(path).st_size > self.max_bytes:
+                    continue  # cannot be cached: decoded when published
+                key = self.key(path)
+                with self._lock:
+                    if key in self._frames or key in self._pending:
+                        continue
+                    event = self._pending[key] = threading.Event()
+                try:
+                    frame = self.reader(key[0])
+                    if not self._store(key, frame):  # bigger once decoded
+                        with self._lock:
+                            self._oversized.clear()  # keep only the latest
+                            self._oversized[key] = frame
+                finally:
+                    with self._lock:
+                        del self._pending[key]
+                    event.set()
+            except Exception as exc:
+                logger.debug("read-ahead of %s failed: %s", path, exc)
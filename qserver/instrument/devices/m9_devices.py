@@ -14,23 +14,31 @@ logger.info(__file__)
 print(__file__)
 
 from .. import iconfig
+from .blueskyImageServer import REDUCTION_SCHEMA
+from .blueskyImageServer import reduction_pv_object
+from .datasets import open_dataset
+from .frame_pacing import CATCH_UP
+from .frame_pacing import FramePacer
+from .frame_pipeline import DEFAULT_RING_DEPTH
+from .frame_pipeline import FramePipeline
+from .frame_reductions import preview_frame
+from .frame_reductions import reduce_frame
+from .frame_server_shard import ShardedFrameServer
 from apstools.devices import ActionsFlyerBase
 from apstools.utils import run_in_thread
 from ophyd import Component
+from ophyd import Device
 from ophyd import EpicsSignal
-# from ophyd import Signal
+from ophyd import Signal
 import configparser
 import numpy as np
-import pandas
-import pathlib
 import pvaccess as pva
+import threading
 import time
 
 
-DATA_PATH = pathlib.Path("/gdata/bdp") / "henke"
-IMAGES_FILE = DATA_PATH / "fly001_uint16.npy"
-POSITIONS_FILE = DATA_PATH / "fly001_pos.csv"
-CONFIG_FILE = DATA_PATH / "ptychodus.ini"
+DATASET = iconfig.get("M9_DATASET", "fly001")  # name in iconfig DATASETS
+FALLBACK_DATASET = "synthetic"  # when the dataset files are not available
 PVA_TYPE_KEY_MAP = {
     np.dtype("uint8"): "ubyteValue",
     np.dtype("int8"): "byteValue",
@@ -44,6 +52,14 @@ PVA_TYPE_KEY_MAP = {
     np.dtype("float64"): "doubleValue",
 }
 DEMO_TITLE = f"{iconfig['BDP_DEMO']} demo"
+PREVIEW_ENABLE = iconfig.get("IMAGE_PREVIEW_ENABLE", False)
+PREVIEW_BINNING = iconfig.get("IMAGE_PREVIEW_BINNING", 4)
+PREVIEW_DECIMATION = max(1, int(iconfig.get("IMAGE_PREVIEW_DECIMATION", 1)))
+PREVIEW_ROI = iconfig.get("IMAGE_PREVIEW_ROI")
+REDUCTION_ENABLE = iconfig.get("IMAGE_REDUCTION_ENABLE", False)
+REDUCTION_ROIS = iconfig.get("IMAGE_REDUCTION_ROIS") or []
+# shards: also publish all frames on PV_PVA_M9_IMAGE (by a merger process)
+SHARD_MERGE = iconfig.get("M9_SHARD_MERGE", True)
 
 
 def getTimestamp(t=None):
@@ -54,46 +70,166 @@ def getTimestamp(t=None):
 
 
 class PositionerCache:
-    """Cache positioner values and timestamps before updating PVA."""
+    """
+    Cache positioner values and timestamps before updating PVA.
+
+    Values and timestamps are kept in preallocated numpy arrays (which grow
+    when full).  Timestamps are published as parallel arrays of
+    ``secondsPastEpoch`` and ``nanoseconds``, one pair per value.
+
+    The cache is :meth:`due` for publication when it holds 'chunk_size'
+    values or when its oldest value is 'max_age' seconds old.
+    """
 
     schema = dict(
         uniqueId=pva.ULONG,
         nUpdates=pva.UINT,
-        t=[pva.PvTimeStamp()],
+        secondsPastEpoch=[pva.UINT],
+        nanoseconds=[pva.UINT],
         values=[pva.DOUBLE],
     )
 
-    def __init__(self):
-        self.reset()
+    def __init__(self, chunk_size=10, max_age=None, size=1024):
+        self.chunk_size = chunk_size
+        self.max_age = max_age
+        self.values = np.zeros(size, dtype=np.float64)
+        self.seconds = np.zeros(size, dtype=np.uint32)
+        self.nanoseconds = np.zeros(size, dtype=np.uint32)
         self.uniqueId = 0
+        self.reset()
 
     def __len__(self):
-        return len(self.values)
+        return self.n
+
+    def add(self, value, t):
+        """Add a value and its (time.time()) timestamp."""
+        if self.n == len(self.values):  # full, grow all arrays
+            size = 2 * len(self.values)
+            self.values = np.resize(self.values, size)
+            self.seconds = np.resize(self.seconds, size)
+            self.nanoseconds = np.resize(self.nanoseconds, size)
+        if self.n == 0:
+            self.t_oldest = time.monotonic()
+        s = int(t)
+        self.values[self.n] = value
+        self.seconds[self.n] = s
+        self.nanoseconds[self.n] = int((t - s) * 1_000_000_000)
+        self.n += 1
+
+    def due(self, horizon=0):
+        """
+        Should the cache be published now?
 
-    def add(self, value, timestamp):
-        self.values.append(value)
-        self.timestamps.append(timestamp)
+        True if full, or if the oldest value will be 'max_age' old within
+        'horizon' seconds (such as the time until the next value is added).
+        """
+        if self.n == 0:
+            return False
+        if self.n >= self.chunk_size:
+            return True
+        if self.max_age is None:
+            return False
+        return time.monotonic() + horizon >= self.t_oldest + self.max_age
 
     def reset(self):
-        self.values = []
-        self.timestamps = []
+        self.n = 0
+        self.t_oldest = None
 
     @property
     def pv_object(self):
         self.uniqueId += 1
+        n = self.n
         dd = dict(
                 uniqueId=self.uniqueId,
-                nUpdates=len(self.values),
-                t=self.timestamps,
-                values=np.array(self.values),
+                nUpdates=n,
+                secondsPastEpoch=self.seconds[:n].copy(),
+                nanoseconds=self.nanoseconds[:n].copy(),
+                values=self.values[:n].copy(),
             )
-        # print(f"{dd=}")
         pv_object = pva.PvObject(self.schema, dd)
 
         self.reset()
         return pv_object
 
 
+class XYPositionerCache:
+    """
+    Cache X & Y positions together, always published from the same flush.
+
+    Both channels receive the same timestamps and number of values.
+    """
+
+    def __init__(self, chunk_size=10, max_age=None):
+        self.x = PositionerCache(chunk_size=chunk_size, max_age=max_age)
+        self.y = PositionerCache(chunk_size=chunk_size, max_age=max_age)
+
+    def __len__(self):
+        return len(self.x)
+
+    def configure(self, chunk_size, max_age=None):
+        for cache in (self.x, self.y):
+            cache.chunk_size = chunk_size
+            cache.max_age = max_age
+
+    def add(self, x, y, t):
+        self.x.add(x, t)
+        self.y.add(y, t)
+
+    def due(self, horizon=0):
+        return self.x.due(horizon)
+
+    @property
+    def pv_objects(self):
+        """PVA objects for X and Y (and reset the cache)."""
+        return self.x.pv_object, self.y.pv_object
+
+
+class FrameRecords:
+    """
+    Per-frame records of a fly scan: uniqueId, publish time, X & Y.
+
+    Preallocated (one row per frame) and filled as the frames are published.
+    """
+
+    dtype = np.dtype(
+        [
+            ("unique_id", np.int64),
+            ("publish_time", np.float64),
+            ("pos_x", np.float64),
+            ("pos_y", np.float64),
+        ]
+    )
+
+    def __init__(self, size=0):
+        self.reset(size)
+
+    def __len__(self):
+        return self.n
+
+    def reset(self, size):
+        """Empty the records, room for 'size' frames."""
+        if size != len(getattr(self, "data", ())):
+            self.data = np.zeros(size, dtype=self.dtype)
+        self.n = 0
+
+    def add(self, unique_id, t, x, y):
+        self.data[self.n] = (unique_id, t, x, y)
+        self.n += 1
+
+    def extend(self, unique_ids, times, x, y):
+        """Add many records at once (arrays)."""
+        n = self.n + len(unique_ids)
+        self.data["unique_id"][self.n : n] = unique_ids
+        self.data["publish_time"][self.n : n] = times
+        self.data["pos_x"][self.n : n] = x
+        self.data["pos_y"][self.n : n] = y
+        self.n = n
+
+    @property
+    def records(self):
+        return self.data[: self.n]
+
+
 class BlueskyImageServer(pva.PvaServer):
 
     def __init__(self):
@@ -101,12 +237,36 @@ class BlueskyImageServer(pva.PvaServer):
         print(f"{extraFieldsTypeDict=}")
         super().__init__()
 
-        self.cache_x = PositionerCache()
-        self.cache_y = PositionerCache()
+        self.cache_xy = XYPositionerCache()
+        self.abort_event = threading.Event()  # set: stop publishing early
+
+        self.addRecord(iconfig["PV_PVA_M9_X"], pva.PvObject(PositionerCache.schema), None)
+        self.addRecord(iconfig["PV_PVA_M9_Y"], pva.PvObject(PositionerCache.schema), None)
+        self.restore_image_channels()
+
+    @staticmethod
+    def image_records():
+        """The records of the frame, preview & reduction channels."""
+        records = {iconfig["PV_PVA_M9_IMAGE"]: pva.NtNdArray({})}
+        if PREVIEW_ENABLE:
+            records[iconfig["PV_PVA_M9_IMAGE_PREVIEW"]] = pva.NtNdArray({})
+        if REDUCTION_ENABLE:
+            records[iconfig["PV_PVA_M9_IMAGE_REDUCTION"]] = pva.PvObject(
+                REDUCTION_SCHEMA
+            )
+        return records
+
+    def release_image_channels(self):
+        """Stop serving the image channels (another process will)."""
+        for name in self.image_records():
+            if self.hasRecord(name):
+                self.removeRecord(name)
 
-        self.addRecord(iconfig["PV_PVA_M9_IMAGE"], pva.NtNdArray(extraFieldsTypeDict))
-        self.addRecord(iconfig["PV_PVA_M9_X"], pva.PvObject(self.cache_x.schema), None)
-        self.addRecord(iconfig["PV_PVA_M9_Y"], pva.PvObject(self.cache_y.schema), None)
+    def restore_image_channels(self):
+        """Serve the image channels (again)."""
+        for name, record in self.image_records().items():
+            if not self.hasRecord(name):
+                self.addRecord(name, record)
 
     def build_pva_frame(self, frame, unique_id, total_frames, ts=None):
         """Build the PVA object for one frame."""
@@ -136,44 +296,222 @@ class BlueskyImageServer(pva.PvaServer):
         pva_frame["timeStamp"] = ts
         pva_frame["dataTimeStamp"] = ts
         pva_frame["descriptor"] = "Bluesky Image"
-        pva_frame["value"] = {pvaTypeKey: frame.flatten()}
+        pva_frame["value"] = {pvaTypeKey: frame.ravel()}
         pva_frame["attribute"] = attributes
 
         return pva_frame
 
-    def m9_demo(self, rate, n_frames, positions, frames, position_chunks=10):
-        """Serve 'n' frames at 'rate' frames/second."""
+    def build_preview(self, frame, unique_id, total_frames, ts=None):
+        """Build the binned/ROI preview of this frame (None if not enabled)."""
+        if not PREVIEW_ENABLE or unique_id % PREVIEW_DECIMATION != 0:
+            return None
+        preview = preview_frame(frame, PREVIEW_BINNING, PREVIEW_ROI)
+        return self.build_pva_frame(preview, unique_id, total_frames, ts=ts)
+
+    def build_reduction(self, frame, unique_id):
+        """Build the per-frame reductions (None if not enabled)."""
+        if not REDUCTION_ENABLE:
+            return None
+        return reduction_pv_object(reduce_frame(frame, REDUCTION_ROIS), unique_id)
+
+    def publish_positions(self):
+        """Publish (and reset) the cached X & Y positions, together."""
+        pv_x, pv_y = self.cache_xy.pv_objects
+        self.update(iconfig["PV_PVA_M9_X"], pv_x)
+        self.update(iconfig["PV_PVA_M9_Y"], pv_y)
+
+    def m9_demo(
+        self,
+        rate,
+        n_frames,
+        positions,
+        frames,
+        position_chunks=10,
+        position_max_age=None,
+        overrun_policy=CATCH_UP,
+        builders=0,
+        ring_depth=DEFAULT_RING_DEPTH,
+        records=None,
+    ):
+        """
+        Serve 'n' frames at 'rate' frames/second (0: as fast as possible).
+
+        Positions are published in chunks of 'position_chunks' or when the
+        oldest cached position is 'position_max_age' seconds old.
+
+        With ``builders=0``, each frame is built and published in turn.
+        Otherwise, 'builders' threads build frames ahead into a ring of
+        'ring_depth' preallocated slots and this thread only publishes.
+
+        Each published frame is added to 'records' (:class:`FrameRecords`),
+        if given.
+
+        Return a dict with statistics of the achieved frame timing.
+        """
         # only use the first n available position,frame sets
         n = max(0, min(n_frames, len(frames), len(positions)))
         logger.debug("Serving the first %s frames.", n)
-        period = 1.0 / rate
-        logger.debug("Period between frames: %s s", period)
-
-        t0 = time.time()
-        for i, obj in enumerate(zip(positions[:n], frames[:n])):
-            deadline = t0 + i * period
-            while time.time() < deadline:  # control the frame rate
-                time.sleep(period/20)
-            yx, frame = obj
-            y, x = yx
-            ts = getTimestamp()
-            self.update(  # post the frame every time
-                iconfig["PV_PVA_M9_IMAGE"], self.build_pva_frame(frame, i, n, ts=ts)
+        pacer = FramePacer(rate, n_frames=n, policy=overrun_policy)
+        logger.debug("Period between frames: %s s", pacer.period)
+        self.cache_xy.configure(position_chunks, position_max_age)
+        if records is not None:
+            records.reset(n)
+
+        def build(i, buffer=None):
+            frame = frames[i]
+            if buffer is not None:
+                np.copyto(buffer, frame)  # read from the memory-mapped file
+                frame = buffer
+            return (
+                self.build_pva_frame(frame, i, n),
+                self.build_preview(frame, i, n),
+                self.build_reduction(frame, i),
             )
-            self.cache_x.add(x, ts)
-            self.cache_y.add(y, ts)
 
-            # post the positions in chunks
-            if len(self.cache_x) >= position_chunks:
-                self.update(iconfig["PV_PVA_M9_X"], self.cache_x.pv_object)
-            if len(self.cache_y) >= position_chunks:
-                self.update(iconfig["PV_PVA_M9_Y"], self.cache_y.pv_object)
+        def publish(i, built):
+            pva_frame, pva_preview, pva_reduction = built
+            y, x = positions[i]
+            t = time.time()
+            ts = getTimestamp(t)
+            pva_frame["timeStamp"] = ts
+            pva_frame["dataTimeStamp"] = ts
+            self.update(iconfig["PV_PVA_M9_IMAGE"], pva_frame)  # post every frame
+            if pva_preview is not None:
+                pva_preview["timeStamp"] = ts
+                pva_preview["dataTimeStamp"] = ts
+                self.update(iconfig["PV_PVA_M9_IMAGE_PREVIEW"], pva_preview)
+            if pva_reduction is not None:
+                pva_reduction["timeStamp"] = ts
+                self.update(iconfig["PV_PVA_M9_IMAGE_REDUCTION"], pva_reduction)
+            self.cache_xy.add(x, y, t)
+            if records is not None:
+                records.add(i, t, x, y)
+
+            # post the positions in chunks (or before they get too old)
+            if self.cache_xy.due(horizon=pacer.period):
+                self.publish_positions()
+
+        if builders > 0:
+            pipeline = None
+
+            def publish_or_stop(i, built):
+                if self.abort_event.is_set():
+                    pipeline.stop()
+                else:
+                    publish(i, built)
+
+            pipeline = FramePipeline(
+                build,
+                publish_or_stop,
+                n,
+                pacer,
+                builders=builders,
+                depth=ring_depth,
+                buffer_shape=frames.shape[1:],
+                dtype=frames.dtype,
+            )
+            stats = pipeline.run()
+        else:
+            pacer.start()
+            for i in range(n):
+                if self.abort_event.is_set():
+                    break
+                if pacer.wait(i):  # control the frame rate
+                    publish(i, build(i))
+            stats = pacer.statistics()
 
         # post any remaining positions in the caches
-        if len(self.cache_x) > 0:
-            self.update(iconfig["PV_PVA_M9_X"], self.cache_x.pv_object)
-        if len(self.cache_y) > 0:
-            self.update(iconfig["PV_PVA_M9_Y"], self.cache_y.pv_object)
+        if len(self.cache_xy) > 0:
+            self.publish_positions()
+
+        logger.info("Frame pacing: %s", stats)
+        return stats
+
+    def m9_demo_sharded(
+        self,
+        shards,
+        rate,
+        n_frames,
+        positions,
+        position_chunks=10,
+        position_max_age=None,
+        overrun_policy=CATCH_UP,
+        records=None,
+    ):
+        """
+        Serve 'n' frames at 'rate' frames/second from the shard processes.
+
+        The frames are published by the :class:`ShardedFrameServer`
+        'shards'.  This thread publishes the positions on the same schedule,
+        each chunk (timestamped with its frames' due times) when its last
+        frame is due.  It sleeps in between, so the RunEngine keeps the GIL.
+        The frames published (with the shards' publish times) are added to
+        'records' (:class:`FrameRecords`), if given.
+
+        Return a dict with statistics of the achieved frame timing.
+        """
+        n = max(0, min(n_frames, shards.n_frames, len(positions)))
+        logger.debug("Serving the first %s frames from %s shards.", n, shards.n_shards)
+        if not shards.merge:
+            logger.warning(
+                "Sharded frames are published on %s, not on %s.",
+                shards.channels,
+                shards.channel,
+            )
+        period = 1.0 / rate if rate > 0 else 0.0
+        chunk = max(1, int(position_chunks))
+        if position_max_age and period > 0:
+            chunk = max(1, min(chunk, int(position_max_age / period)))
+        self.cache_xy.configure(chunk, position_max_age)
+
+        t0 = shards.begin(rate, n, overrun_policy)
+        for start in range(0, n, chunk):
+            stop = min(n, start + chunk)
+            due = t0 + (stop - 1) * period
+            if self.abort_event.wait(max(0.0, due - time.time())):
+                break  # stop() has told the shards to stop too
+            for i in range(start, stop):
+                y, x = positions[i]
+                self.cache_xy.add(x, y, t0 + i * period)
+            self.publish_positions()
+        if len(self.cache_xy) > 0:
+            self.publish_positions()
+
+        stats = shards.finish()
+        if records is not None:
+            records.reset(len(shards.ids))
+            y, x = np.asarray(positions)[shards.ids].T
+            records.extend(shards.ids, shards.times, x, y)
+        logger.info("Frame pacing: %s", stats)
+        return stats
+
+
+class FramePacingStatistics(Device):
+    """
+    Achieved frame timing of the most recent fly scan (times in seconds).
+
+    The queue and stall counters are only updated when frames are built
+    in builder threads (``builders > 0``).
+    """
+
+    rate_achieved = Component(Signal, value=0.0, kind="config")
+    frames_published = Component(Signal, value=0, kind="config")
+    frames_late = Component(Signal, value=0, kind="config")
+    frames_skipped = Component(Signal, value=0, kind="config")
+    jitter_p50 = Component(Signal, value=0.0, kind="config")
+    jitter_p90 = Component(Signal, value=0.0, kind="config")
+    jitter_p99 = Component(Signal, value=0.0, kind="config")
+    jitter_max = Component(Signal, value=0.0, kind="config")
+    throughput = Component(Signal, value=0.0, kind="config")
+    queue_depth_max = Component(Signal, value=0, kind="config")
+    builder_stalls = Component(Signal, value=0, kind="config")
+    publisher_stalls = Component(Signal, value=0, kind="config")
+
+    def record(self, stats):
+        """Write the statistics from :meth:`FramePacer.statistics()`."""
+        stats.setdefault("throughput", stats["rate_achieved"])
+        for attr in self.component_names:
+            getattr(self, attr).put(stats.get(attr, 0))
 
 
 class M9_Flyer(ActionsFlyerBase):
@@ -183,65 +521,220 @@ class M9_Flyer(ActionsFlyerBase):
     frame_rate = Component(EpicsSignal, iconfig["PV_CA_M9_FRAME_RATE"], kind="config")
     num_images = Component(EpicsSignal, iconfig["PV_CA_M9_NUM_IMAGES"], kind="config")
     position_chunk_size = Component(EpicsSignal, iconfig["PV_CA_M9_N_POS_CHUNKS"], kind="config")
+    position_max_age = Component(Signal, value=0.1, kind="config")  # seconds
+    overrun_policy = Component(Signal, value=CATCH_UP, kind="config")
+    builders = Component(Signal, value=0, kind="config")
+    ring_depth = Component(Signal, value=DEFAULT_RING_DEPTH, kind="config")
+    # >0: publish frames from this many separate processes
+    shards = Component(Signal, value=0, kind="config")
+    # reported in the run's descriptor configuration
+    pacing = Component(FramePacingStatistics, "", kind="config")
+
+    # name of a dataset in iconfig DATASETS, (re)loaded when changed
+    dataset = Component(Signal, value=DATASET, kind="config")
 
     frame_server = BlueskyImageServer()
+    frame_shards = None  # ShardedFrameServer, started when needed
+    frame_records = FrameRecords()  # per-frame records of the last fly scan
+    records_stream = "m9_frames"
+    records_page_size = 10_000  # events per event_page document
+    # no (inherited) collect(): bluesky uses collect_pages() without warning
+    collect = None
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
 
         self.frame_server.start()
-        self.load_configuration()
-        self.load_image_data()
-        self.load_positions_data()
+        self.loaded_dataset = None
+        self.load_dataset(self.dataset.get())
 
-    def load_configuration(self):
-        self.config = configparser.ConfigParser()
-        self.config.read(CONFIG_FILE)
+    def load_dataset(self, name):
+        """
+        Load frames, positions & configuration of dataset 'name'.
+
+        Use the synthetic dataset if the files are not available.
+        """
+        try:
+            self.data = open_dataset(name)
+        except OSError as exc:
+            logger.warning("Dataset %r: %s.  Using %r.", name, exc, FALLBACK_DATASET)
+            self.data = open_dataset(FALLBACK_DATASET)
+        self.frames = self.data.frames
+        self.positions = self.data.positions  # note: y, x
+        self.loaded_dataset = name
         logger.info(
-            "Configuration: file='%s', len=%s", CONFIG_FILE.name, len(self.config)
+            "Dataset %r: images shape=%s, positions shape=%s",
+            self.data.name,
+            self.frames.shape,
+            self.positions.shape,
         )
+        self.load_configuration(self.data.config_file)
 
-    def load_image_data(self):
-        self.frames = np.load(IMAGES_FILE, mmap_mode="r")
-        logger.info("Images: file='%s', shape=%s", IMAGES_FILE.name, self.frames.shape)
+    def load_configuration(self, config_file):
+        self.config = configparser.ConfigParser()
+        if config_file is not None:
+            self.config.read(config_file)
+            logger.info(
+                "Configuration: file='%s', len=%s", config_file.name, len(self.config)
+            )
 
-    def load_positions_data(self):
-        self.positions = pandas.read_csv(POSITIONS_FILE).to_numpy()
-        # note: y, x
-        logger.info(
-            "Positions: file='%s', shape=%s", POSITIONS_FILE.name, self.positions.shape
+    @property
+    def synthetic(self):
+        """Are the frames & positions generated (not from files)?"""
+        return self.data.synthetic
+
+    def start_frame_shards(self, n_shards):
+        """(Re)start the frame server processes, if not already running."""
+        if self.frame_shards is not None:
+            if (
+                self.frame_shards.n_shards == n_shards
+                and self.frame_shards.images_file == str(self.data.images_file)
+            ):
+                return self.frame_shards
+            self.stop_frame_shards()
+        preview = reduction = None
+        if PREVIEW_ENABLE:
+            preview = dict(
+                channel=iconfig["PV_PVA_M9_IMAGE_PREVIEW"],
+                binning=PREVIEW_BINNING,
+                roi=PREVIEW_ROI,
+                decimation=PREVIEW_DECIMATION,
+            )
+        if REDUCTION_ENABLE:
+            reduction = dict(
+                channel=iconfig["PV_PVA_M9_IMAGE_REDUCTION"], rois=REDUCTION_ROIS
+            )
+        self.frame_shards = ShardedFrameServer(
+            n_shards,
+            iconfig["PV_PVA_M9_IMAGE"],
+            self.data.images_file,
+            preview=preview,
+            reduction=reduction,
+            merge=SHARD_MERGE,
         )
+        if SHARD_MERGE:  # the merger serves the image channels now
+            self.frame_server.release_image_channels()
+        try:
+            self.frame_shards.start()
+        except Exception:
+            self.stop_frame_shards()
+            raise
+        return self.frame_shards
+
+    def stop_frame_shards(self):
+        if self.frame_shards is not None:
+            self.frame_shards.stop()
+            self.frame_shards = None
+        self.frame_server.restore_image_channels()
+
+    @property
+    def publishing(self):
+        """Is a fly scan publishing frames now?"""
+        status = self.status_actions_thread
+        return status is not None and not status.done
+
+    def stop(self, *, success=False):
+        """Stop publishing frames (in this process and in the shards)."""
+        if self.publishing:
+            logger.info("Stopping the M9 fly scan.")
+            self.frame_server.abort_event.set()
+            if self.frame_shards is not None and self.frame_shards.running:
+                self.frame_shards.abort()
+        super().stop(success=success)
+
+    def pause(self):
+        """A fly scan cannot be suspended: stop publishing (RunEngine pause)."""
+        self.stop()
 
     def actions_thread(self):
         """
         Run the flyer in a thread.  Not a bluesky plan.
 
         Any acquired data should be saved internally and yielded from
-        :meth:`~collect`.  (Remember to modify :meth:`~describe_collect` for
-        any changes in the structure of data yielded by :meth:`~collect`!)
+        :meth:`~collect_pages`.  (Remember to modify :meth:`~describe_collect`
+        for any changes in the structure of data it yields!)
         """
 
         @run_in_thread
         def _action():
             logging.debug("in actions_thread()")
 
-            self.reconstruct.put(0)  # disable reconstruction
-
-            # This is where we call the external code
-            self.frame_server.m9_demo(
-                self.frame_rate.get(),
-                self.num_images.get(),
-                self.positions,
-                self.frames,
-                position_chunks=self.position_chunk_size.get()
-            )
-
-            self.reconstruct.put(1)  # enable (trigger) reconstruction
+            self.frame_server.abort_event.clear()
+            try:
+                self.reconstruct.put(0)  # disable reconstruction
+
+                if self.dataset.get() != self.loaded_dataset:
+                    self.load_dataset(self.dataset.get())
+
+                # This is where we call the external code
+                sharded = self.data.images_file is not None
+                if self.shards.get() > 0 and not sharded:
+                    logger.warning("Shards need a .npy dataset file.  Not using shards.")
+                if self.shards.get() > 0 and sharded:
+                    stats = self.frame_server.m9_demo_sharded(
+                        self.start_frame_shards(self.shards.get()),
+                        self.frame_rate.get(),
+                        self.num_images.get(),
+                        self.positions,
+                        position_chunks=self.position_chunk_size.get(),
+                        position_max_age=self.position_max_age.get(),
+                        overrun_policy=self.overrun_policy.get(),
+                        records=self.frame_records,
+                    )
+                else:
+                    self.stop_frame_shards()  # serve the image channels here
+                    stats = self.frame_server.m9_demo(
+                        self.frame_rate.get(),
+                        self.num_images.get(),
+                        self.positions,
+                        self.frames,
+                        position_chunks=self.position_chunk_size.get(),
+                        position_max_age=self.position_max_age.get(),
+                        overrun_policy=self.overrun_policy.get(),
+                        builders=self.builders.get(),
+                        ring_depth=self.ring_depth.get(),
+                        records=self.frame_records,
+                    )
+                self.pacing.record(stats)
+
+                self.reconstruct.put(1)  # enable (trigger) reconstruction
+            except Exception as exc:
+                # complete() raises it, rather than waiting forever
+                logger.exception("M9 fly scan failed")
+                self.status_actions_thread.set_exception(exc)
+                return
 
             self.status_actions_thread.set_finished()
             logging.debug("actions_thread() marked 'finished'")
 
         _action()
 
+    def describe_collect(self):
+        """Describe the per-frame records (one stream)."""
+        source = f"PY:{self.name}.frame_records"
+        integer = dict(source=source, dtype="integer", shape=[])
+        number = dict(source=source, dtype="number", shape=[])
+        return {
+            self.records_stream: {
+                "unique_id": integer,
+                "publish_time": dict(number, units="s"),
+                "pos_x": number,
+                "pos_y": number,
+            }
+        }
+
+    def collect_pages(self):
+        """Yield the per-frame records as bulk event pages."""
+        records = self.frame_records.records
+        for start in range(0, len(records), self.records_page_size):
+            page = records[start : start + self.records_page_size]
+            times = page["publish_time"].tolist()
+            data = {key: page[key].tolist() for key in FrameRecords.dtype.names}
+            yield dict(
+                time=times,
+                data=data,
+                timestamps={key: times for key in data},
+            )
+
 
 m9_flyer = M9_Flyer("", name="m9_flyer")
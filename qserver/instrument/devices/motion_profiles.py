@@ -0,0 +1,244 @@
+"""
+Position-versus-time tables for simulated motion, computed with numpy.
+
+Single moves:
+
+``trapezoid_profile``
+    Acceleration limited: accelerate at 'amax' to 'vmax', cruise,
+    decelerate.  (A triangle when the move is too short to reach 'vmax'.)
+``s_curve_profile``
+    Acceleration and jerk limited: the trapezoid's velocity smoothed by a
+    moving average of width ``amax/jmax`` (7 segments, jerk <= 'jmax').
+
+Trajectories:
+
+``pvt_profile``
+    Through (time, position, velocity) knots, cubic Hermite segments.
+``waypoints_profile``
+    Point-to-point moves through a list of positions, one after another.
+``fly_profile``
+    X & Y together through (x, y) waypoints without stopping.
+
+Each returns ``(times, positions)``, two arrays sampled every 'period'
+seconds, with times relative to the start of the motion (the last
+sample is the end of the motion).  ``move_duration`` is the time of a
+single move, for scan time estimates.
+
+**Example**::
+
+    times, positions = s_curve_profile(0, 100, vmax=50, amax=500, jmax=5000)
+    samplexy.fine.x.load_trajectory(times, positions)
+"""
+
+__all__ = """
+    fly_profile
+    move_duration
+    pvt_profile
+    s_curve_profile
+    trapezoid_profile
+    waypoints_profile
+""".split()
+
+import logging
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PERIOD = 0.01  # s, between samples
+
+
+def _trapezoid(distance, vmax, amax):
+    """Return (ta, tc, v): acceleration time, cruise time, peak velocity."""
+    distance = abs(distance)
+    ta = vmax / amax
+    if amax * ta * ta > distance:  # triangle: never reaches vmax
+        ta = np.sqrt(distance / amax)
+        return ta, 0.0, amax * ta
+    return ta, (distance - amax * ta * ta) / vmax, vmax
+
+
+def _sample_times(duration, period):
+    """Times from 0 to 'duration' (inclusive), 'period' apart."""
+    n = 1 + int(np.ceil(duration / period - 1e-9))
+    return np.linspace(0, duration, max(n, 2))
+
+
+def _trapezoid_integral(t, ta, tc, v, amax):
+    """
+    Integral (from 0 to t) of the trapezoid's distance travelled.
+
+    Closed form, piecewise cubic in 't' (an array).
+    """
+    t = np.asarray(t, dtype=float)
+    t2 = ta + tc  # start of deceleration
+    T = t2 + ta  # end of motion
+    pa = amax * ta * ta / 2  # distance at end of acceleration
+    distance = 2 * pa + v * tc
+    Pa = amax * ta**3 / 6  # integral at end of acceleration
+    P2 = Pa + pa * tc + v * tc * tc / 2  # ... at start of deceleration
+    PT = P2 + distance * ta - amax * ta**3 / 6  # ... at end of motion
+
+    tt = np.clip(t, 0, ta)
+    result = amax * tt**3 / 6
+    tt = np.clip(t - ta, 0, tc)
+    result = np.where(t > ta, Pa + pa * tt + v * tt * tt / 2, result)
+    tt = np.clip(t, t2, T)
+    result = np.where(
+        t > t2,
+        P2 + distance * (tt - t2) - amax * (ta**3 - (T - tt) ** 3) / 6,
+        result,
+    )
+    return np.where(t > T, PT + distance * (t - T), result)
+
+
+def move_duration(distance, vmax, amax=None, jmax=None):
+    """
+    Time (s) to move 'distance' with these limits.
+
+    Without 'amax', at constant velocity.  'jmax' adds ``amax/jmax``.
+    """
+    distance = abs(distance)
+    if distance == 0:
+        return 0.0
+    if not amax:
+        return distance / vmax
+    ta, tc, _v = _trapezoid(distance, vmax, amax)
+    duration = 2 * ta + tc
+    if jmax:
+        duration += amax / jmax
+    return float(duration)
+
+
+def trapezoid_profile(start, end, vmax, amax, period=DEFAULT_PERIOD):
+    """Acceleration-limited move from 'start' to 'end'."""
+    distance = end - start
+    ta, tc, v = _trapezoid(distance, vmax, amax)
+    times = _sample_times(2 * ta + tc, period)
+
+    t2 = ta + tc
+    travelled = np.where(
+        times < ta,
+        amax * times**2 / 2,
+        np.where(
+            times < t2,
+            amax * ta * ta / 2 + v * (times - ta),
+            abs(distance) - amax * (2 * ta + tc - times) ** 2 / 2,
+        ),
+    )
+    positions = start + np.sign(distance) * travelled
+    positions[-1] = end
+    return times, positions
+
+
+def s_curve_profile(start, end, vmax, amax, jmax, period=DEFAULT_PERIOD):
+    """
+    Acceleration and jerk limited move from 'start' to 'end'.
+
+    The moving average (width ``tj = amax/jmax``) of the trapezoid's
+    velocity has the same distance and peak velocity, acceleration changes
+    at most 'jmax'.  Its position is the difference of the trapezoid's
+    closed-form position integral, ``(P(t) - P(t - tj)) / tj``.
+    """
+    distance = end - start
+    ta, tc, v = _trapezoid(distance, vmax, amax)
+    tj = amax / jmax
+    times = _sample_times(2 * ta + tc + tj, period)
+    integral = _trapezoid_integral(times, ta, tc, v, amax)
+    integral_lagged = _trapezoid_integral(times - tj, ta, tc, v, amax)
+    positions = start + np.sign(distance) * (integral - integral_lagged) / tj
+    positions[-1] = end
+    return times, positions
+
+
+def pvt_profile(times, positions, velocities=None, period=DEFAULT_PERIOD):
+    """
+    Trajectory through (time, position, velocity) knots.
+
+    Each segment is the cubic (Hermite) which matches the positions and
+    velocities at both of its knots.  Without 'velocities', the
+    velocity at each interior knot is the slope between its neighbours,
+    zero at the first and last knots.
+    """
+    knots_t = np.asarray(times, dtype=float)
+    knots_p = np.asarray(positions, dtype=float)
+    if knots_t.shape != knots_p.shape or knots_t.size < 2:
+        raise ValueError("Need at least 2 knots, same number of times & positions.")
+    if np.any(np.diff(knots_t) <= 0):
+        raise ValueError("Knot times must increase.")
+    if velocities is None:
+        knots_v = np.zeros_like(knots_p)
+        knots_v[1:-1] = (knots_p[2:] - knots_p[:-2]) / (knots_t[2:] - knots_t[:-2])
+    else:
+        knots_v = np.asarray(velocities, dtype=float)
+
+    t = knots_t[0] + _sample_times(knots_t[-1] - knots_t[0], period)
+    i = np.clip(np.searchsorted(knots_t, t, side="right") - 1, 0, knots_t.size - 2)
+    h = knots_t[i + 1] - knots_t[i]
+    s = (t - knots_t[i]) / h
+    s2, s3 = s * s, s * s * s
+    result = (
+        (2 * s3 - 3 * s2 + 1) * knots_p[i]
+        + (s3 - 2 * s2 + s) * h * knots_v[i]
+        + (-2 * s3 + 3 * s2) * knots_p[i + 1]
+        + (s3 - s2) * h * knots_v[i + 1]
+    )
+    return t - knots_t[0], result
+
+
+def waypoints_profile(
+    positions, vmax, amax=None, jmax=None, dwell=0, period=DEFAULT_PERIOD
+):
+    """
+    Move through 'positions', stopping (for 'dwell' s) at each one.
+
+    Each move is constant velocity (no 'amax'), trapezoid, or S-curve
+    (with 'jmax').  Returns the tables of all moves, joined.
+    """
+    positions = list(positions)
+    if len(positions) == 0:
+        return np.zeros(0), np.zeros(0)
+    all_times, all_positions = [np.zeros(1)], [np.asarray(positions[:1], float)]
+    t_end = 0.0
+    for start, end in zip(positions[:-1], positions[1:]):
+        if start == end:
+            t, p = np.zeros(1), np.array([end], dtype=float)
+        elif not amax:
+            t = _sample_times(abs(end - start) / vmax, period)
+            p = np.linspace(start, end, t.size)
+        elif jmax:
+            t, p = s_curve_profile(start, end, vmax, amax, jmax, period)
+        else:
+            t, p = trapezoid_profile(start, end, vmax, amax, period)
+        all_times.append(t_end + t[1:])
+        all_positions.append(p[1:])
+        t_end += t[-1] + dwell
+    return np.concatenate(all_times), np.concatenate(all_positions)
+
+
+def fly_profile(waypoints, vx, vy, smooth=False, period=DEFAULT_PERIOD):
+    """
+    Move X & Y through (x, y) 'waypoints' without stopping.
+
+    Each leg takes ``max(|dx|/vx, |dy|/vy)``: the slower axis moves at
+    its velocity, the other arrives at the same time.  Straight legs at
+    constant velocity, or (with 'smooth') a PVT trajectory through the
+    waypoints at the same times.  Returns ``(times, x, y)``.
+    """
+    xy = np.asarray(waypoints, dtype=float).reshape(-1, 2)
+    legs = np.abs(np.diff(xy, axis=0)) / np.array([abs(vx), abs(vy)])
+    keep = np.append(True, legs.max(axis=1) > 0)  # skip repeated points
+    xy = xy[keep]
+    knots = np.append(0.0, np.cumsum(legs.max(axis=1)[keep[1:]]))
+    if len(knots) < 2:
+        return np.zeros(1), xy[:1, 0].copy(), xy[:1, 1].copy()
+    if smooth:
+        times, x = pvt_profile(knots, xy[:, 0], period=period)
+        _times, y = pvt_profile(knots, xy[:, 1], period=period)
+    else:
+        times = _sample_times(knots[-1], period)
+        # every waypoint is on the path: include the knots
+        times = np.union1d(times, knots)
+        x = np.interp(times, knots, xy[:, 0])
+        y = np.interp(times, knots, xy[:, 1])
+    return times, x, y
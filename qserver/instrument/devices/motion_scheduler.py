@@ -0,0 +1,290 @@
+"""
+One scheduler thread for the readback updates of all simulated axes.
+
+Each axis (any hashable key) has at most one active *profile*: a list of
+(time, position) waypoints and a ``put(position, scheduled)`` callable
+('scheduled' is the waypoint's due time, ``perf_counter`` clock).  The
+scheduler keeps the next waypoint of each profile in a timer heap and
+sleeps (no polling) until the earliest is due.  Waypoints of all axes
+due within the same 'tick' are written together (so the X and Y
+readbacks of a stage update together), and only the latest due waypoint
+of each axis is written.
+
+Scheduling a new profile for an axis preempts its current profile,
+:meth:`MotionScheduler.cancel` stops it.
+
+:class:`TimingRecord` keeps when each (recent) readback update was
+scheduled, issued, and completed.
+
+**Example**::
+
+    motion_scheduler.schedule(axis, times, positions, axis.write_readback)
+"""
+
+__all__ = """
+    MotionScheduler
+    TimingRecord
+    motion_scheduler
+""".split()
+
+import heapq
+import itertools
+import logging
+import numpy as np
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TICK = 0.000_5  # s, waypoints due this close together: one wakeup
+DEFAULT_MAX_TIMING_RECORDS = 2**18  # per axis: ~4 minutes at 1 kHz, 8 MB
+
+
+class TimingRecord:
+    """
+    When was each readback update scheduled, issued, and completed?
+
+    One entry per scheduled update (time on the ``perf_counter`` clock),
+    in preallocated arrays which grow when full, up to 'max_size'
+    entries.  Then it is a ring: each new entry replaces the oldest, so
+    memory use is bounded however long the axis runs.
+
+    ``scheduled``
+        When the update was due.
+    ``issued``
+        When the put was issued (``nan``: dropped, a newer position was
+        due before it could be written).
+    ``completed``
+        When the put completed (``nan``: not yet, or dropped).
+    ``positions``
+        The position written.
+
+    Indices count all updates since :meth:`reset` (``len()``), including
+    those no longer kept.
+    """
+
+    fields = "scheduled issued completed positions".split()
+
+    def __init__(self, size=4096, max_size=DEFAULT_MAX_TIMING_RECORDS):
+        self.max_size = max(1, max_size)
+        size = min(max(1, size), self.max_size)
+        for field in self.fields:
+            setattr(self, field, np.full(size, np.nan))
+        self.reset()
+
+    def __len__(self):
+        return self.n
+
+    @property
+    def first(self):
+        """Index of the oldest update kept."""
+        return max(0, self.n - len(self.scheduled))
+
+    @property
+    def dropped(self):
+        return int(np.isnan(self.table()["issued"]).sum())
+
+    def reset(self):
+        self.n = 0
+        for field in self.fields:
+            getattr(self, field)[:] = np.nan
+
+    def add(self, scheduled, issued, position):
+        """Record one update, return its index."""
+        size = len(self.scheduled)
+        if self.n == size and size < self.max_size:  # full, grow all arrays
+            size = min(2 * size, self.max_size)
+            for field in self.fields:
+                grown = np.full(size, np.nan)
+                grown[: self.n] = getattr(self, field)
+                setattr(self, field, grown)
+        i = self.n % size  # replaces the oldest, once at 'max_size'
+        self.scheduled[i] = scheduled
+        self.issued[i] = issued
+        self.completed[i] = np.nan
+        self.positions[i] = position
+        self.n += 1
+        return self.n - 1
+
+    def complete(self, index, t=None):
+        """Record when the put of update 'index' completed."""
+        if self.first <= index < self.n:  # not yet replaced
+            t = time.perf_counter() if t is None else t
+            self.completed[index % len(self.completed)] = t
+
+    def table(self, start=0):
+        """Return {field: array} of the updates (still kept) from 'start'."""
+        rows = np.arange(max(start, self.first), self.n) % len(self.scheduled)
+        return {field: getattr(self, field)[rows] for field in self.fields}
+
+    def statistics(self, start=0):
+        """
+        Timing statistics (s) of the updates from 'start'.
+
+        ``lag``: issued - scheduled; ``jitter``: its standard deviation;
+        ``interval_jitter``: standard deviation of the differences between
+        issued and scheduled intervals; ``latency``: completed - issued.
+        """
+        table = self.table(start)
+        issued = ~np.isnan(table["issued"])
+        lag = (table["issued"] - table["scheduled"])[issued]
+        latency = table["completed"] - table["issued"]
+        latency = latency[~np.isnan(latency)]
+        intervals = np.diff(table["issued"][issued]) - np.diff(
+            table["scheduled"][issued]
+        )
+
+        def percentiles(values, prefix):
+            if len(values) == 0:
+                return {f"{prefix}_{k}": 0.0 for k in "mean p50 p99 max".split()}
+            p50, p99 = np.percentile(values, [50, 99])
+            return {
+                f"{prefix}_mean": float(values.mean()),
+                f"{prefix}_p50": float(p50),
+                f"{prefix}_p99": float(p99),
+                f"{prefix}_max": float(values.max()),
+            }
+
+        result = dict(
+            updates=len(table["scheduled"]),
+            puts=int(issued.sum()),
+            dropped=int((~issued).sum()),
+            jitter=float(lag.std()) if len(lag) else 0.0,
+            interval_jitter=float(intervals.std()) if len(intervals) else 0.0,
+        )
+        result.update(percentiles(lag, "lag"))
+        result.update(percentiles(latency, "latency"))
+        return result
+
+
+class MotionProfile:
+    """Waypoints of one axis (times on the ``perf_counter`` clock)."""
+
+    def __init__(self, key, times, positions, put, done=None):
+        self.key = key
+        self.times = times
+        self.positions = positions
+        self.put = put
+        self.done = done  # called (no arguments) after the last waypoint
+        self.index = 0  # next waypoint
+        self.cancelled = False
+
+    def __len__(self):
+        return len(self.times)
+
+    @property
+    def finished(self):
+        return self.index >= len(self)
+
+
+class MotionScheduler:
+    """Run the motion profiles of all simulated axes from one thread."""
+
+    def __init__(self, tick=DEFAULT_TICK):
+        self.tick = tick
+        self.profiles = {}  # key: active MotionProfile
+        self._heap = []  # (time, sequence, profile): next waypoint
+        self._sequence = itertools.count()
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+        self._thread = None
+
+        self.wakeups = 0  # scheduler passes which wrote readbacks
+        self.puts = 0  # readback values written
+
+    def schedule(self, key, times, positions, put, t0=None, done=None):
+        """
+        Start a motion profile for axis 'key' (preempts its current one).
+
+        Waypoint ``i`` is due 'times[i]' seconds after 't0' (a
+        ``time.perf_counter()`` value, default: now), when
+        ``put(positions[i], due_time)`` is called.
+        """
+        t0 = time.perf_counter() if t0 is None else t0
+        profile = MotionProfile(
+            key, [t0 + t for t in times], list(positions), put, done=done
+        )
+        with self._lock:
+            old = self.profiles.get(key)
+            if old is not None:
+                old.cancelled = True  # its heap entry is dropped when due
+            if len(profile) == 0:
+                self.profiles.pop(key, None)
+                return profile
+            self.profiles[key] = profile
+            heapq.heappush(self._heap, (profile.times[0], next(self._sequence), profile))
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(
+                    target=self._run, name="motion scheduler", daemon=True
+                )
+                self._thread.start()
+            self._wakeup.notify()
+        return profile
+
+    def cancel(self, key):
+        """Stop the motion profile of axis 'key' (readback holds)."""
+        with self._lock:
+            profile = self.profiles.pop(key, None)
+            if profile is not None:
+                profile.cancelled = True
+
+    def active(self, key):
+        """Is axis 'key' running a motion profile?"""
+        profile = self.profiles.get(key)
+        return profile is not None and not profile.finished
+
+    def _due(self):
+        """Wait until waypoints are due, return {profile: (position, time)}."""
+        with self._lock:
+            while True:
+                while self._heap and self._heap[0][2].cancelled:
+                    heapq.heappop(self._heap)
+                if not self._heap:
+                    self._wakeup.wait()
+                    continue
+                delay = self._heap[0][0] - time.perf_counter()
+                if delay <= 0:
+                    break
+                self._wakeup.wait(delay)
+
+            horizon = time.perf_counter() + self.tick
+            due = {}
+            while self._heap and self._heap[0][0] <= horizon:
+                _t, _seq, profile = heapq.heappop(self._heap)
+                if profile.cancelled:
+                    continue
+                # skip to the latest waypoint already due (coalesce)
+                i = profile.index
+                while i + 1 < len(profile) and profile.times[i + 1] <= horizon:
+                    i += 1
+                due[profile] = profile.positions[i], profile.times[i]
+                profile.index = i + 1
+                if profile.finished:
+                    if self.profiles.get(profile.key) is profile:
+                        self.profiles.pop(profile.key)
+                else:
+                    heapq.heappush(
+                        self._heap,
+                        (profile.times[profile.index], next(self._sequence), profile),
+                    )
+            return due
+
+    def _run(self):
+        while True:
+            due = self._due()
+            self.wakeups += 1
+            for profile, (position, scheduled) in due.items():  # same tick
+                if profile.cancelled:
+                    continue
+                try:
+                    profile.put(position, scheduled)
+                    self.puts += 1
+                except Exception:
+                    logger.exception("Readback update failed: %s", profile.key)
+                    self.cancel(profile.key)
+                    continue
+                if profile.finished and profile.done is not None:
+                    profile.done()
+
+
+motion_scheduler = MotionScheduler()
@@ -2,18 +2,39 @@
 Simulated Piezo X,Y Stage with Velocity-Controlled Readbacks.
 
 Simulates a piezo stage with X, Y with positioners.  Each has a setpoint,
-readback, and velocity control.  Readback will update in a thread during
-each move at constant velocity and time intervals.
+readback, and velocity control.  Readback will update during each move at
+constant velocity and time intervals.  The readback updates of all axes
+are written by one scheduler thread (see ``motion_scheduler``).
 
 ``rb_update_period`` (float):
     Period (s) at which the readback is updated during motion.
-    Empirically, shortest value is 0.004.  Any shorter compromises
-    the position updates.  Default: 0.05
+    Readback puts do not wait for the IOC: when a put is still in
+    progress, only the newest position is written next (older ones are
+    dropped).  Periods as short as 0.001 (1 kHz) may be used.
+    Default: 0.05
 
 ``velocity`` (float):
     Maximum speed (position/s) at which the readback is advanced during
     motion.  Ranges from 0.000_1 (creepy slow) to 100 (almost instantaneous).
     Default: 1.0
+
+``acceleration`` (float):
+    Maximum acceleration (position/s^2).  When 0 (default), velocity
+    changes instantly (constant velocity moves).  Otherwise, moves follow
+    a trapezoid velocity profile (see ``motion_profiles``).
+
+``jerk`` (float):
+    Maximum jerk (position/s^3), used with ``acceleration``.  When 0
+    (default), acceleration changes instantly.  Otherwise, moves follow
+    an S-curve velocity profile.
+
+A whole trajectory (table of times and positions, such as from
+``motion_profiles``) is loaded at once with ``load_trajectory()``.
+
+Timing fidelity: each positioner records (in ``put_timing``, a
+``TimingRecord``) when each readback update was due, when its put was
+issued and completed, and the position.  After each move (or stop()),
+``move_timing`` has the lag and jitter statistics of that move.
 """
 
 # __all__ = ["fastxy"]
@@ -25,22 +46,27 @@ logger.info(__file__)
 print(__file__)
 
 from .. import iconfig
+from .motion_profiles import s_curve_profile
+from .motion_profiles import trapezoid_profile
+from .motion_scheduler import TimingRecord
+from .motion_scheduler import motion_scheduler
 from apstools.devices import PVPositionerSoftDoneWithStop
 from apstools.synApps import SwaitRecord
-from apstools.utils import run_in_thread
 from ophyd import Component
 from ophyd import Device
 from ophyd import EpicsSignal
 from ophyd import FormattedComponent
 from ophyd import Signal
+from ophyd.status import Status
 import numpy as np
+import threading
 import time
 
 
 DEFAULT_UPDATE_PERIOD = 0.05
 DEFAULT_VELOCITY = 1
-DELAY_AFTER_CAPUT = 0.000_1
-LOOP_SLEEP = 0.000_1
+DEFAULT_ACCELERATION = 0  # no limit
+DEFAULT_JERK = 0  # no limit
 MINIMUM_VELOCITY = 0.000_1
 MAXIMUM_VELOCITY = 10_000
 
@@ -82,19 +108,33 @@ class SimulatedConstantVelocityPositioner(PVPositionerSoftDoneWithStop):
     rb_update_period = Component(
         Signal, value=DEFAULT_UPDATE_PERIOD, kind="config"
     )
+    acceleration = Component(Signal, value=DEFAULT_ACCELERATION, kind="config")
+    jerk = Component(Signal, value=DEFAULT_JERK, kind="config")
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.put_timing = TimingRecord()  # of the recent readback updates (ring)
+        self.move_timing = {}  # statistics of the most recent move
+        self._move_start = 0  # put_timing index where the current move started
+        self._put_lock = threading.Lock()
+        self._put_in_progress = False
+        self._put_index = None  # put_timing index of the put in progress
+        self._put_next = None  # (position, scheduled): newest waiting to be put
+        self._trajectory_status = None  # of the trajectory being run
 
     def _setup_move(self, position):
         """Move and do not wait until motion is complete (asynchronous)"""
         super()._setup_move(position)
 
-        self._stop_motion_profile = False
         self.motion_simulator(position)
 
-    @run_in_thread
     def motion_simulator(self, position):
         # Enable the desired simulator (or write a new one).
         # self.move_immediately_to_end(position)
-        self.change_readback_by_linear_steps(position)
+        if abs(self.acceleration.get()) > 0:
+            self.change_readback_by_profile(position)
+        else:
+            self.change_readback_by_linear_steps(position)
 
     def move_immediately_to_end(self, end):
         self.readback.put(end)
@@ -116,24 +156,150 @@ class SimulatedConstantVelocityPositioner(PVPositionerSoftDoneWithStop):
             zip(time.time() + times, positions)
         )
 
+    def change_readback_by_profile(self, end):
+        """Move with limited acceleration (and jerk, if set)."""
+        start = self.readback.get(use_monitor=False)
+        velocity = min(
+            MAXIMUM_VELOCITY, max(MINIMUM_VELOCITY, abs(self.velocity.get()))
+        )
+        acceleration = abs(self.acceleration.get())
+        jerk = abs(self.jerk.get())
+        period = abs(self.rb_update_period.get())
+        if jerk > 0:
+            times, positions = s_curve_profile(
+                start, end, velocity, acceleration, jerk, period
+            )
+        else:
+            times, positions = trapezoid_profile(
+                start, end, velocity, acceleration, period
+            )
+        self.load_trajectory(times, positions)
+
     def update_readback_at_timed_waypoints(self, waypoints):
+        """
+        Schedule readback updates at (absolute time.time(), position) waypoints.
+
+        Replaces any motion profile in progress.  Returns immediately.
+        """
+        times, positions = [], []
         for t, rbv in waypoints:
-            while time.time() < t:
-                if self._stop_motion_profile:  # emergency stop
-                    return
-                time.sleep(LOOP_SLEEP)
+            times.append(t)
+            positions.append(rbv)
+        t0 = time.perf_counter() - time.time()  # time.time() -> perf_counter
+        self._abandon_trajectory()
+        with self._put_lock:
+            self._move_start = len(self.put_timing)
+        motion_scheduler.schedule(
+            self,
+            times,
+            positions,
+            self.write_readback,
+            t0=t0,
+            done=self._move_finished,
+        )
+
+    def load_trajectory(self, times, positions, t0=None):
+        """
+        Run the readback through a whole (times, positions) table.
+
+        'times' (s) are relative to 't0' (a ``time.perf_counter()`` value,
+        default: now).  Replaces any motion profile in progress.  Returns
+        a ``Status``, finished after the last position is written (or
+        finished with an exception if the trajectory is stopped or
+        replaced first).
+        """
+        self._abandon_trajectory()
+        status = Status(obj=self)
+        self._trajectory_status = status
+        with self._put_lock:
+            self._move_start = len(self.put_timing)
+
+        def done():
+            self._move_finished()
+            status.set_finished()
+
+        motion_scheduler.schedule(
+            self,
+            np.asarray(times, dtype=float).tolist(),
+            np.asarray(positions, dtype=float).tolist(),
+            self.write_readback,
+            t0=t0,
+            done=done,
+        )
+        return status
+
+    def _move_finished(self):
+        with self._put_lock:
+            self.move_timing = self.put_timing.statistics(self._move_start)
+        logger.debug("%s move timing: %s", self.name, self.move_timing)
+
+    def reset_put_timing(self):
+        """Forget the timing of earlier readback updates."""
+        with self._put_lock:
+            self.put_timing.reset()
+            self._move_start = 0
+            self._put_index = None
+
+    def _abandon_trajectory(self):
+        status, self._trajectory_status = self._trajectory_status, None
+        if status is not None and not status.done:
+            status.set_exception(RuntimeError(f"{self.name}: trajectory stopped."))
+
+    def write_readback(self, rbv, scheduled):
+        """
+        Put 'rbv' to the readback without waiting for the IOC.
 
-            if self._stop_motion_profile:  # emergency stop
+        If the previous put has not completed, hold 'rbv' until it has,
+        replacing (dropping) any position held before.
+        """
+        with self._put_lock:
+            if self._put_in_progress:
+                if self._put_next is not None:  # record as dropped
+                    stale, t_stale = self._put_next
+                    self.put_timing.add(t_stale, np.nan, stale)
+                self._put_next = (rbv, scheduled)
                 return
+            self._put_in_progress = True
+        self._issue_readback(rbv, scheduled)
+
+    def _issue_readback(self, rbv, scheduled):
+        # put_timing is changed by the scheduler & the CA callback threads
+        with self._put_lock:
+            self._put_index = self.put_timing.add(scheduled, time.perf_counter(), rbv)
+        try:
+            self.readback.put(rbv, use_complete=True, callback=self._readback_put_done)
+        except Exception:
+            with self._put_lock:
+                self._put_in_progress = False
+            raise
+
+    def _readback_put_done(self, *args, **kwargs):
+        """The IOC completed a readback put: write the newest held position."""
+        with self._put_lock:
+            if self._put_index is not None:  # None: reset while in progress
+                self.put_timing.complete(self._put_index)
+            held, self._put_next = self._put_next, None
+            self._put_in_progress = held is not None
+        if held is not None:
+            self._issue_readback(*held)
 
-            self.readback.put(rbv, wait=True)
-            time.sleep(DELAY_AFTER_CAPUT)
+    @property
+    def in_motion(self):
+        """Is the readback being changed by a motion profile?"""
+        return motion_scheduler.active(self)
 
     def stop(self, *, success=False):
         """
         Hold the current readback when stop() is called and not :meth:`inposition`.
         """
-        self._stop_motion_profile = True
+        motion_scheduler.cancel(self)  # emergency stop
+        with self._put_lock:
+            if self._put_next is not None:  # do not move after the stop
+                held, t_held = self._put_next
+                self.put_timing.add(t_held, np.nan, held)  # record as dropped
+                self._put_next = None
+            self.move_timing = self.put_timing.statistics(self._move_start)
+        self._abandon_trajectory()
         super().stop(success=success)
 
 
@@ -233,3 +399,14 @@ else:
         @property
         def inposition(self):
             return self.x.inposition and self.y.inposition
+
+        def load_trajectory(self, times, x_positions, y_positions, t0=None):
+            """
+            Run X & Y through a (times, x, y) table, starting together.
+
+            Returns a ``Status``, finished when both axes are done.
+            """
+            t0 = time.perf_counter() if t0 is None else t0
+            st_x = self.x.load_trajectory(times, x_positions, t0=t0)
+            st_y = self.y.load_trajectory(times, y_positions, t0=t0)
+            return st_x & st_y
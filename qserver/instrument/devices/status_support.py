@@ -0,0 +1,48 @@
+"""
+Wait for ophyd Status objects from a bluesky plan, without polling.
+"""
+
+__all__ = """
+    wait_for_status
+""".split()
+
+import asyncio
+import logging
+
+from bluesky import plan_stubs as bps
+
+logger = logging.getLogger(__name__)
+
+
+def _status_awaitable(status):
+    """Factory of an awaitable which completes when 'status' is done."""
+
+    async def done():
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+
+        def finish():
+            if not future.done():
+                future.set_result(status)
+
+        # callback runs in the thread that finishes the status
+        status.add_callback(lambda st: loop.call_soon_threadsafe(finish))
+        return await future
+
+    return done
+
+
+def wait_for_status(*statuses, timeout=None):
+    """
+    Bluesky plan: wait until all 'statuses' are done.
+
+    The RunEngine is not blocked (and not polled) while waiting.  A status
+    may finish with an exception, check ``status.success`` if that matters.
+    Raises ``bluesky.utils.WaitForTimeoutError`` after 'timeout' seconds.
+    """
+    statuses = [st for st in statuses if st is not None and not st.done]
+    if len(statuses) == 0:
+        yield from bps.null()
+        return
+    kwargs = {} if timeout is None else dict(timeout=timeout)
+    yield from bps.wait_for([_status_awaitable(st) for st in statuses], **kwargs)
@@ -0,0 +1,371 @@
+#!/usr/bin/env python
+
+"""
+Synthetic image frames and scan positions for the M9 flyer.
+
+Replaces the ``fly001`` dataset where it is not available (such as on a
+developer machine) or when a run should be longer than the dataset.
+Frames are generated in vectorised batches, as needed.
+
+Frame content:
+
+``gaussian``
+    Gaussian peak (following the scan position) with background noise.
+``speckle``
+    Ptychography-like far-field speckle: ``|FFT(probe * object)|**2`` of a
+    random phase object illuminated through a circular aperture.
+    (An FFT per frame: for rates of a few hundred frames/s.)
+``counter``
+    Every pixel has the frame number (cheapest, to verify frame order).
+
+Scan patterns (positions, as ``y, x`` pairs like the ``fly001`` dataset):
+``raster``, ``snake``, ``spiral`` (Fermat), and ``random``.
+
+Run as a script for a long-duration soak benchmark::
+
+    python synthetic_frames.py --rate 5000 --duration 3600 --channel soak:image
+
+which reports throughput, memory (RSS), and publish latency periodically.
+"""
+
+__all__ = """
+    SyntheticFrames
+    SyntheticPositions
+    scan_positions
+""".split()
+
+import argparse
+import collections
+import logging
+import numpy as np
+import os
+import resource
+import sys
+import threading
+import time
+
+try:
+    from .frame_pacing import FramePacer
+except ImportError:  # run as a script
+    from frame_pacing import FramePacer
+
+logger = logging.getLogger(__name__)
+
+CONTENTS = "gaussian speckle counter".split()
+SCAN_PATTERNS = "raster snake spiral random".split()
+DEFAULT_BATCH_SIZE = 64
+DEFAULT_CACHED_BATCHES = 2  # current & next: builders work across a boundary
+DEFAULT_SHAPE = (256, 256)
+NOISE_BANK_SIZE = 64  # noise frames, generated once, re-used in random order
+GOLDEN_ANGLE = np.pi * (3 - np.sqrt(5))
+
+
+def scan_positions(pattern="snake", n=10_000, extent=1.0, seed=0):
+    """
+    Return an (n, 2) array of (y, x) positions for the scan 'pattern'.
+
+    Positions are within ``-extent/2 .. +extent/2`` on both axes.
+    """
+    if pattern not in SCAN_PATTERNS:
+        raise ValueError(
+            f"Unknown scan pattern {pattern!r}.  Use one of {SCAN_PATTERNS}."
+        )
+    half = extent / 2
+    if pattern in ("raster", "snake"):
+        side = max(1, int(np.ceil(np.sqrt(n))))
+        k = np.arange(n)
+        row, col = np.divmod(k, side)
+        if pattern == "snake":
+            col = np.where(row % 2 == 1, side - 1 - col, col)
+        step = extent / max(1, side - 1)
+        y = -half + row * step
+        x = -half + col * step
+    elif pattern == "spiral":
+        k = np.arange(n)
+        r = half * np.sqrt(k / max(1, n - 1))
+        theta = k * GOLDEN_ANGLE
+        y = r * np.sin(theta)
+        x = r * np.cos(theta)
+    else:
+        rng = np.random.default_rng(seed)
+        y, x = rng.uniform(-half, half, (2, n))
+    return np.column_stack((y, x))
+
+
+class SyntheticPositions:
+    """
+    Positions for 'n_frames' frames, repeating one scan of 'points' positions.
+
+    Array-like: supports ``len()`` and integer indexing.
+    """
+
+    def __init__(self, n_frames, pattern="snake", points=10_000, extent=1.0, seed=0):
+        self.n_frames = n_frames
+        self.table = scan_positions(pattern, min(points, n_frames), extent, seed)
+        self.shape = (n_frames, 2)
+
+    def __len__(self):
+        return self.n_frames
+
+    def __getitem__(self, i):
+        return self.table[i % len(self.table)]
+
+    def take(self, start, stop):
+        """Positions of frames ``start .. stop`` as an array (vectorised)."""
+        return self.table[np.arange(start, stop) % len(self.table)]
+
+
+class SyntheticFrames:
+    """
+    Array-like source of 'n_frames' synthetic frames.
+
+    Supports ``len()``, integer indexing, ``shape`` and ``dtype`` (as used by
+    the M9 frame server in place of the memory-mapped dataset).  Frames are
+    generated in batches of 'batch_size'; the most recently used
+    'cached_batches' are cached.  Each batch is generated once, by the
+    first thread which needs it, while other threads use the cached ones.
+    Frames are reproducible: frame ``i`` depends only on ``i`` and 'seed'.
+    """
+
+    def __init__(
+        self,
+        n_frames,
+        shape=DEFAULT_SHAPE,
+        dtype="uint16",
+        content="gaussian",
+        positions=None,
+        batch_size=DEFAULT_BATCH_SIZE,
+        noise=0.02,
+        seed=0,
+        cached_batches=DEFAULT_CACHED_BATCHES,
+    ):
+        if content not in CONTENTS:
+            raise ValueError(f"Unknown content {content!r}.  Use one of {CONTENTS}.")
+        self.n_frames = n_frames
+        self.frame_shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        self.content = content
+        self.positions = positions or SyntheticPositions(n_frames)
+        self.batch_size = batch_size
+        self.noise = noise
+        self.seed = seed
+        self.cached_batches = max(1, int(cached_batches))
+        if self.dtype.kind in "ui":
+            self.full_scale = 0.8 * np.iinfo(self.dtype).max
+        else:
+            self.full_scale = 1.0
+
+        rows, cols = self.frame_shape
+        self._y = np.linspace(-0.5, 0.5, rows)
+        self._x = np.linspace(-0.5, 0.5, cols)
+        yy, xx = np.meshgrid(self._y, self._x, indexing="ij")
+        self._aperture = (xx**2 + yy**2) < 0.1**2  # speckle probe
+        self._noise_bank = None
+        self._batches = collections.OrderedDict()  # start: frames (LRU)
+        self._pending = {}  # start: threading.Event, batch being generated
+        self._lock = threading.Lock()  # builder threads share the batches
+
+    @property
+    def shape(self):
+        return (self.n_frames, *self.frame_shape)
+
+    def __len__(self):
+        return self.n_frames
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += self.n_frames
+        if not 0 <= i < self.n_frames:
+            raise IndexError(f"Frame {i} is out of range (0..{self.n_frames - 1}).")
+        start = i - i % self.batch_size
+        with self._lock:
+            batch = self._batches.get(start)
+            if batch is not None:
+                self._batches.move_to_end(start)
+                return batch[i - start]
+            pending = self._pending.get(start)
+            if pending is None:  # this thread generates the batch
+                event = self._pending[start] = threading.Event()
+        if pending is not None:  # another thread is generating it
+            pending.wait()
+            with self._lock:
+                batch = self._batches.get(start)
+            if batch is not None:
+                return batch[i - start]
+            return self.batch(start)[i - start]  # already evicted (or failed)
+
+        try:
+            batch = self.batch(start)
+            with self._lock:
+                self._batches[start] = batch
+                while len(self._batches) > self.cached_batches:
+                    self._batches.popitem(last=False)
+        finally:
+            with self._lock:
+                del self._pending[start]
+            event.set()
+        return batch[i - start]
+
+    def batch(self, start):
+        """Generate frames ``start .. start+batch_size`` (fewer at the end)."""
+        stop = min(start + self.batch_size, self.n_frames)
+        rng = np.random.default_rng((self.seed, start))
+        n = stop - start
+        if self.content == "counter":
+            index = np.arange(start, stop).astype(self.dtype)
+            return np.broadcast_to(index[:, None, None], (n, *self.frame_shape)).copy()
+        if self.content == "gaussian":
+            signal = self._gaussian(start, stop)
+        else:
+            signal = self._speckle(rng, n)
+        if self.noise > 0:
+            signal += self._noise(rng, n)
+        np.clip(signal, 0, 1, out=signal)
+        signal *= self.full_scale
+        return signal.astype(self.dtype)
+
+    def _noise(self, rng, n):
+        """Background noise for 'n' frames, drawn from a bank of noise frames."""
+        if self._noise_bank is None:
+            bank = np.random.default_rng(self.seed).standard_normal(
+                (NOISE_BANK_SIZE, *self.frame_shape), dtype=np.float32
+            )
+            self._noise_bank = self.noise * bank
+        return self._noise_bank[rng.integers(0, NOISE_BANK_SIZE, n)]
+
+    def _gaussian(self, start, stop, sigma=0.05):
+        """Gaussian peaks centred on the (scaled) scan positions."""
+        yx = self.positions.take(start, stop)
+        extent = max(1e-12, np.ptp(self.positions.table))
+        centre = 0.6 * yx / extent  # keep the peaks inside the frame
+        gy = np.exp(-((self._y[None, :] - centre[:, 0:1]) ** 2) / (2 * sigma**2))
+        gx = np.exp(-((self._x[None, :] - centre[:, 1:2]) ** 2) / (2 * sigma**2))
+        return np.einsum("br,bc->brc", gy.astype(np.float32), gx.astype(np.float32))
+
+    def _speckle(self, rng, n):
+        """Far-field speckle of random phase objects, log-scaled to 0..1."""
+        phase = rng.uniform(0, 2 * np.pi, (n, *self.frame_shape))
+        exit_wave = self._aperture * np.exp(1j * phase)
+        intensity = np.abs(np.fft.fftshift(np.fft.fft2(exit_wave), axes=(1, 2))) ** 2
+        signal = np.log1p(intensity).astype(np.float32)
+        signal /= signal.max(axis=(1, 2), keepdims=True)
+        return signal
+
+
+def rss_megabytes():
+    """Resident memory of this process (MB)."""
+    try:
+        with open("/proc/self/statm") as f:
+            pages = int(f.read().split()[1])
+        return pages * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except (OSError, ValueError):
+        # peak, not current, where /proc is not available (kB on Linux)
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def soak(
+    rate,
+    duration,
+    frames,
+    channel=None,
+    report_interval=10,
+    stream=sys.stdout,
+):
+    """
+    Publish synthetic 'frames' at 'rate' for 'duration' seconds.
+
+    Every 'report_interval' seconds, write throughput, memory (RSS) and
+    publish latency (time after each frame's deadline until published).
+    Frames are only generated (not published) if 'channel' is None.
+    Unpaced (``rate=0``): publish as fast as possible for 'duration'.
+    Return the final pacing statistics (dict).
+    """
+    server = None
+    if channel is not None:
+        try:
+            from .blueskyImageServer import BlueskyImageServer
+        except ImportError:  # run as a script
+            from blueskyImageServer import BlueskyImageServer
+
+        server = BlueskyImageServer(channel)
+        server.start()
+
+    n = min(len(frames), int(rate * duration) if rate > 0 else len(frames))
+    pacer = FramePacer(rate)
+    latency = np.zeros(max(16, int(1.5 * max(rate, 1_000) * report_interval)))
+    n_latency = 0
+    rss_start = rss_megabytes()
+    stream.write(
+        f"{'elapsed/s':>10} {'frames':>10} {'frames/s':>10} {'RSS/MB':>8}"
+        f" {'growth/MB':>10} {'p50/ms':>8} {'p99/ms':>8} {'max/ms':>8}\n"
+    )
+
+    def report(now, interval_frames, interval):
+        rss = rss_megabytes()
+        samples = latency[:n_latency] * 1e3
+        p50, p99 = np.percentile(samples, [50, 99]) if n_latency else (0, 0)
+        worst = samples.max() if n_latency else 0
+        stream.write(
+            f"{now - pacer.t0:10.1f} {pacer.published:10d}"
+            f" {interval_frames / interval:10.1f} {rss:8.1f} {rss - rss_start:10.1f}"
+            f" {p50:8.3f} {p99:8.3f} {worst:8.3f}\n"
+        )
+        stream.flush()
+
+    pacer.start()
+    t_report = pacer.t0
+    published_at_report = 0
+    for i in range(n):
+        if not pacer.wait(i):
+            continue
+        frame = frames[i]
+        if server is not None:
+            server.updateFrame(frame)
+        now = time.perf_counter()
+        if n_latency < len(latency):
+            latency[n_latency] = now - pacer.deadline(i) if rate > 0 else 0
+            n_latency += 1
+        if now - t_report >= report_interval:
+            report(now, pacer.published - published_at_report, now - t_report)
+            t_report = now
+            published_at_report = pacer.published
+            n_latency = 0
+        if rate <= 0 and now - pacer.t0 >= duration:
+            break
+
+    if server is not None:
+        server.stop()
+    stats = pacer.statistics()
+    stats["rss_growth_mb"] = rss_megabytes() - rss_start
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Synthetic frame soak benchmark")
+    parser.add_argument("--rate", type=float, default=1_000, help="frames/s (0: unpaced)")
+    parser.add_argument("--duration", type=float, default=60, help="run time, s")
+    parser.add_argument("--rows", type=int, default=DEFAULT_SHAPE[0])
+    parser.add_argument("--cols", type=int, default=DEFAULT_SHAPE[1])
+    parser.add_argument("--dtype", default="uint16")
+    parser.add_argument("--content", default="gaussian", choices=CONTENTS)
+    parser.add_argument("--pattern", default="snake", choices=SCAN_PATTERNS)
+    parser.add_argument("--channel", default=None, help="PVA channel (default: do not publish)")
+    parser.add_argument("--report", type=float, default=10, help="report interval, s")
+    args = parser.parse_args()
+
+    # unpaced: enough frames for any rate, the soak stops after 'duration'
+    n_frames = int(args.rate * args.duration) if args.rate > 0 else 2**40
+    frames = SyntheticFrames(
+        n_frames,
+        shape=(args.rows, args.cols),
+        dtype=args.dtype,
+        content=args.content,
+        positions=SyntheticPositions(n_frames, pattern=args.pattern),
+    )
+    stats = soak(args.rate, args.duration, frames, args.channel, args.report)
+    for k, v in stats.items():
+        print(f"{k}: {v}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,264 @@
+"""
+Monitor signals during a run, writing their updates as event pages.
+
+``bpp.monitor_during_wrapper`` emits one event document per monitor
+update: at high update rates, that floods the document pipeline (and
+the database).  :func:`buffered_monitor_wrapper` buffers each signal's
+updates instead and writes them in bulk (``event_page`` documents), to
+the same ``<signal name>_monitor`` streams, when:
+
+* a buffer holds 'page_size' updates, or
+* 'flush_interval' seconds passed since the last flush,
+
+(both checked as the plan's messages go by) and when the run closes.
+While the plan waits (``wait_for``, such as a fly motion's status), the
+wait is split into 'flush_interval' slices, with a flush after each.
+Each event page has at most 'page_size' updates.
+
+Updates may also be decimated as they arrive:
+
+'min_interval'
+    Keep at most one update per 'min_interval' seconds.
+'deadband'
+    Keep an update only if it differs from the last one kept by at least
+    'deadband'.
+
+The last update is always kept, so the stream ends at the final value.
+
+**Example**::
+
+    @buffered_monitor_decorator([xy.x.readback, xy.y.readback], deadband=0.01)
+    @bpp.run_decorator()
+    def plan():
+        ...
+"""
+
+__all__ = """
+    MonitorBuffer
+    buffered_monitor_decorator
+    buffered_monitor_wrapper
+""".split()
+
+import logging
+import threading
+import time
+
+from bluesky import plan_stubs as bps
+from bluesky.preprocessors import plan_mutator
+from bluesky.preprocessors import single_gen
+from bluesky.run_engine import WaitForTimeoutError
+from bluesky.utils import make_decorator
+from ophyd.status import Status
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PAGE_SIZE = 1_000  # updates
+DEFAULT_FLUSH_INTERVAL = 1.0  # s
+
+
+class MonitorBuffer:
+    """
+    Buffer the updates of one signal, collect them as event pages.
+
+    Flyer-like: :meth:`kickoff` subscribes, :meth:`complete` unsubscribes,
+    :meth:`collect_pages` yields (and forgets) the buffered updates, in
+    pages of at most 'page_size' updates.
+
+    Counters: ``received``, ``kept`` (after decimation), ``collected``.
+    """
+
+    def __init__(
+        self, signal, min_interval=None, deadband=None, stream=None, page_size=None
+    ):
+        self.signal = signal
+        self.name = f"{signal.name}_buffer"
+        self.parent = None
+        self.stream = stream or f"{signal.name}_monitor"
+        self.min_interval = min_interval
+        self.deadband = deadband
+        self.page_size = page_size
+
+        self.received = 0
+        self.kept = 0
+        self.collected = 0
+        self._lock = threading.Lock()
+        self._times = []
+        self._values = []
+        self._last_kept = None  # (timestamp, value)
+        self._held = None  # (timestamp, value): latest update, not kept
+        self._subscription = None
+
+    def __len__(self):
+        return len(self._times)
+
+    def _keep(self, timestamp, value):
+        if self._last_kept is None:
+            return True
+        t_kept, v_kept = self._last_kept
+        if self.min_interval and timestamp - t_kept < self.min_interval:
+            return False
+        if self.deadband:
+            try:
+                return abs(value - v_kept) >= self.deadband
+            except TypeError:  # not a number: keep every change
+                return value != v_kept
+        return True
+
+    def _update(self, value=None, timestamp=None, **kwargs):
+        timestamp = time.time() if timestamp is None else timestamp
+        with self._lock:
+            self.received += 1
+            if self._keep(timestamp, value):
+                self._times.append(timestamp)
+                self._values.append(value)
+                self._last_kept = (timestamp, value)
+                self._held = None
+                self.kept += 1
+            else:
+                self._held = (timestamp, value)
+
+    def kickoff(self):
+        """Start buffering (the first update is the current value)."""
+        if self._subscription is None:
+            self._subscription = self.signal.subscribe(self._update, run=True)
+        status = Status(obj=self)
+        status.set_finished()
+        return status
+
+    def complete(self):
+        """Stop buffering, keep the last update if it was decimated."""
+        if self._subscription is not None:
+            self.signal.unsubscribe(self._subscription)
+            self._subscription = None
+        with self._lock:
+            if self._held is not None:
+                self._times.append(self._held[0])
+                self._values.append(self._held[1])
+                self._last_kept, self._held = self._held, None
+                self.kept += 1
+        status = Status(obj=self)
+        status.set_finished()
+        return status
+
+    def describe_collect(self):
+        return {self.stream: self.signal.describe()}
+
+    def collect_pages(self):
+        """Yield the buffered updates as event pages (of 'page_size' at most)."""
+        with self._lock:
+            times, self._times = self._times, []
+            values, self._values = self._values, []
+        key = self.signal.name
+        size = self.page_size or len(times)
+        for i in range(0, len(times), size):
+            page_times = times[i : i + size]
+            self.collected += len(page_times)
+            yield dict(
+                time=page_times,
+                data={key: values[i : i + size]},
+                timestamps={key: page_times},
+            )
+
+
+def buffered_monitor_wrapper(
+    plan,
+    signals,
+    page_size=DEFAULT_PAGE_SIZE,
+    flush_interval=DEFAULT_FLUSH_INTERVAL,
+    min_interval=None,
+    deadband=None,
+):
+    """
+    Monitor 'signals' during runs, writing their updates as event pages.
+
+    Like ``bpp.monitor_during_wrapper``: buffering starts just after the
+    run opens, the last pages are written just before it closes.
+    """
+    buffers = [
+        MonitorBuffer(
+            signal,
+            min_interval=min_interval,
+            deadband=deadband,
+            page_size=page_size,
+        )
+        for signal in signals
+    ]
+    state = dict(
+        open=False, flushing=False, waiting=False, last_flush=time.monotonic()
+    )
+
+    def flush(final=False):
+        state["flushing"] = True
+        try:
+            for buffer in buffers:
+                if final:
+                    buffer.complete()
+                if len(buffer) > 0:
+                    yield from bps.collect(buffer, return_payload=False)
+        finally:
+            state["flushing"] = False
+            state["last_flush"] = time.monotonic()
+
+    def start():
+        for buffer in buffers:
+            buffer.kickoff()
+        state["open"] = True
+        state["last_flush"] = time.monotonic()
+        yield from bps.null()
+
+    def flush_due():
+        if time.monotonic() - state["last_flush"] >= flush_interval:
+            return True
+        return any(len(buffer) >= page_size for buffer in buffers)
+
+    def sliced_wait_for(msg):
+        """Wait as 'msg' does, flushing every 'flush_interval' meanwhile."""
+        state["waiting"] = True
+        try:
+            timeout = msg.kwargs.get("timeout")
+            deadline = None if timeout is None else time.monotonic() + timeout
+            if flush_due():
+                yield from flush()
+            while True:
+                now = time.monotonic()
+                kwargs = dict(msg.kwargs)
+                kwargs["timeout"] = max(
+                    0, flush_interval - (now - state["last_flush"])
+                )
+                last_slice = deadline is not None and (
+                    deadline - now <= kwargs["timeout"]
+                )
+                if last_slice:
+                    kwargs["timeout"] = max(0, deadline - now)
+                try:
+                    return (yield msg._replace(kwargs=kwargs))
+                except WaitForTimeoutError:
+                    if last_slice:
+                        raise
+                yield from flush()
+        finally:
+            state["waiting"] = False
+
+    def insert_messages(msg):
+        if state["waiting"]:
+            return None, None  # messages of sliced_wait_for()
+        if msg.command == "open_run":
+            return single_gen(msg), start()
+        if msg.command == "close_run" and state["open"]:
+            state["open"] = False
+
+            def final_flush_then_close():
+                yield from flush(final=True)
+                return (yield msg)
+
+            return final_flush_then_close(), None
+        if msg.command == "wait_for" and state["open"] and not state["flushing"]:
+            return sliced_wait_for(msg), None
+        if state["open"] and not state["flushing"] and flush_due():
+            return None, flush()
+        return None, None
+
+    return (yield from plan_mutator(plan, insert_messages))
+
+
+buffered_monitor_decorator = make_decorator(buffered_monitor_wrapper)
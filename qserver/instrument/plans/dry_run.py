@@ -0,0 +1,407 @@
+"""
+Dry runs of trajectory scans on a virtual clock (no EPICS, no waiting).
+
+The virtual stage and detector change their signals on timers of a
+:class:`VirtualClock`.  :func:`virtual_clock_wrapper` advances that clock
+instead of waiting: ``sleep`` moves the clock ahead, ``wait`` and
+``wait_for`` move it to when the pending motions finish.  Signal updates
+carry virtual timestamps, so the run's monitor streams look like those
+of a real scan (and ``correlate_frames`` works on them).
+
+The plan is the real one: ``trajectory_scan`` (the scan of
+``trajectory_plan``), given the virtual stage & detector.
+
+A scan runs as fast as its documents can be made, and :func:`dry_run`
+reports the (virtual) duration it would have had.
+
+**Example**::
+
+    clock = VirtualClock()
+    stage = VirtualXyStage("", name="fastxy", clock=clock)
+    detector = VirtualDetector("", name="adsimdet", clock=clock)
+    report = dry_run(
+        trajectory_scan(detector, stage, -500, 500, -500, 500, 1000, path="spiral"),
+        clock,
+    )
+    print(report["virtual_duration"], report["wall_duration"])
+
+or, as a script::
+
+    python dry_run.py --path spiral --n-points 10000 --mode fly
+"""
+
+__all__ = """
+    VirtualCam
+    VirtualClock
+    VirtualDetector
+    VirtualPlugin
+    VirtualPositioner
+    VirtualXyStage
+    dry_run
+    virtual_clock_wrapper
+""".split()
+
+import heapq
+import itertools
+import logging
+import time
+
+import numpy as np
+from bluesky import RunEngine
+from bluesky import plan_stubs as bps
+from bluesky.preprocessors import plan_mutator
+from bluesky.run_engine import WaitForTimeoutError
+from ophyd import Component
+from ophyd import Device
+from ophyd import Signal
+from ophyd.status import Status
+
+try:
+    from ..devices.motion_profiles import s_curve_profile
+    from ..devices.motion_profiles import trapezoid_profile
+    from .trajectory_scan import trajectory_scan
+except ImportError:  # run as a script
+    import pathlib
+    import sys
+
+    sys.path.append(str(pathlib.Path(__file__).parent.parent / "devices"))
+    from motion_profiles import s_curve_profile
+    from motion_profiles import trapezoid_profile
+    from trajectory_scan import trajectory_scan
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_UPDATE_PERIOD = 0.01  # s, readback updates & detector frames
+DEFAULT_VELOCITY = 1
+MAXIMUM_VELOCITY = 10_000  # as the simulated piezo axis
+
+
+class VirtualClock:
+    """
+    Simulated time: timers run in order as the clock is advanced.
+
+    ``t`` is the virtual time (s) since the clock started; ``now()`` is
+    that time as an epoch timestamp.  ``pending`` has the statuses of
+    the virtual motions not yet finished.
+    """
+
+    def __init__(self, epoch=None):
+        self.epoch = time.time() if epoch is None else epoch
+        self.t = 0.0
+        self.pending = set()
+        self.timers_run = 0
+        self._timers = []  # (t, sequence, callback)
+        self._sequence = itertools.count()
+
+    def now(self):
+        return self.epoch + self.t
+
+    def call_at(self, t, callback):
+        """Call ``callback()`` at virtual time 't'."""
+        heapq.heappush(self._timers, (max(t, self.t), next(self._sequence), callback))
+
+    def call_later(self, delay, callback):
+        self.call_at(self.t + delay, callback)
+
+    def advance_to(self, t):
+        """Run the timers due until virtual time 't', in order."""
+        while self._timers and self._timers[0][0] <= t:
+            self.t, _seq, callback = heapq.heappop(self._timers)
+            callback()
+            self.timers_run += 1
+        self.t = max(self.t, t)
+
+    def advance(self, delay):
+        self.advance_to(self.t + delay)
+
+    def run_until_done(self, timeout=None):
+        """
+        Run timers until all pending motions are finished (or for
+        'timeout' s).  Return True if they are.
+        """
+        end = None if timeout is None else self.t + timeout
+        while self._timers and any(not st.done for st in list(self.pending)):
+            if end is not None and self._timers[0][0] > end:
+                self.advance_to(end)
+                break
+            self.advance_to(self._timers[0][0])
+        self.pending = {st for st in list(self.pending) if not st.done}
+        return len(self.pending) == 0
+
+    def status(self, obj):
+        """A new ``Status`` for a virtual motion (pending until finished)."""
+        status = Status(obj=obj)
+        self.pending.add(status)
+        status.add_callback(lambda st: self.pending.discard(st))
+        return status
+
+
+class VirtualPositioner(Device):
+    """
+    Positioner which moves (on the clock) like the simulated piezo axis.
+
+    Same configuration as ``SimulatedConstantVelocityPositioner``:
+    velocity, acceleration & jerk (0: no limit), rb_update_period.
+    """
+
+    readback = Component(Signal, value=0.0, kind="hinted")
+    setpoint = Component(Signal, value=0.0, kind="normal")
+    velocity = Component(Signal, value=DEFAULT_VELOCITY, kind="config")
+    acceleration = Component(Signal, value=0, kind="config")
+    jerk = Component(Signal, value=0, kind="config")
+    rb_update_period = Component(Signal, value=DEFAULT_UPDATE_PERIOD, kind="config")
+
+    def __init__(self, *args, clock=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.readback.name = self.name  # as PVPositioner does
+        self.clock = clock
+        self._motion = 0  # timers of older motions are ignored
+        self._status = None
+
+    @property
+    def position(self):
+        return self.readback.get()
+
+    def set(self, value):
+        start = self.readback.get()
+        velocity = abs(self.velocity.get())
+        acceleration = abs(self.acceleration.get())
+        jerk = abs(self.jerk.get())
+        period = abs(self.rb_update_period.get())
+        if start == value:
+            times, positions = np.zeros(1), np.array([value], dtype=float)
+        elif acceleration > 0 and jerk > 0:
+            times, positions = s_curve_profile(
+                start, value, velocity, acceleration, jerk, period
+            )
+        elif acceleration > 0:
+            times, positions = trapezoid_profile(
+                start, value, velocity, acceleration, period
+            )
+        else:
+            duration = abs(value - start) / velocity
+            times = np.linspace(0, duration, 1 + max(1, int(duration / period)))
+            positions = np.linspace(start, value, times.size)
+        self.setpoint.put(value, timestamp=self.clock.now())
+        return self.load_trajectory(times, positions)
+
+    def load_trajectory(self, times, positions, t0=None):
+        """Readback follows the (times, positions) table from 't0' (default: now)."""
+        self.stop()
+        self._motion += 1
+        motion = self._motion
+        status = self.clock.status(self)
+        self._status = status
+        t0 = self.clock.t if t0 is None else t0
+
+        def update(position, last):
+            if motion != self._motion:
+                return  # stopped, or replaced by a newer motion
+            self.readback.put(position, timestamp=self.clock.now())
+            if last:
+                status.set_finished()
+
+        n = len(times)
+        for i, (t, position) in enumerate(zip(times, positions)):
+            self.clock.call_at(
+                t0 + t, lambda p=float(position), last=(i == n - 1): update(p, last)
+            )
+        return status
+
+    def stop(self, *, success=False):
+        self._motion += 1
+        status, self._status = self._status, None
+        if status is not None and not status.done:
+            # hold where stopped, as PVPositionerSoftDoneWithStop does
+            self.setpoint.put(self.readback.get(), timestamp=self.clock.now())
+            status.set_exception(RuntimeError(f"{self.name}: motion stopped."))
+
+
+class VirtualXyStage(Device):
+    x = Component(VirtualPositioner, "", clock=None)
+    y = Component(VirtualPositioner, "", clock=None)
+
+    def __init__(self, *args, clock=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.x.clock = self.y.clock = clock
+
+    def load_trajectory(self, times, x_positions, y_positions):
+        t0 = self.x.clock.t
+        st_x = self.x.load_trajectory(times, x_positions, t0=t0)
+        st_y = self.y.load_trajectory(times, y_positions, t0=t0)
+        return st_x & st_y
+
+
+class VirtualCam(Device):
+    """The area detector's cam: the signals ``trajectory_scan`` uses."""
+
+    acquire = Component(Signal, value=0, kind="omitted")
+    acquire_time = Component(Signal, value=0.001, kind="config")
+    acquire_period = Component(Signal, value=DEFAULT_UPDATE_PERIOD, kind="config")
+    image_mode = Component(Signal, value="Continuous", kind="config")
+    trigger_mode = Component(Signal, value="Internal", kind="config")
+    num_exposures = Component(Signal, value=1, kind="config")
+    array_counter = Component(Signal, value=0, kind="normal")
+
+
+class VirtualPlugin(Device):
+    """An area detector plugin (enabled or not), counting its arrays."""
+
+    enable = Component(Signal, value="Enable", kind="config")
+    array_counter = Component(Signal, value=0, kind="normal")
+
+    def enable_on_stage(self):
+        self.stage_sigs["enable"] = 1
+
+    def disable_on_stage(self):
+        self.stage_sigs["enable"] = 0
+
+
+class VirtualDetector(Device):
+    """
+    Detector which acquires frames (on the clock) while ``cam.acquire`` is 1.
+
+    Each frame increments ``cam.array_counter`` and, 'pva_delay' later,
+    ``pva.array_counter``.
+    """
+
+    cam = Component(VirtualCam, "")
+    pva = Component(VirtualPlugin, "")
+    hdf1 = Component(VirtualPlugin, "")
+
+    def __init__(self, *args, clock=None, pva_delay=0.0005, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.clock = clock
+        self.pva_delay = pva_delay
+        self._acquisition = 0
+        self.cam.acquire.subscribe(self._acquire_changed, run=False)
+
+    def _acquire_changed(self, value=None, **kwargs):
+        self._acquisition += 1
+        if value:
+            acquisition = self._acquisition
+            self.clock.call_later(
+                self.cam.acquire_period.get(), lambda: self._frame(acquisition)
+            )
+
+    def _frame(self, acquisition):
+        if acquisition != self._acquisition:
+            return  # acquisition stopped
+        counter = self.cam.array_counter.get() + 1
+        self.cam.array_counter.put(counter, timestamp=self.clock.now())
+
+        def received():
+            self.pva.array_counter.put(counter, timestamp=self.clock.now())
+
+        self.clock.call_later(self.pva_delay, received)
+        self.clock.call_later(
+            self.cam.acquire_period.get(), lambda: self._frame(acquisition)
+        )
+
+
+def virtual_clock_wrapper(plan, clock):
+    """
+    Run 'plan' on the virtual 'clock', without waiting.
+
+    ``sleep`` advances the clock instead.  ``wait`` & ``wait_for`` first
+    run the clock until the pending virtual motions finish, then wait
+    (now, without delay) as usual.  A ``wait_for`` with a 'timeout' runs
+    the clock for that long at most, then times out if motions are still
+    pending.
+    """
+
+    def advance(msg):
+        clock.advance(msg.args[0])
+        return (yield from bps.null())
+
+    def run_clock(msg):
+        timeout = msg.kwargs.get("timeout") if msg.command == "wait_for" else None
+        if not clock.run_until_done(timeout):
+            raise WaitForTimeoutError("Plan failed to complete in the specified time")
+        return (yield msg)
+
+    def insert_messages(msg):
+        if msg.command == "sleep":
+            return advance(msg), None
+        if msg.command in ("wait", "wait_for"):
+            return run_clock(msg), None
+        return None, None
+
+    return (yield from plan_mutator(plan, insert_messages))
+
+
+def dry_run(plan, clock, RE=None):
+    """
+    Run 'plan' on the virtual 'clock', return a report (dict).
+
+    ``virtual_duration``: how long the plan would have taken (s);
+    ``wall_duration``: how long it did take.
+    """
+    RE = RE or RunEngine({})
+    counts = {}
+
+    def count(name, doc):
+        counts[name] = counts.get(name, 0) + 1
+
+    token = RE.subscribe(count)
+    t_virtual, t_wall = clock.t, time.monotonic()
+    try:
+        RE(virtual_clock_wrapper(plan, clock))
+    finally:
+        RE.unsubscribe(token)
+    report = dict(
+        virtual_duration=clock.t - t_virtual,
+        wall_duration=time.monotonic() - t_wall,
+        timers=clock.timers_run,
+        documents=counts,
+    )
+    report["speedup"] = report["virtual_duration"] / max(report["wall_duration"], 1e-9)
+    return report
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Dry run of a trajectory scan.")
+    parser.add_argument("--region", type=float, nargs=4, default=[-500, 500, -500, 500],
+                        metavar=("X0", "X1", "Y0", "Y1"))
+    parser.add_argument("--n-points", type=int, default=100)
+    parser.add_argument("--path", default="random",
+                        choices="random raster snake spiral lissajous rings".split())
+    parser.add_argument("--order", default="snake", choices="snake hilbert morton".split())
+    parser.add_argument("--mode", default="step", choices="step fly".split())
+    parser.add_argument("--smooth", action="store_true")
+    parser.add_argument("--vx", type=float, default=100)
+    parser.add_argument("--vy", type=float, default=100)
+    parser.add_argument("--acceleration", type=float, default=0)
+    parser.add_argument("--jerk", type=float, default=0)
+    parser.add_argument("--update-period", type=float, default=DEFAULT_UPDATE_PERIOD)
+    parser.add_argument("--timing-stream", action="store_true")
+    parser.add_argument("--no-monitors", action="store_true",
+                        help="Write no monitor streams (timing only).")
+    args = parser.parse_args()
+
+    clock = VirtualClock()
+    stage = VirtualXyStage("", name="fastxy", clock=clock)
+    detector = VirtualDetector("", name="adsimdet", clock=clock)
+    for axis in (stage.x, stage.y):
+        axis.acceleration.put(args.acceleration)
+        axis.jerk.put(args.jerk)
+    plan = trajectory_scan(
+        detector, stage,
+        *args.region, args.n_points,
+        update_period=args.update_period,
+        vx=args.vx, vy=args.vy,
+        timing_stream=args.timing_stream,
+        path=args.path, order=args.order, mode=args.mode, smooth=args.smooth,
+        monitors=not args.no_monitors,
+        max_velocity=MAXIMUM_VELOCITY,
+        md=dict(dry_run=True),
+    )
+    report = dry_run(plan, clock)
+    for key, value in report.items():
+        print(f"{key}: {value}")
+
+
+if __name__ == "__main__":
+    main()
@@ -15,14 +15,25 @@ from ..devices import adpvadet
 from ..devices import gallery
 from ..devices import image_file_list
 from ..devices import img2pva
+from ..devices.status_support import wait_for_status
+from .rate_control import DEFAULT_MAX_RATE
+from .rate_control import AimdRateController
 # from apstools.devices import AD_plugin_primed
 # from apstools.devices import AD_prime_plugin2
 from bluesky import plan_stubs as bps
 from bluesky import preprocessors as bpp
+from ophyd import Signal
 import datetime
+import itertools
 import time
 import tqdm
 
+# recorded in the run: commanded rate (each frame); commanded, achieved
+# & sustained rates (each rate control interval, and at the end)
+publish_rate = Signal(name="publish_rate", value=0.0)
+achieved_rate = Signal(name="achieved_rate", value=0.0)
+sustained_rate = Signal(name="sustained_rate", value=0.0)
+
 
 def set_next_deadline(deadline, interval):
     while deadline <= time.time():  # until time is in the future
@@ -30,12 +41,53 @@ def set_next_deadline(deadline, interval):
     return deadline
 
 
-def push_images(num_images=4, frame_rate=10, run_time=300, md={}):
+def detector_congestion():
+    """
+    Return (counters, execution_time, queue_use) of the area detector.
+
+    * counters: total of the cam overruns and plugin dropped arrays
+    * execution_time: longest plugin execution time (ms)
+    * queue_use: fullest queue, plugins or publisher (fraction)
+    """
+    plugins = (adpvadet.pva1, adpvadet.tiff1)
+    counters = adpvadet.cam.overrun_counter.get()
+    counters += sum(p.dropped_arrays.get() for p in plugins)
+    execution_time = max(p.execution_time.get() for p in plugins)
+    queue_use = [p.queue_use.get() / max(1, p.queue_size.get()) for p in plugins]
+    queue_use.append(len(img2pva.publisher) / img2pva.publisher.maxsize)
+    return counters, execution_time, max(queue_use)
+
+
+def push_images(
+    num_images=4,
+    frame_rate=10,
+    run_time=300,
+    adaptive=False,
+    max_rate=DEFAULT_MAX_RATE,
+    md={},
+):
+    """
+    Publish gallery frames to the PVA detector at 'frame_rate' frames/s.
+
+    Frames are queued for the publisher thread at their deadlines (the
+    plan does not wait for each one to be published).
+
+    With 'adaptive', 'frame_rate' is the starting rate: the rate is then
+    raised (additively, up to 'max_rate') while the frames are published
+    on time, and cut (by half) on missed deadlines, a lower rate of frames
+    published than commanded, overruns, dropped arrays, slow plugins or
+    full queues (AIMD).  The rate of each frame (``publish_rate``) is
+    recorded.  Stream ``rate_control`` has, once per second and at the
+    end, the commanded and ``achieved_rate`` (frames published) and the
+    highest rate achieved without congestion (``sustained_rate``).
+    """
     _md = dict(
         purpose="push TIFF files to PVaccess PV",
         num_images=num_images,
         frame_rate=frame_rate,
         run_time=run_time,
+        adaptive=adaptive,
+        max_rate=max_rate,
         datetime=str(datetime.datetime.now()),
     )
     _md.update(md)
@@ -50,7 +102,10 @@ def push_images(num_images=4, frame_rate=10, run_time=300, md={}):
 
     adpvadet.cam.stage_sigs["num_images"] = 1_000_000  # num_images
     adpvadet.tiff1.stage_sigs["num_capture"] = 1_000_000  # num_images
-    frame_interval = 1.0 / frame_rate
+    controller = None
+    if adaptive:
+        controller = AimdRateController(frame_rate, max_rate=max_rate)
+    publish_rate.put(frame_rate)
 
     # setup custom file names in TIFF plugin
     yield from bps.mv(
@@ -67,6 +122,7 @@ def push_images(num_images=4, frame_rate=10, run_time=300, md={}):
 
         t0 = time.time()
         frame_deadline = t0
+        frame_interval = 1.0 / frame_rate
         run_deadline = t0 + max(0, run_time)
 
         def detector_stopped():
@@ -84,35 +140,75 @@ def push_images(num_images=4, frame_rate=10, run_time=300, md={}):
                 logger.info("Run time time complete.")
             return result
 
+        publisher = img2pva.publisher
+
         def publish_single_frame(frame):
-            yield from bps.null()
+            delay = frame_deadline - time.time()
+            if delay > 0:
+                yield from bps.sleep(delay)
+            elif controller is not None and -delay > frame_interval:
+                controller.missed_deadline()
+            if len(publisher) >= publisher.maxsize:  # do not block the RE
+                yield from wait_for_status(publisher.last_status)
             # next call is not a bluesky plan
-            img2pva.publish_frame_as_pva(frame)  # runs in thread
-
+            return img2pva.publish_frame_as_pva(frame)  # queued, not copied
+
+        def record_rates():
+            publish_rate.put(controller.rate)
+            achieved_rate.put(controller.achieved_rate)
+            sustained_rate.put(controller.sustained_rate)
+            yield from bps.create("rate_control")
+            yield from bps.read(publish_rate)
+            yield from bps.read(achieved_rate)
+            yield from bps.read(sustained_rate)
+            yield from bps.save()
+
+        if controller is not None:
+            controller.start(publisher.published, detector_congestion()[0])
+        # Frames are queued for publishing without a copy: two buffers,
+        # each re-filled only once all its frames have been published.
+        buffers = [None, None]
+        published = [[], []]  # Status of each frame queued from the buffer
         progress_bar = tqdm.tqdm(desc=f"run time: {run_time} seconds.")
-        while True:
+        for batch in itertools.count():
             "Repeat until run time expires."
             if has_runtime_expired() or detector_stopped():
                 break
-            for frame in gallery.image_file_list(num_images):
+            k = batch % 2
+            yield from wait_for_status(*published[k])
+            buffers[k] = gallery.image_file_list(num_images, out=buffers[k])
+            published[k] = []
+            for frame in buffers[k]:
                 progress_bar.update()
                 if has_runtime_expired() or detector_stopped():
                     break
-                yield from img2pva.wait_server(frame_deadline)
                 # yield from bps.mv(img2pva, item)
-                yield from publish_single_frame(frame)
-                yield from img2pva.wait_server()
+                status = yield from publish_single_frame(frame)
+                published[k].append(status)
                 yield from bps.create()
                 yield from bps.read(adpvadet.cam.array_counter)
                 yield from bps.read(adpvadet.cam.array_rate)
                 yield from bps.read(adpvadet.pva1.execution_time)
                 yield from bps.read(adpvadet.tiff1.execution_time)
+                yield from bps.read(adpvadet.cam.overrun_counter)
+                yield from bps.read(publish_rate)
                 yield from bps.save()
 
+                if controller is not None and controller.due():
+                    # the detector's PVs: once per interval, not every frame
+                    rate = controller.update(
+                        publisher.published, *detector_congestion()
+                    )
+                    frame_interval = 1.0 / rate
+                    yield from record_rates()
                 frame_deadline = set_next_deadline(frame_deadline, frame_interval)
         yield from img2pva.wait_server()
         progress_bar.close()
 
+        if controller is not None:
+            logger.info("Sustained rate: %.1f frames/s", controller.sustained_rate)
+            yield from record_rates()
+
         yield from bps.mv(adpvadet.tiff1.capture, 0)
         yield from bps.mv(adpvadet.cam.acquire, 0)
 
@@ -15,23 +15,99 @@ print(__file__)
 
 from .. import iconfig
 from ..devices import m9_flyer
+from ..devices.datasets import dataset_names
+from ..devices.frame_pacing import OVERRUN_POLICIES
 from bluesky import plans as bp
 from bluesky import plan_stubs as bps
+from bluesky import preprocessors as bpp
 import datetime
 
 
-def m9_push_images(num_images=12_000, frame_rate=1_000, position_chunk_size=100, md={}):
+def m9_push_images(
+    num_images=12_000,
+    frame_rate=1_000,
+    position_chunk_size=100,
+    position_max_age=0.1,
+    overrun_policy="catch_up",
+    builders=0,
+    ring_depth=64,
+    shards=0,
+    dataset=None,
+    md={},
+):
+    """
+    Publish image frames via PVaccess.
+
+    Positions are published in chunks of 'position_chunk_size', or sooner
+    when the oldest is 'position_max_age' seconds old.
+
+    'overrun_policy' (``"catch_up"`` or ``"skip"``) chooses what happens to
+    frames which are late.  The achieved frame rate and timing jitter are
+    recorded in the run (configuration of ``m9_flyer.pacing``).
+
+    With 'builders' > 0, that many threads build frames ahead into a ring
+    of 'ring_depth' slots while one thread publishes them.  Use
+    ``frame_rate=0`` (unpaced) to measure the sustained throughput.
+
+    With 'shards' > 0, frames are published by that many separate
+    processes (not competing with the RunEngine for the GIL).  Shard ``k``
+    publishes frames ``k, k+shards, ...`` on PVA channel
+    ``{PV_PVA_M9_IMAGE}:{k}`` (and the preview & reductions, if enabled,
+    on their channels + ``:{k}``).  Another process republishes all the
+    frames on ``PV_PVA_M9_IMAGE`` too (unless ``M9_SHARD_MERGE`` is false
+    in iconfig.yml), so its clients keep receiving frames.  The channels
+    are listed in the run's ``image_channels`` metadata.
+
+    Frames stop being published if the run is stopped, aborted or paused.
+
+    'dataset' names the frames & positions (from ``DATASETS`` in
+    iconfig.yml).  When it changes, the new dataset is loaded before the
+    frames are published.  Default: the dataset used last.
+    """
+    if overrun_policy not in OVERRUN_POLICIES:
+        raise ValueError(
+            f"Unknown overrun policy {overrun_policy!r}."
+            f"  Use one of {OVERRUN_POLICIES}."
+        )
+    if dataset is None:
+        dataset = m9_flyer.dataset.get()
+    if dataset not in dataset_names():
+        raise KeyError(f"Unknown dataset {dataset!r}.  Known: {dataset_names()}")
+
     _md = dict(
         purpose="publish image frames via PVaccess",
         num_images=num_images,
         frame_rate=frame_rate,
+        position_chunk_size=position_chunk_size,
+        position_max_age=position_max_age,
+        overrun_policy=overrun_policy,
+        builders=builders,
+        ring_depth=ring_depth,
+        shards=shards,
+        dataset=dataset,
         datetime=str(datetime.datetime.now()),
     )
+    if shards > 0:
+        _md["image_channels"] = [
+            f"{iconfig['PV_PVA_M9_IMAGE']}:{k}" for k in range(shards)
+        ]
+        if iconfig.get("M9_SHARD_MERGE", True):
+            _md["image_channels"].insert(0, iconfig["PV_PVA_M9_IMAGE"])
     _md.update(md)
 
+    def stop_publishing():
+        if m9_flyer.publishing:
+            yield from bps.stop(m9_flyer)
+
     yield from bps.mv(
         m9_flyer.frame_rate, frame_rate,
         m9_flyer.num_images, num_images,
         m9_flyer.position_chunk_size, position_chunk_size,
+        m9_flyer.position_max_age, position_max_age,
+        m9_flyer.overrun_policy, overrun_policy,
+        m9_flyer.builders, builders,
+        m9_flyer.ring_depth, ring_depth,
+        m9_flyer.shards, shards,
+        m9_flyer.dataset, dataset,
     )
-    yield from bp.fly([m9_flyer], md=_md)
+    yield from bpp.finalize_wrapper(bp.fly([m9_flyer], md=_md), stop_publishing())
@@ -0,0 +1,149 @@
+"""
+Adaptive (AIMD) control of the image publish rate.
+
+Additive increase, multiplicative decrease: while the pipeline keeps
+up, raise the rate by a fixed step each update interval; when it shows
+congestion, cut the rate by a factor.  The rate settles just below the
+highest rate the pipeline sustains.
+
+The achieved rate is measured from the frames actually published in
+each interval, so a publishing loop which cannot keep up is congestion
+too.  Congestion is any of (since the previous update):
+
+* a frame deadline was missed,
+* fewer than 'keep_up' of the commanded frames were published,
+* the pvaDriver ``overrun_counter`` increased,
+* a plugin's ``dropped_arrays`` increased,
+* a plugin's ``execution_time`` used more than 'headroom' of the frame
+  period,
+* a plugin's queue (or the publisher's queue) was more than
+  'queue_limit' full.
+"""
+
+__all__ = """
+    AimdRateController
+""".split()
+
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_RATE = 1_000.0  # frames/s
+
+
+class AimdRateController:
+    """
+    Find the highest publish rate the pipeline sustains (AIMD).
+
+    Call :meth:`start` when publishing starts, :meth:`missed_deadline`
+    for each frame published late, and :meth:`update` (with the number
+    of frames published and the detector's counters) whenever
+    :meth:`due`, once every 'interval' seconds.  The rate then changes:
+    ``+increase`` (frames/s) if there was no congestion, ``*decrease`` if
+    there was.
+
+    ``achieved_rate`` is the rate measured in the last interval.
+    ``sustained_rate`` is the highest achieved rate of an interval
+    without congestion.
+    """
+
+    def __init__(
+        self,
+        rate,
+        min_rate=1.0,
+        max_rate=DEFAULT_MAX_RATE,
+        increase=None,
+        decrease=0.5,
+        interval=1.0,
+        headroom=0.8,
+        queue_limit=0.5,
+        keep_up=0.9,
+    ):
+        self.rate = float(rate)
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.increase = increase or max(1.0, 0.1 * rate)  # frames/s per interval
+        self.decrease = decrease
+        self.interval = interval
+        self.headroom = headroom
+        self.queue_limit = queue_limit
+        self.keep_up = keep_up
+
+        self.achieved_rate = 0.0
+        self.sustained_rate = 0.0
+        self.increases = 0
+        self.decreases = 0
+        self.missed = 0  # deadlines missed in this interval
+        self._counters = None  # overruns + dropped, at the previous update
+        self._published = 0  # frames published, at the previous update
+        self._t_update = time.monotonic()
+
+    @property
+    def period(self):
+        return 1.0 / self.rate
+
+    def start(self, published=0, counters=None):
+        """Start the first interval now, from these totals."""
+        self._published = published
+        self._counters = counters
+        self.missed = 0
+        self._t_update = time.monotonic()
+
+    def due(self):
+        """Is it time to :meth:`update` the rate?"""
+        return time.monotonic() - self._t_update >= self.interval
+
+    def missed_deadline(self):
+        """A frame was published more than one period after its deadline."""
+        self.missed += 1
+
+    def congested(self, counters, execution_time=0, queue_use=0):
+        """
+        Is the detector congested?
+
+        'counters': total of overrun & dropped-array counters.
+        'execution_time': longest plugin execution time (ms).
+        'queue_use': fullest queue (fraction, 0..1).
+        """
+        new_drops = self._counters is not None and counters > self._counters
+        self._counters = counters
+        too_slow = execution_time / 1000 > self.headroom * self.period
+        return new_drops or too_slow or queue_use > self.queue_limit
+
+    def update(self, published, counters, execution_time=0, queue_use=0):
+        """
+        Adjust the rate, at the end of an interval.  Return the new rate.
+
+        'published': total of frames published so far.  Other arguments
+        as :meth:`congested`.
+        """
+        now = time.monotonic()
+        elapsed = now - self._t_update
+        frames = published - self._published
+        self.achieved_rate = frames / elapsed if elapsed > 0 else 0.0
+        lagging = self.achieved_rate < self.keep_up * self.rate
+        congested = self.congested(counters, execution_time, queue_use)
+        congested = congested or lagging or self.missed > 0
+
+        if congested:
+            self.rate = max(self.min_rate, self.rate * self.decrease)
+            self.decreases += 1
+        else:
+            self.sustained_rate = max(self.sustained_rate, self.achieved_rate)
+            self.rate += self.increase
+            if self.max_rate is not None:
+                self.rate = min(self.rate, self.max_rate)
+            self.increases += 1
+        logger.debug(
+            "rate=%.1f (achieved=%.1f, missed=%d, congested=%s, sustained=%.1f)",
+            self.rate,
+            self.achieved_rate,
+            self.missed,
+            congested,
+            self.sustained_rate,
+        )
+        self._published = published
+        self.missed = 0
+        self._t_update = now
+        return self.rate
@@ -0,0 +1,67 @@
+"""
+Record the simulated stage's readback timing in a run.
+
+How closely did the simulated readbacks follow their intended timeline?
+For each positioner, one event in the 'stream' has the timing table of
+its readback updates (times relative to the first update) and the
+statistics (lag, jitter, put latency, dropped updates).  Positioners
+which do not record their timing (no ``put_timing``) are skipped.
+
+**Example**::
+
+    reset_stage_timing(xy.x, xy.y)  # before the motion
+    ...
+    yield from write_stage_timing_stream(xy.x, xy.y)  # within the run
+"""
+
+__all__ = """
+    reset_stage_timing
+    write_stage_timing_stream
+""".split()
+
+import logging
+
+from bluesky import plan_stubs as bps
+from ophyd import Signal
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_STREAM = "stage_timing"
+STATISTICS = "lag_p50 lag_p99 lag_max jitter interval_jitter latency_p99 dropped".split()
+
+
+def _timed(positioners):
+    return [p for p in positioners if getattr(p, "put_timing", None) is not None]
+
+
+def reset_stage_timing(*positioners):
+    """Forget the timing of earlier readback updates."""
+    for positioner in _timed(positioners):
+        reset = getattr(positioner, "reset_put_timing", positioner.put_timing.reset)
+        reset()  # the positioner's method also holds its lock
+
+
+def write_stage_timing_stream(*positioners, stream=DEFAULT_STREAM):
+    """Bluesky plan stub: write the readback timing, within an open run."""
+    signals = []
+    for positioner in _timed(positioners):
+        record = positioner.put_timing
+        table = record.table()
+        t0 = table["scheduled"][0] if len(record) > 0 else 0.0
+        prefix = f"{positioner.name}_timing"
+        for field, values in table.items():
+            if field != "positions":
+                values = values - t0
+            signals.append(Signal(name=f"{prefix}_{field}", value=values))
+        statistics = record.statistics()
+        for key in STATISTICS:
+            signals.append(Signal(name=f"{prefix}_{key}", value=statistics[key]))
+        logger.info("%s readback timing: %s", positioner.name, statistics)
+
+    if len(signals) == 0:
+        yield from bps.null()
+        return
+    yield from bps.create(stream)
+    for signal in signals:
+        yield from bps.read(signal)
+    yield from bps.save()
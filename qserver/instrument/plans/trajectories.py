@@ -12,10 +12,8 @@ Prepare control system for workflow 4.
 * Measurement plan streams images while moving fine positioners.
 * Analysis must examine image and metadata (for fine position), then recommend next action.
 
-Future:
-Move X & Y on non-linear path:
-- grid trajectory
-- lissajous trajectory
+Paths (``path`` argument, see ``trajectory_generators``): random (default),
+raster, snake, spiral, lissajous, rings.
 
 **Example**::
 
@@ -55,6 +53,11 @@ Move X & Y on non-linear path:
     twin1.axes.set_ylabel("X (g) & Y (r) position")
 
     run.metadata
+
+    # Or, all at once: one row per frame (counter, time, x, y, gaps)
+    from instrument.utils import correlate_frames, frame_summary
+    table = correlate_frames(run)
+    frame_summary(table)
 """
 
 __all__ = ["trajectory_plan"]
@@ -73,76 +76,20 @@ from ..devices import samplexy
 from ..devices import shutter
 from ..devices.simulated_pzt_stage import MAXIMUM_VELOCITY
 from ..qserver_framework import RE
-from bluesky import plan_stubs as bps
-from bluesky import preprocessors as bpp
-import math
-import numpy as np
-
-
-def sublists(liszt, n):
-    """Yield successive n-sized sublists from liszt."""
-    for i in range(0, len(liszt), n):
-        yield liszt[i : i + n]
-
-
-def is_odd(n):
-    return n % 2 == 1
-
-
-def create_random_grid(
-    x0, x1, y0, y1, n=25, snake=True, corners=True, sort_x_1st=True
-):
-    """
-    Create a sorted list of random X,Y positions within a region of interest.
-
-    Sort the list:
-
-    - sort on first positioner (default: X)
-    - if n>8, sort by sections (of size sqrt(n))
-      - sort each section on second positioner (default: Y) according to snake term
-    """
-
-    def sort_by_x(xy):
-        return xy[0]
-
-    def sort_by_y(xy):
-        return xy[1]
-
-    sorters = (sort_by_x, sort_by_y) if sort_x_1st else (sort_by_y, sort_by_x)
-
-    coords = []
-    nr = n
-    if corners and n >= 4:  # include the corners
-        coords += [
-            (x0, y0),
-            (x0, y1),
-            (x1, y1),
-            (x1, y0),
-        ]
-        nr -= 4
-    coords += list(
-        zip(
-            x0 + (x1 - x0) * np.random.rand(nr),
-            y0 + (y1 - y0) * np.random.rand(nr)
-        )
-    )
-    coords = sorted(coords, key=sorters[0])
-
-    if n > 8:
-        # sort by sections
-        num_in_section = int(math.sqrt(n))
-        arr = []
-        for row, chunk in enumerate(sublists(coords, num_in_section)):
-            arr += sorted(chunk, key=sorters[1], reverse=(snake and is_odd(row)))
-        coords = arr
-
-    return list(coords)
+from .trajectory_generators import create_random_grid  # was defined here
+from .trajectory_scan import trajectory_scan
 
 
 def trajectory_plan(
     x0, x1, y0, y1, n_points,
     update_period=0.01, t_exposure=0.001,
     vx=1, vy=1,
+    timing_stream=False,
+    order="snake", optimize=True, time_budget=1.0,
+    mode="step", smooth=False,
+    path="random",
+    buffered_monitors=None, monitor_options=None,
+    stage=None, detector=None,
     md=None
 ):
     """
@@ -151,7 +98,8 @@ def trajectory_plan(
     Parameters
 
     x0 float:
-        Starting X position.
+        Starting X position.  (For every 'path', the region of interest
+        is x0..x1, y0..y1.)
     x1 float:
         Ending X position.
     y0 float:
@@ -160,6 +108,9 @@ def trajectory_plan(
         Ending Y position.
     n_points int:
         Number of points.
+    path str:
+        Shape of the path: "random" (random points), "raster", "snake",
+        "spiral", "lissajous", or "rings".
     update_period float:
         Update period (s) for the readback values of the xy stage.
     t_exposure float:
@@ -168,134 +119,56 @@ def trajectory_plan(
         Velocity of X positioner (EGU/s).
     vy float:
         Velocity of Y positioner (EGU/s).
+    timing_stream bool:
+        If True, write the simulated readback timing (lag, jitter) of X
+        and Y to the ``stage_timing`` stream.
+    order str:
+        Order of the waypoints: "snake" (as generated by 'path'; random
+        points are sorted in sections of alternating direction),
+        "hilbert", or "morton" (space-filling curve, see
+        ``waypoint_ordering``).
+    optimize bool:
+        With "hilbert" or "morton" order, shorten the path by 2-opt.
+    time_budget float:
+        Time limit (s) for 'optimize'.
+    mode str:
+        "step": move to each waypoint in turn, waiting for both axes to
+        arrive.  "fly": load the whole timed path into the stage
+        simulator at once, then only monitor readbacks and detector
+        while it runs (the scan takes the pure motion time).
+    smooth bool:
+        In "fly" mode, a smooth (PVT) path through the waypoints instead
+        of straight legs.
+    buffered_monitors bool:
+        Write the monitored readbacks and counters as event pages (see
+        ``buffered_monitor``) instead of one event per update.
+        Default: True in "fly" mode, False in "step" mode.
+    monitor_options dict:
+        Options of the buffered monitors: 'page_size', 'flush_interval',
+        'min_interval', 'deadband'.
+    stage object:
+        X,Y stage to move.  Default: ``samplexy.fine``.
+    detector object:
+        Area detector.  Default: ``adsimdet``.  (The scan itself is
+        ``trajectory_scan``, which the dry run uses with virtual ones.)
 
     NOTES:
 
     * 
     """
-    if n_points < 1:
-        yield from bps.null()
-        return
-
-    det = adsimdet  # local name
-    xy = samplexy.fine
-
-    # metadata
-    _md = {
-        "detector_name": det.name,
-        "x_name": xy.x.name,
-        "y_name": xy.y.name,
-        "x_start": x0,
-        "x_end": x1,
-        "y_start": y0,
-        "y_end": y1,
-        "n_points": n_points,
-        "exposure_time": t_exposure,
-        "update_period": update_period,
-        "image mode": "Continuous",
-        "velocity_x": vx,
-        "velocity_y": vy,
-    }
-    _md.update(md or {})  # add any user metadata
-
-    originals = {}
-
-    def save_original_configurations():
-        # backup original device configurations
-        originals["xy"] = dict(xy.stage_sigs)
-        originals["det_read_attrs"] = det.read_attrs
-        originals["det"] = dict(det.stage_sigs)
-        originals["det.cam"] = dict(det.cam.stage_sigs)
-
-    def restore_original_configurations():
-        xy.stage_sigs = dict(originals["xy"])
-        det.cam.stage_sigs = dict(originals["det.cam"])
-        det.stage_sigs = dict(originals["det"])
-        det.read_attrs = originals["det_read_attrs"]
-
-    def setup_staging():
-        det.read_attrs = []
-        # det.stage_sigs["cam.image_mode"] = 2  # "Continuous"
-        det.cam.stage_sigs["acquire_time"] = t_exposure
-        det.cam.stage_sigs["acquire_period"] = update_period
-        det.cam.stage_sigs["image_mode"] = "Continuous"
-        det.cam.stage_sigs["trigger_mode"] = "Internal"
-        det.cam.stage_sigs["num_exposures"] = 1
-
-        xy.stage_sigs["x.rb_update_period"] = update_period
-        xy.stage_sigs["y.rb_update_period"] = update_period
-        if vx != 0:
-            xy.stage_sigs["x.velocity"] = vx
-        if vy != 0:
-            xy.stage_sigs["y.velocity"] = vy
-
-        # print("(DEBUG) Stage prep complete")
-        print(f"(DEBUG) det.stage_sigs={det.stage_sigs}")
-        print(f"(DEBUG) det.cam.stage_sigs={det.cam.stage_sigs}")
-        # print(f"(DEBUG) det.hdf1.stage_sigs={det.hdf1.stage_sigs}")
-        # print(f"(DEBUG) det.pva.stage_sigs={det.pva.stage_sigs}")
-
-        det.hdf1.kind = "omitted"
-        det.hdf1.disable_on_stage()
-        det.pva.enable_on_stage()
-
-    waypoints = create_random_grid(
-        x0, x1, y0, y1, n_points, snake=True, corners=True, sort_x_1st=True
-    )
-
-    # describe the trajectory scan
-    monitored_signals = [
-        xy.x.readback, xy.y.readback,
-        det.cam.array_counter, det.pva.array_counter,
-    ]
-    @bpp.stage_decorator([det, xy])
-    @bpp.monitor_during_decorator(monitored_signals)
-    @bpp.run_decorator(md=_md)
-    def execute_the_trajectory_scan():
-        # print("(DEBUG) execute_the_trajectory_scan() starting")
-        print(f"(DEBUG) det.cam.image_mode={det.cam.image_mode.get()}")
-        # print(f"(DEBUG) det.hdf1.enable={det.hdf1.enable.get()}")
-        # print(f"(DEBUG) det.pva.enable={det.pva.enable.get()}")
-        # print(f"(DEBUG) xy={xy.read()}")
-
-        # start
-        yield from bps.mv(det.cam.acquire, 1)
-        # print("images started")
-
-        # iterate over the trajectory waypoints
-        for x, y in waypoints:
-            # TODO: why not this?  yield from bps.mv(xy.x, x1, xy.y, y1)
-            # Does not catch end of motion?
-
-            yield from bps.abs_set(xy.x, x, group="motion")
-            yield from bps.abs_set(xy.y, y, group="motion")
-            # print("motion started")
-
-            # wait for motion to end, then stop AD
-            yield from bps.wait(group="motion")
-
-        yield from bps.mv(det.cam.acquire, 0)
-
-    # before we start ...
-    yield from bps.mv(
-        det.cam.acquire, 0,
-        xy.x.velocity, MAXIMUM_VELOCITY,
-        xy.y.velocity, MAXIMUM_VELOCITY,
-        det.hdf1.enable, "Disable",  # _before_ staging
-        det.pva.enable, "Enable",
-    )
-    # move to start position before running the trajectory
-    yield from bps.mv(
-        xy.x, x0,
-        xy.y, y0,
+    return (
+        yield from trajectory_scan(
+            detector or adsimdet,
+            stage or samplexy.fine,
+            x0, x1, y0, y1, n_points,
+            update_period=update_period, t_exposure=t_exposure,
+            vx=vx, vy=vy,
+            timing_stream=timing_stream,
+            order=order, optimize=optimize, time_budget=time_budget,
+            mode=mode, smooth=smooth,
+            path=path,
+            buffered_monitors=buffered_monitors, monitor_options=monitor_options,
+            max_velocity=MAXIMUM_VELOCITY,
+            md=md,
+        )
     )
-    yield from bps.sleep(0.02)  # one 60Hz clock cycle, rounded up
-
-    # proceed through these control steps
-    save_original_configurations()
-    setup_staging()
-    uids = (yield from execute_the_trajectory_scan())
-    restore_original_configurations()
-
-    return uids
-
@@ -0,0 +1,195 @@
+"""
+Parametric X,Y scan paths, computed as numpy arrays.
+
+Each generator fills the region (x0..x1, y0..y1) with about 'n_points'
+points and returns ``(times, x, y)`` arrays.  'times' (s, from the first
+point) assume X & Y move together at their velocities 'vx' & 'vy': each
+step takes ``max(|dx|/vx, |dy|/vy)``.
+
+========== ==============================================================
+name       path
+========== ==============================================================
+raster     rows, each from x0 to x1 (flyback between rows)
+snake      rows, alternating direction
+spiral     Fermat spiral from the center (even density)
+lissajous  ``sin(a*t + delta), sin(b*t)`` figure, one period
+rings      concentric rings from the center, points evenly spaced on each
+random     random points, sorted in snake sections (``create_random_grid``)
+========== ==============================================================
+
+**Example**::
+
+    times, x, y = generate_path("spiral", -500, 500, -500, 500, 10_000)
+"""
+
+__all__ = """
+    PATHS
+    create_random_grid
+    generate_path
+""".split()
+
+import logging
+import math
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+def path_times(x, y, vx=1, vy=1):
+    """Time (s, from the first point) to reach each point."""
+    steps = np.maximum(np.abs(np.diff(x)) / abs(vx), np.abs(np.diff(y)) / abs(vy))
+    return np.concatenate([[0.0], np.cumsum(steps)])
+
+
+def _rows(x0, x1, y0, y1, n_points):
+    """(columns, rows) with about 'n_points' points, spaced alike in X & Y."""
+    width, height = abs(x1 - x0), abs(y1 - y0)
+    if width == 0 or height == 0:
+        return max(n_points, 1), 1
+    rows = max(1, int(round(np.sqrt(n_points * height / width))))
+    return max(1, int(round(n_points / rows))), rows
+
+
+def _grid(x0, x1, y0, y1, n_points):
+    columns, rows = _rows(x0, x1, y0, y1, n_points)
+    x = np.tile(np.linspace(x0, x1, columns), rows).reshape(rows, columns)
+    y = np.repeat(np.linspace(y0, y1, rows), columns).reshape(rows, columns)
+    return x, y
+
+
+def raster(x0, x1, y0, y1, n_points):
+    x, y = _grid(x0, x1, y0, y1, n_points)
+    return x.ravel(), y.ravel()
+
+
+def snake(x0, x1, y0, y1, n_points):
+    x, y = _grid(x0, x1, y0, y1, n_points)
+    x[1::2] = x[1::2, ::-1]  # odd rows: reversed
+    return x.ravel(), y.ravel()
+
+
+def spiral(x0, x1, y0, y1, n_points):
+    # along the arm (r = sqrt(theta)): equal area per point, and the arms
+    # (at the edge) as far apart as the points
+    u = (np.arange(n_points) + 0.5) / n_points
+    r = np.sqrt(u)
+    theta = np.sqrt(np.pi * n_points) * u
+    return (
+        (x0 + x1) / 2 + (x1 - x0) / 2 * r * np.cos(theta),
+        (y0 + y1) / 2 + (y1 - y0) / 2 * r * np.sin(theta),
+    )
+
+
+def lissajous(x0, x1, y0, y1, n_points, a=3, b=2, delta=np.pi / 2):
+    t = np.linspace(0, 2 * np.pi, n_points)
+    return (
+        (x0 + x1) / 2 + (x1 - x0) / 2 * np.sin(a * t + delta),
+        (y0 + y1) / 2 + (y1 - y0) / 2 * np.sin(b * t),
+    )
+
+
+def rings(x0, x1, y0, y1, n_points):
+    # ring k (1..m) has about k*c points (same spacing on every ring)
+    m = max(1, int(round(np.sqrt(n_points / np.pi))))
+    c = max(1.0, 2 * (n_points - 1) / (m * (m + 1)))
+    per_ring = np.maximum(1, np.round(c * np.arange(1, m + 1))).astype(int)
+    ring = np.repeat(np.arange(1, m + 1), per_ring)
+    # position of each point on its ring: 0 .. per_ring-1
+    first = np.repeat(np.cumsum(per_ring) - per_ring, per_ring)
+    index = np.arange(ring.size) - first
+    theta = 2 * np.pi * index / per_ring[ring - 1]
+    r = np.concatenate([[0.0], ring / m])
+    theta = np.concatenate([[0.0], theta])
+    return (
+        (x0 + x1) / 2 + (x1 - x0) / 2 * r * np.cos(theta),
+        (y0 + y1) / 2 + (y1 - y0) / 2 * r * np.sin(theta),
+    )
+
+
+def sublists(liszt, n):
+    """Yield successive n-sized sublists from liszt."""
+    for i in range(0, len(liszt), n):
+        yield liszt[i : i + n]
+
+
+def is_odd(n):
+    return n % 2 == 1
+
+
+def create_random_grid(
+    x0, x1, y0, y1, n=25, snake=True, corners=True, sort_x_1st=True
+):
+    """
+    Create a sorted list of random X,Y positions within a region of interest.
+
+    Sort the list:
+
+    - sort on first positioner (default: X)
+    - if n>8, sort by sections (of size sqrt(n))
+      - sort each section on second positioner (default: Y) according to snake term
+    """
+
+    def sort_by_x(xy):
+        return xy[0]
+
+    def sort_by_y(xy):
+        return xy[1]
+
+    sorters = (sort_by_x, sort_by_y) if sort_x_1st else (sort_by_y, sort_by_x)
+
+    coords = []
+    nr = n
+    if corners and n >= 4:  # include the corners
+        coords += [
+            (x0, y0),
+            (x0, y1),
+            (x1, y1),
+            (x1, y0),
+        ]
+        nr -= 4
+    coords += list(
+        zip(
+            x0 + (x1 - x0) * np.random.rand(nr),
+            y0 + (y1 - y0) * np.random.rand(nr)
+        )
+    )
+    coords = sorted(coords, key=sorters[0])
+
+    if n > 8:
+        # sort by sections
+        num_in_section = int(math.sqrt(n))
+        arr = []
+        for row, chunk in enumerate(sublists(coords, num_in_section)):
+            arr += sorted(chunk, key=sorters[1], reverse=(snake and is_odd(row)))
+        coords = arr
+
+    return list(coords)
+
+
+def random_grid(x0, x1, y0, y1, n_points):
+    xy = np.asarray(create_random_grid(x0, x1, y0, y1, n_points), dtype=float)
+    return xy[:, 0], xy[:, 1]
+
+
+PATHS = dict(
+    raster=raster,
+    snake=snake,
+    spiral=spiral,
+    lissajous=lissajous,
+    rings=rings,
+    random=random_grid,
+)
+
+
+def generate_path(name, x0, x1, y0, y1, n_points, vx=1, vy=1, **kwargs):
+    """
+    Return ``(times, x, y)`` of path 'name' (a key of ``PATHS``).
+
+    Any 'kwargs' are parameters of that path (such as 'a', 'b', 'delta'
+    for ``lissajous``).
+    """
+    if name not in PATHS:
+        raise KeyError(f"Unknown path {name!r}.  Use one of {sorted(PATHS)}.")
+    x, y = PATHS[name](x0, x1, y0, y1, int(n_points), **kwargs)
+    return path_times(x, y, vx, vy), x, y
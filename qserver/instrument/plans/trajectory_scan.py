@@ -0,0 +1,276 @@
+"""
+The trajectory scan, on any X,Y stage and area detector.
+
+:func:`trajectory_scan` is the plan of
+:func:`~instrument.plans.trajectories.trajectory_plan` (which see for
+the parameters), with the 'detector' and the 'stage' as arguments.  It
+does not need the instrument's devices: the dry run (``dry_run``) runs
+it with virtual ones.
+
+The stage has ``x`` and ``y`` positioners (``readback``, ``velocity``
+and ``rb_update_period``; ``load_trajectory()`` for "fly" mode).  The
+detector has ``cam`` (``acquire``, ``array_counter``, ...), ``pva`` and
+``hdf1`` plugins, as ``adsimdet``.
+
+**Example**::
+
+    RE(trajectory_scan(adsimdet, samplexy.fine, -500, 500, -500, 500, 100))
+"""
+
+__all__ = """
+    trajectory_scan
+""".split()
+
+import logging
+
+import numpy as np
+from bluesky import plan_stubs as bps
+from bluesky import preprocessors as bpp
+
+try:
+    from ..devices.motion_profiles import fly_profile
+    from ..devices.status_support import wait_for_status
+    from .buffered_monitor import buffered_monitor_decorator
+    from .stage_timing import reset_stage_timing
+    from .stage_timing import write_stage_timing_stream
+    from .trajectory_generators import generate_path
+    from .waypoint_ordering import order_waypoints
+    from .waypoint_ordering import travel_time
+except ImportError:  # run as a script (by dry_run.py)
+    from motion_profiles import fly_profile
+    from status_support import wait_for_status
+    from buffered_monitor import buffered_monitor_decorator
+    from stage_timing import reset_stage_timing
+    from stage_timing import write_stage_timing_stream
+    from trajectory_generators import generate_path
+    from waypoint_ordering import order_waypoints
+    from waypoint_ordering import travel_time
+
+logger = logging.getLogger(__name__)
+
+
+def trajectory_scan(
+    detector, stage,
+    x0, x1, y0, y1, n_points,
+    update_period=0.01, t_exposure=0.001,
+    vx=1, vy=1,
+    timing_stream=False,
+    order="snake", optimize=True, time_budget=1.0,
+    mode="step", smooth=False,
+    path="random",
+    buffered_monitors=None, monitor_options=None,
+    monitors=True, max_velocity=None,
+    md=None
+):
+    """
+    Collect images from 'detector' while moving the X,Y 'stage'.
+
+    Parameters as ``trajectory_plan``, and:
+
+    monitors bool:
+        If False, write no monitor streams (only the timing matters).
+    max_velocity float:
+        Velocity of both axes while moving to the start position
+        (default: as set).
+    """
+    if n_points < 1:
+        yield from bps.null()
+        return
+    if mode not in ("step", "fly"):
+        raise ValueError(f"Unknown mode {mode!r}.  Use 'step' or 'fly'.")
+
+    det = detector  # local names
+    xy = stage
+
+    # metadata
+    _md = {
+        "detector_name": det.name,
+        "x_name": xy.x.name,
+        "y_name": xy.y.name,
+        "x_start": x0,
+        "x_end": x1,
+        "y_start": y0,
+        "y_end": y1,
+        "n_points": n_points,
+        "path": path,
+        "exposure_time": t_exposure,
+        "update_period": update_period,
+        "image mode": "Continuous",
+        "velocity_x": vx,
+        "velocity_y": vy,
+    }
+    _md.update(md or {})  # add any user metadata
+
+    originals = {}
+
+    def save_original_configurations():
+        # backup original device configurations
+        originals["xy"] = dict(xy.stage_sigs)
+        originals["det_read_attrs"] = det.read_attrs
+        originals["det"] = dict(det.stage_sigs)
+        originals["det.cam"] = dict(det.cam.stage_sigs)
+
+    def restore_original_configurations():
+        xy.stage_sigs = dict(originals["xy"])
+        det.cam.stage_sigs = dict(originals["det.cam"])
+        det.stage_sigs = dict(originals["det"])
+        det.read_attrs = originals["det_read_attrs"]
+
+    def setup_staging():
+        det.read_attrs = []
+        # det.stage_sigs["cam.image_mode"] = 2  # "Continuous"
+        det.cam.stage_sigs["acquire_time"] = t_exposure
+        det.cam.stage_sigs["acquire_period"] = update_period
+        det.cam.stage_sigs["image_mode"] = "Continuous"
+        det.cam.stage_sigs["trigger_mode"] = "Internal"
+        det.cam.stage_sigs["num_exposures"] = 1
+
+        xy.stage_sigs["x.rb_update_period"] = update_period
+        xy.stage_sigs["y.rb_update_period"] = update_period
+        if vx != 0:
+            xy.stage_sigs["x.velocity"] = vx
+        if vy != 0:
+            xy.stage_sigs["y.velocity"] = vy
+
+        # print("(DEBUG) Stage prep complete")
+        print(f"(DEBUG) det.stage_sigs={det.stage_sigs}")
+        print(f"(DEBUG) det.cam.stage_sigs={det.cam.stage_sigs}")
+        # print(f"(DEBUG) det.hdf1.stage_sigs={det.hdf1.stage_sigs}")
+        # print(f"(DEBUG) det.pva.stage_sigs={det.pva.stage_sigs}")
+
+        det.hdf1.kind = "omitted"
+        det.hdf1.disable_on_stage()
+        det.pva.enable_on_stage()
+
+    # "random": sorted in snake sections, with the corners
+    _t, path_x, path_y = generate_path(path, x0, x1, y0, y1, n_points)
+    waypoints = np.column_stack([path_x, path_y])
+    # 0: velocity not changed, weigh the axes equally
+    speeds = dict(vx=abs(vx) or 1, vy=abs(vy) or 1)
+    _md["waypoint_order"] = order
+    _md["travel_time_path"] = travel_time(waypoints, start=(x0, y0), **speeds)
+    if order != "snake":
+        waypoints, report = order_waypoints(
+            waypoints,
+            curve=order,
+            improve=optimize,
+            time_budget=time_budget,
+            start=(x0, y0),
+            **speeds,
+        )
+        _md["waypoint_optimize"] = optimize
+        _md["waypoint_optimize_time"] = report["optimize_time"]
+    _md["travel_time_estimate"] = travel_time(waypoints, start=(x0, y0), **speeds)
+
+    _md["trajectory_mode"] = mode
+    if mode == "fly":
+        if not hasattr(xy, "load_trajectory"):
+            raise TypeError(f"{xy.name} cannot run a fly trajectory.")
+        fly_times, fly_x, fly_y = fly_profile(
+            np.vstack([[x0, y0], waypoints]),
+            vx or xy.x.velocity.get(),
+            vy or xy.y.velocity.get(),
+            smooth=smooth,
+            period=update_period,
+        )
+        _md["fly_smooth"] = smooth
+        _md["fly_motion_time"] = float(fly_times[-1])
+
+    def run_the_fly_trajectory():
+        # The trajectory drives only the readbacks: set the setpoints to
+        # the final waypoint so they are not stale (and 'done' follows the
+        # readbacks to the end).  A stop() holds the setpoints where stopped.
+        yield from bps.mv(xy.x.setpoint, fly_x[-1], xy.y.setpoint, fly_y[-1])
+
+        # whole path in one upload, then only the monitors report
+        status = xy.load_trajectory(fly_times, fly_x, fly_y)
+
+        def stop_unfinished_motion():
+            if not status.done:
+                xy.x.stop()
+                xy.y.stop()
+            yield from bps.null()
+
+        yield from bpp.finalize_wrapper(
+            wait_for_status(status), stop_unfinished_motion()
+        )
+        if not status.success:
+            raise status.exception()
+
+    # describe the trajectory scan
+    monitored_signals = [
+        xy.x.readback, xy.y.readback,
+        det.cam.array_counter, det.pva.array_counter,
+    ]
+    if buffered_monitors is None:
+        buffered_monitors = mode == "fly"
+    _md["buffered_monitors"] = buffered_monitors and monitors
+
+    if not monitors:
+        monitor_during = bpp.monitor_during_decorator([])
+    elif buffered_monitors:
+        monitor_during = buffered_monitor_decorator(
+            monitored_signals, **(monitor_options or {})
+        )
+    else:
+        monitor_during = bpp.monitor_during_decorator(monitored_signals)
+
+    @bpp.stage_decorator([det, xy])
+    @monitor_during
+    @bpp.run_decorator(md=_md)
+    def execute_the_trajectory_scan():
+        # print("(DEBUG) execute_the_trajectory_scan() starting")
+        print(f"(DEBUG) det.cam.image_mode={det.cam.image_mode.get()}")
+        # print(f"(DEBUG) det.hdf1.enable={det.hdf1.enable.get()}")
+        # print(f"(DEBUG) det.pva.enable={det.pva.enable.get()}")
+        # print(f"(DEBUG) xy={xy.read()}")
+
+        # start
+        reset_stage_timing(xy.x, xy.y)
+        yield from bps.mv(det.cam.acquire, 1)
+        # print("images started")
+
+        if mode == "fly":
+            yield from run_the_fly_trajectory()
+        else:
+            # iterate over the trajectory waypoints
+            for x, y in waypoints:
+                # TODO: why not this?  yield from bps.mv(xy.x, x1, xy.y, y1)
+                # Does not catch end of motion?
+
+                yield from bps.abs_set(xy.x, x, group="motion")
+                yield from bps.abs_set(xy.y, y, group="motion")
+                # print("motion started")
+
+                # wait for motion to end, then stop AD
+                yield from bps.wait(group="motion")
+
+        yield from bps.mv(det.cam.acquire, 0)
+        if timing_stream:
+            yield from write_stage_timing_stream(xy.x, xy.y)
+
+    # before we start ...
+    fastest = []
+    if max_velocity is not None:
+        fastest = [xy.x.velocity, max_velocity, xy.y.velocity, max_velocity]
+    yield from bps.mv(
+        det.cam.acquire, 0,
+        *fastest,
+        det.hdf1.enable, "Disable",  # _before_ staging
+        det.pva.enable, "Enable",
+    )
+    # move to start position before running the trajectory
+    yield from bps.mv(
+        xy.x, x0,
+        xy.y, y0,
+    )
+    yield from bps.sleep(0.02)  # one 60Hz clock cycle, rounded up
+
+    # proceed through these control steps
+    save_original_configurations()
+    setup_staging()
+    uids = (yield from execute_the_trajectory_scan())
+    restore_original_configurations()
+
+    return uids
+
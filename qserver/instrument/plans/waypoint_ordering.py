@@ -0,0 +1,173 @@
+"""
+Order X,Y waypoints to shorten the time spent moving between them.
+
+X and Y move at the same time (each at its own velocity), so the time
+of one move is ``max(|dx|/vx, |dy|/vy)``.  Waypoints are first ordered
+along a space-filling curve (``hilbert`` or ``morton``) in those time
+units, then (optionally) improved by 2-opt: reverse any part of the
+path which makes it quicker, until none does or the time budget is used.
+
+**Example**::
+
+    ordered, report = order_waypoints(waypoints, vx=2, vy=1, start=(x0, y0))
+    print(report["travel_time_before"], report["travel_time_after"])
+"""
+
+__all__ = """
+    order_waypoints
+    travel_time
+""".split()
+
+import logging
+import time
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+CURVES = "hilbert morton".split()
+CURVE_BITS = 16  # resolution of the space-filling curve, per axis
+DEFAULT_TIME_BUDGET = 1.0  # s, for 2-opt
+
+
+def _as_times(xy, vx, vy):
+    """Scale (N, 2) positions into (N, 2) travel times."""
+    return np.asarray(xy, dtype=float) / np.array([abs(vx), abs(vy)])
+
+
+def _leg_times(a, b):
+    """Time of each move from a[k] to b[k] (arrays already in time units)."""
+    return np.abs(a - b).max(axis=-1)
+
+
+def travel_time(waypoints, vx=1, vy=1, start=None):
+    """Total time (s) to move through 'waypoints' (from 'start', if given)."""
+    t = _as_times(waypoints, vx, vy).reshape(-1, 2)
+    if start is not None:
+        t = np.vstack([_as_times([start], vx, vy), t])
+    return float(_leg_times(t[:-1], t[1:]).sum())
+
+
+def _grid(t, bits):
+    """Map (N, 2) coordinates onto integers 0 .. 2**bits - 1 (same scale)."""
+    low = t.min(axis=0)
+    span = max((t.max(axis=0) - low).max(), 1e-300)
+    return ((t - low) / span * (2**bits - 1)).astype(np.int64)
+
+
+def morton_keys(t, bits=CURVE_BITS):
+    """Z-order key of each point: interleaved bits of x & y."""
+    g = _grid(t, bits)
+    keys = np.zeros(len(g), dtype=np.int64)
+    for bit in range(bits):
+        keys |= ((g[:, 0] >> bit) & 1) << (2 * bit)
+        keys |= ((g[:, 1] >> bit) & 1) << (2 * bit + 1)
+    return keys
+
+
+def hilbert_keys(t, bits=CURVE_BITS):
+    """Hilbert curve distance of each point (vectorised xy -> d)."""
+    g = _grid(t, bits)
+    x, y = g[:, 0].copy(), g[:, 1].copy()
+    keys = np.zeros(len(g), dtype=np.int64)
+    s = 1 << (bits - 1)
+    while s > 0:
+        rx = (x & s) > 0
+        ry = (y & s) > 0
+        keys += s * s * ((3 * rx) ^ ry)
+        # rotate the quadrant
+        flip = ~ry & rx
+        x = np.where(flip, s - 1 - x, x)
+        y = np.where(flip, s - 1 - y, y)
+        swap = ~ry
+        x, y = np.where(swap, y, x), np.where(swap, x, y)
+        s >>= 1
+    return keys
+
+
+def two_opt(t, order, time_budget=DEFAULT_TIME_BUDGET):
+    """
+    Improve a path (first point fixed, last point free) by 2-opt.
+
+    For each leg (i, i+1), the gains of reversing ``order[i+1 : j+1]``
+    are computed for all j at once; the best is applied.  Returns
+    (order, passes).
+    """
+    order = np.array(order)
+    n = len(order)
+    deadline = time.monotonic() + time_budget
+    passes = 0
+    improved = True
+    while improved and time.monotonic() < deadline:
+        improved = False
+        passes += 1
+        for i in range(n - 2):
+            p = t[order]
+            a, b = p[i], p[i + 1]
+            c = p[i + 2 :]  # new neighbour of a: order[j], j = i+2 .. n-1
+            d = p[i + 3 :]  # order[j+1] (none for the last point)
+            old = _leg_times(a, b) + np.append(_leg_times(c[:-1], d), 0.0)
+            new = _leg_times(a, c) + np.append(_leg_times(b, d), 0.0)
+            gain = old - new
+            k = int(np.argmax(gain))
+            if gain[k] > 1e-12:
+                j = i + 2 + k
+                order[i + 1 : j + 1] = order[i + 1 : j + 1][::-1]
+                improved = True
+            if time.monotonic() >= deadline:
+                break
+    return order, passes
+
+
+def order_waypoints(
+    waypoints,
+    vx=1,
+    vy=1,
+    curve="hilbert",
+    improve=True,
+    time_budget=DEFAULT_TIME_BUDGET,
+    start=None,
+):
+    """
+    Order 'waypoints' (list of (x, y)) for a quicker path.
+
+    'start' (x, y): where the stage is before the first waypoint (the
+    path begins there).  Returns (ordered waypoints, report dict with the
+    estimated ``travel_time_before`` and ``travel_time_after``, s).
+    """
+    if curve not in CURVES:
+        raise ValueError(f"Unknown curve {curve!r}.  Use one of {CURVES}.")
+    xy = np.asarray(waypoints, dtype=float).reshape(-1, 2)
+    report = dict(
+        curve=curve,
+        improve=improve,
+        travel_time_before=travel_time(xy, vx, vy, start),
+    )
+    if len(xy) < 3:
+        report["travel_time_after"] = report["travel_time_before"]
+        return [tuple(p) for p in xy], report
+
+    t = _as_times(xy, vx, vy)
+    if start is not None:  # fixed first point of the path
+        t = np.vstack([_as_times([start], vx, vy), t])
+    keys = (hilbert_keys if curve == "hilbert" else morton_keys)(t)
+    if start is not None:
+        keys[0] = -1  # stays first
+    order = np.argsort(keys, kind="stable")
+
+    t0 = time.monotonic()
+    if improve:
+        order, report["two_opt_passes"] = two_opt(t, order, time_budget)
+    report["optimize_time"] = time.monotonic() - t0
+    if start is not None:
+        order = order[1:] - 1  # without the start point
+
+    ordered = xy[order]
+    report["travel_time_after"] = travel_time(ordered, vx, vy, start)
+    logger.info(
+        "Waypoint travel time: %.3f s -> %.3f s (%s)",
+        report["travel_time_before"],
+        report["travel_time_after"],
+        curve,
+    )
+    return [tuple(p) for p in ordered], report
@@ -3,3 +3,4 @@ Python utility code that does not define devices or plans.
 """
 
 from .reporting import *
+from .run_correlation import *
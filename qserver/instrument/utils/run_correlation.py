@@ -0,0 +1,177 @@
+"""
+Correlate the frames of a trajectory run with the stage positions.
+
+A ``trajectory_plan`` run records monitor streams: the X & Y readbacks
+and the detector's cam & PVA array counters, each at its own times.
+:func:`correlate_frames` aligns them by timestamp (``np.searchsorted``
+and interpolation) into one table, one row per frame received (by the
+PVA plugin):
+
+=========== ==============================================================
+field       value
+=========== ==============================================================
+frame       PVA array counter
+time        when the frame was received (s, epoch; PVA counter timestamp)
+x, y        stage position at that time (interpolated from the readbacks)
+missing     frames (counter values) not seen since the previous row
+cam_ahead   frames acquired (cam counter) but not (yet) received by PVA
+=========== ==============================================================
+
+The table is cached next to the run: in the directory of the run's
+(first) resource file, such as its HDF5 image file, as
+``<uid>_<signals>.npz``.  So it is computed once per run, for anyone
+reading that run's data.  When the run has no resource files (such as,
+no file plugin enabled) or that directory is not writable, the table is
+cached in ``~/.cache/bdp_controls/runs/`` instead (on this host only).
+
+**Example**::
+
+    table = correlate_frames(cat[-1])
+    print(frame_summary(table))
+    plot(table["x"], table["y"], ".")
+"""
+
+__all__ = """
+    correlate_frames
+    frame_summary
+""".split()
+
+import logging
+import pathlib
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+CACHE_DIR = pathlib.Path.home() / ".cache" / "bdp_controls" / "runs"
+FRAME_TABLE_DTYPE = np.dtype(
+    [
+        ("frame", "i8"),
+        ("time", "f8"),
+        ("x", "f8"),
+        ("y", "f8"),
+        ("missing", "i8"),
+        ("cam_ahead", "i8"),
+    ]
+)
+
+
+def _monitor(run, name):
+    """Return (times, values) arrays of the monitor stream of signal 'name'."""
+    stream = f"{name}_monitor"
+    if stream not in run:
+        raise KeyError(f"Run has no {stream!r} stream.  Streams: {list(run)}")
+    values = run[stream].read()[name].values
+    # the signal's own timestamps: event (page) times are when the
+    # documents were made, not when the values changed
+    times = run[stream].timestamps.read()[name].values
+    return np.asarray(times, dtype=float), np.asarray(values)
+
+
+def _signal_names(run, detector, x, y):
+    """Names of the monitored signals, from the run's metadata by default."""
+    md = run.metadata["start"]
+    detector = detector or md.get("detector_name", "adsimdet")
+    return dict(
+        x=x or md.get("x_name", "fastxy_x"),
+        y=y or md.get("y_name", "fastxy_y"),
+        cam=f"{detector}_cam_array_counter",
+        pva=f"{detector}_pva_array_counter",
+    )
+
+
+def _run_directory(run):
+    """Directory of the run's (first) resource file, or None."""
+    for stream in run:
+        try:
+            resources = run[stream]._get_resources()
+        except Exception as exc:
+            logger.debug("No resources from stream %r: %s", stream, exc)
+            continue
+        for r in resources:
+            return (pathlib.Path(r["root"]) / r["resource_path"]).parent
+    return None
+
+
+def _cache_files(run, names):
+    """Cache file candidates: next to the run's files, then CACHE_DIR."""
+    key = "_".join(names[k] for k in sorted(names))
+    fname = f"{run.metadata['start']['uid']}_{key}.npz"
+    directories = [_run_directory(run), CACHE_DIR]
+    return [path / fname for path in directories if path is not None]
+
+
+def _value_at(times, values, t):
+    """Most recent value (at or before each of times 't')."""
+    i = np.searchsorted(times, t, side="right") - 1
+    return values[np.clip(i, 0, len(values) - 1)]
+
+
+def correlate_frames(run, detector=None, x=None, y=None, cache=True, refresh=False):
+    """
+    Per-frame table (structured array) of a trajectory run.
+
+    'run' is a databroker run (or its uid or scan_id, from the catalog).
+    Signal names default to those in the run's metadata.  With 'cache',
+    reuse (or save) the table next to the run's files (or, failing
+    that, in ``CACHE_DIR``); 'refresh' recomputes it.
+    """
+    if not hasattr(run, "metadata"):
+        from ..qserver_framework import cat
+
+        run = cat[run]
+    names = _signal_names(run, detector, x, y)
+    cache_files = _cache_files(run, names) if cache else []
+    for cache_file in cache_files:
+        if not refresh and cache_file.exists():
+            return np.load(cache_file)["table"]
+
+    pva_t, pva = _monitor(run, names["pva"])
+    cam_t, cam = _monitor(run, names["cam"])
+    x_t, x_rbv = _monitor(run, names["x"])
+    y_t, y_rbv = _monitor(run, names["y"])
+    for t in (pva_t, cam_t, x_t, y_t):  # monitors arrive in time order
+        if np.any(np.diff(t) < 0):
+            raise ValueError("Monitor times are not in order.")
+
+    # each PVA counter update is a frame received; the first is the baseline
+    pva = pva.astype(np.int64)
+    new = np.flatnonzero(np.diff(pva) > 0) + 1
+    table = np.zeros(len(new), dtype=FRAME_TABLE_DTYPE)
+    table["frame"] = pva[new]
+    table["time"] = pva_t[new]
+    table["x"] = np.interp(pva_t[new], x_t, x_rbv.astype(float))
+    table["y"] = np.interp(pva_t[new], y_t, y_rbv.astype(float))
+    table["missing"] = np.diff(pva[np.append(0, new)]) - 1
+
+    # relative to the counters at the start of the run
+    cam = cam.astype(np.int64)
+    cam_now = _value_at(cam_t, cam, pva_t[new]) - _value_at(cam_t, cam, pva_t[0])
+    table["cam_ahead"] = cam_now - (pva[new] - pva[0])
+
+    for cache_file in cache_files:
+        try:
+            cache_file.parent.mkdir(parents=True, exist_ok=True)
+            np.savez(cache_file, table=table)
+            break
+        except OSError as exc:
+            logger.warning("Cannot cache frame table in '%s': %s", cache_file, exc)
+    return table
+
+
+def frame_summary(table):
+    """Summary (dict) of a per-frame table: counts, gaps, rate, extent."""
+    n = len(table)
+    duration = float(table["time"][-1] - table["time"][0]) if n > 1 else 0.0
+    missing = int(table["missing"].sum()) if n else 0
+    return dict(
+        frames=n,
+        gaps=int(np.count_nonzero(table["missing"])) if n else 0,
+        missing=missing,
+        missing_fraction=missing / (n + missing) if n + missing else 0.0,
+        cam_ahead_max=int(table["cam_ahead"].max()) if n else 0,
+        duration=duration,
+        frame_rate=(n - 1) / duration if duration > 0 else 0.0,
+        x_range=(float(table["x"].min()), float(table["x"].max())) if n else None,
+        y_range=(float(table["y"].min()), float(table["y"].max())) if n else None,
+    )